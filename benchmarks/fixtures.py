@@ -0,0 +1,115 @@
+import os
+import numpy as np
+import pandas as pd
+import common
+import build_rustbca_input_files as builder
+
+
+"""
+Deterministic synthetic inputs for the benchmarks. Every fixture is generated
+from a fixed seed, so the same size always produces the same data, and none
+of them need the real SOLPS data, hPIC results or RustBCA.
+"""
+
+_SEED = 0
+
+# Fixture sizes, selected with run_benchmarks.py --size
+SIZES = {
+    'small': {
+        'solps_rows': 200,
+        'hpic_log_lines': 20000,
+        'sputtered_rows': 100000,
+    },
+    'large': {
+        'solps_rows': 5000,
+        'hpic_log_lines': 1000000,
+        'sputtered_rows': 5000000,
+    },
+}
+
+
+def make_solps_data(nrows):
+    """
+    A SOLPS frame with the columns the pipeline reads (see
+    common._columns_of_interest), with plausible values. Rows are 1 mm
+    apart, so every row gets its own hPIC simulation ID.
+    """
+    rng = np.random.default_rng(_SEED)
+    data = {
+        'L-Lsep (m)': -0.1396 + 0.001 * np.arange(nrows),
+        'Te (eV)': rng.uniform(0.3, 50.0, nrows),
+        'Ti (eV)': rng.uniform(0.3, 50.0, nrows),
+        '|B| (T)': rng.uniform(5.0, 10.0, nrows),
+        'Bangle (deg)': rng.uniform(1.0, 10.0, nrows),
+    }
+    for ion in common._all_ions:
+        data[ion] = 10**rng.uniform(11.0, 16.0, nrows)
+    data['nD+1'] = 10**rng.uniform(19.0, 21.0, nrows)
+    return pd.DataFrame(data)
+
+
+def write_solps_data(filename, nrows):
+    make_solps_data(nrows).to_csv(filename, index = False)
+
+
+def make_IEAD():
+    """
+    A 240 x 90 IEAD (energies x angles) of integer counts, peaked at a few Te
+    and moderate angles like the hPIC ones.
+    """
+    rng = np.random.default_rng(_SEED)
+    E, A = np.meshgrid(np.arange(240), np.arange(90), indexing = 'ij')
+    expected = 2e3 * np.exp(-((E - 40) / 25.)**2 - ((A - 30) / 20.)**2)
+    return rng.poisson(expected).astype(float)
+
+
+def write_hpic_log(filename, nlines, p2c = 1.23456e+08):
+    """
+    An hPIC STDOUT log with nlines of per-step output, and the p2c line near
+    the end, where find_p2c_values.find_p2c_value has to scan furthest.
+    """
+    with open(filename, 'w') as f:
+        for step in range(nlines):
+            f.write(f'step {step:10d}  time = {step * 1e-9:.6e}  particles = {1000000 + step}\n')
+            if step == nlines - 10:
+                f.write(f'p2c     = {p2c:.5e}\tPhysical-to-Computational ratio\n')
+
+
+def write_sputtered_output(filename, nrows, ntags = 500):
+    """
+    A RustBCA sputtered.output of nrows lithium atoms, with z-offsets of
+    importance-sampled IEAD bins (see build_rustbca_input_files.STRATUM_Z_SPACING).
+    """
+    rng = np.random.default_rng(_SEED)
+    chunk_rows = 1000000
+    with open(filename, 'w') as f:
+        for start in range(0, nrows, chunk_rows):
+            n = min(chunk_rows, nrows - start)
+            rows = np.empty((n, 9))
+            rows[:, 0] = builder.Lithium['mass']
+            rows[:, 1] = builder.Lithium['Z']
+            rows[:, 2] = rng.exponential(5.0, n)
+            rows[:, 3] = -builder.TARGET_LENGTH / 2
+            rows[:, 4] = rng.uniform(-1.0, 0.0, n)
+            rows[:, 5] = rng.integers(0, ntags, n) * builder.STRATUM_Z_SPACING + rng.normal(0, 0.01, n)
+            rows[:, 6:9] = rng.normal(size = (n, 3))
+            np.savetxt(f, rows, delimiter = ',', fmt = '%.8e')
+
+
+def make_fixtures(dirname, size):
+    """
+    Write every file fixture of a given size to dirname.
+    :returns: dictionary of fixture name -> filename (or object)
+    """
+    sizes = SIZES[size]
+    fixtures = {
+        'solps_data': os.path.join(dirname, 'solps.csv'),
+        'hpic_log': os.path.join(dirname, 'hpic.log'),
+        'sputtered_output': os.path.join(dirname, 'sputtered.output'),
+    }
+    write_solps_data(fixtures['solps_data'], sizes['solps_rows'])
+    write_hpic_log(fixtures['hpic_log'], sizes['hpic_log_lines'])
+    write_sputtered_output(fixtures['sputtered_output'], sizes['sputtered_rows'])
+    fixtures['IEAD'] = make_IEAD()
+    fixtures['strata_weights'] = np.ones(500)
+    return fixtures
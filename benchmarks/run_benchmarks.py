@@ -0,0 +1,227 @@
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import util
+import common
+import configure_simulations
+import plasma_parameters
+import build_rustbca_input_files as builder
+import find_p2c_values
+import physical_sputtering_amount
+import finalize_rustbca_outputs
+import fixtures
+
+
+"""
+Micro-benchmarks of the pipeline's hot functions on synthetic fixtures (see
+fixtures.py). Runs offline, without SOLPS data, hPIC or RustBCA.
+
+Each benchmark is timed over several repeats (the median is reported) and
+run once more under tracemalloc for its peak Python memory. Results are
+compared against benchmarks/baselines.json, and a benchmark whose median
+time or peak memory grew by more than the threshold is flagged as a
+regression (exit code 1).
+
+usage: python benchmarks/run_benchmarks.py [--size small|large] [--repeat N]
+           [--threshold FRACTION] [--save-baseline] [BENCHMARK...]
+"""
+
+_BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+_REPEAT = 5
+_THRESHOLD = 0.25
+
+
+def bench_load_solps_data(f, workdir):
+    util.load_solps_data(f['solps_data'])
+
+
+def bench_format_hPIC_command(f, workdir):
+    df = f['solps_df']
+    ion_list = sorted(common._ions_of_interest.keys())
+    for _, row in df.iterrows():
+        configure_simulations.format_hPIC_command(row, 'bench', {}, 10, ion_list)
+
+
+def bench_plasma_parameters(f, workdir):
+    df = f['solps_df']
+    plasma_parameters.gyroradius_for_row(df)
+    plasma_parameters.compute_debye_length_for_row(df)
+
+def bench_particle_parameters_uniform(f, workdir):
+    starts, directions = builder.get_IEAD_particle_starts_and_directions()
+    factor = np.ceil(builder.HIGH_RESOLUTION_N / np.sum(f['IEAD']))
+    builder.get_particle_parameters_from_IEAD(
+        f['IEAD'], 5.0, builder.Deuterium, starts, directions, factor = factor,
+    )
+
+
+def bench_particle_parameters_importance(f, workdir):
+    starts, directions = builder.get_IEAD_particle_starts_and_directions()
+    counts, _ = builder.get_importance_sampled_counts(
+        f['IEAD'],
+        builder.get_incident_energies(5.0),
+        builder.Deuterium,
+        1.0,
+        N_total = builder.IMPORTANCE_SAMPLING_N,
+    )
+    builder.get_particle_parameters_from_IEAD(
+        f['IEAD'], 5.0, builder.Deuterium, starts, directions, counts = counts,
+    )
+
+
+def bench_generate_rustbca_input(f, workdir):
+    starts, directions = builder.get_IEAD_particle_starts_and_directions()
+    particle_parameters = builder.get_particle_parameters_from_IEAD(
+        f['IEAD'], 5.0, builder.Deuterium, starts, directions, factor = 1,
+    )
+    builder.generate_rustbca_input(
+        'bench/',
+        particle_parameters,
+        100,
+        12,
+        os.path.join(workdir, 'input.toml'),
+    )
+
+
+def bench_find_p2c_value(f, workdir):
+    assert find_p2c_values.find_p2c_value(f['hpic_log']) is not None
+
+
+def bench_count_sputtered_text(f, workdir):
+    physical_sputtering_amount.count_sputtered(f['sputtered_output'], f['strata_weights'])
+
+
+def bench_count_sputtered_columnar(f, workdir):
+    physical_sputtering_amount.count_sputtered(f['columnar_output'], f['strata_weights'])
+
+
+BENCHMARKS = {
+    'load_solps_data': bench_load_solps_data,
+    'format_hPIC_command': bench_format_hPIC_command,
+    'plasma_parameters': bench_plasma_parameters,
+    'particle_parameters_uniform': bench_particle_parameters_uniform,
+    'particle_parameters_importance': bench_particle_parameters_importance,
+    'generate_rustbca_input': bench_generate_rustbca_input,
+    'find_p2c_value': bench_find_p2c_value,
+    'count_sputtered_text': bench_count_sputtered_text,
+    'count_sputtered_columnar': bench_count_sputtered_columnar,
+}
+
+
+def run_benchmark(bench, f, workdir, repeat):
+    """
+    :returns: {'median_s', 'min_s', 'peak_bytes'}
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        bench(f, workdir)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    bench(f, workdir)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'median_s': float(np.median(timings)),
+        'min_s': float(np.min(timings)),
+        'peak_bytes': int(peak),
+    }
+
+
+def find_regressions(result, baseline, threshold):
+    regressions = []
+    for key in ('median_s', 'peak_bytes'):
+        if baseline.get(key) and result[key] > baseline[key] * (1 + threshold):
+            regressions.append(f'{key} {baseline[key]:.4g} -> {result[key]:.4g}')
+    return regressions
+
+
+def load_baselines():
+    if not os.path.exists(_BASELINES_FILE):
+        return {}
+    with open(_BASELINES_FILE, 'r') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the pipeline hot functions.')
+    parser.add_argument('benchmarks', nargs = '*', help = f'default: all of {", ".join(BENCHMARKS)}')
+    parser.add_argument('--size', choices = sorted(fixtures.SIZES), default = 'small')
+    parser.add_argument('--repeat', type = int, default = _REPEAT)
+    parser.add_argument('--threshold', type = float, default = _THRESHOLD,
+        help = 'fractional slowdown / memory growth flagged as a regression')
+    parser.add_argument('--save-baseline', action = 'store_true',
+        help = f'store these results in {os.path.basename(_BASELINES_FILE)}')
+    args = parser.parse_args()
+
+    names = args.benchmarks or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark "{name}"')
+
+    baselines = load_baselines()
+    size_baselines = baselines.setdefault(args.size, {})
+
+    regressed = []
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f'generating {args.size} fixtures...')
+        f = fixtures.make_fixtures(workdir, args.size)
+        f['solps_df'] = util.load_solps_data(f['solps_data'])
+
+        # The columnar benchmark reads a finalized copy of sputtered.output
+        columnar_dir = os.path.join(workdir, 'columnar')
+        os.makedirs(columnar_dir)
+        f['columnar_output'] = os.path.join(columnar_dir, 'sputtered.output')
+        os.link(f['sputtered_output'], f['columnar_output'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            finalize_rustbca_outputs.finalize_simulation(columnar_dir)
+
+        print(f'{"benchmark":<32} {"median (s)":>12} {"min (s)":>12} {"peak (MB)":>10}  vs baseline')
+        for name in names:
+            # Keep the functions' own progress messages out of the table
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run_benchmark(BENCHMARKS[name], f, workdir, args.repeat)
+
+            baseline = size_baselines.get(name)
+            if baseline is None:
+                status = 'no baseline'
+            else:
+                regressions = find_regressions(result, baseline, args.threshold)
+                ratio = result['median_s'] / baseline['median_s']
+                status = f'{ratio:.2f}x time'
+                if regressions:
+                    status += '  REGRESSION: ' + ', '.join(regressions)
+                    regressed.append(name)
+            print(
+                f'{name:<32} {result["median_s"]:>12.4f} {result["min_s"]:>12.4f} '
+                + f'{result["peak_bytes"] / 1e6:>10.1f}  {status}'
+            )
+
+            if args.save_baseline:
+                size_baselines[name] = result
+
+    if args.save_baseline:
+        with open(_BASELINES_FILE, 'w') as fh:
+            json.dump(baselines, fh, indent = 4, sort_keys = True)
+        print(f'saved baselines to {_BASELINES_FILE}')
+
+    if regressed:
+        print(f'{len(regressed)} regression(s): {", ".join(regressed)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+_BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+_REPO_DIR = os.path.dirname(_BENCHMARKS_DIR)
+_SCRIPTS_DIR = os.path.join(_REPO_DIR, 'scripts')
+sys.path.insert(0, _SCRIPTS_DIR)
+
+import util
+import common
+import fixtures
+import build_rustbca_input_files as builder
+
+
+"""
+End-to-end scale test. Synthesizes a whole campaign at a chosen scale in a
+scratch directory and runs the real pipeline scripts on it, stage by stage:
+
+    pushes      configure_simulations.py configure-total-pushes-script, then
+                the generated get_total_pushes.sh
+    assign      assign_workloads.py total_pushes.csv
+    configure   configure_simulations.py
+    hpic        every generated per-simulation script
+    p2c         find_p2c_values.py
+    build       build_rustbca_input_files.py, once per SBE
+    verify      verify_total_counts.py
+    rustbca     stub RustBCA over every input file
+    reduce      reduce_rustbca_outputs.py
+    sputtering  physical_sputtering_amount.py all
+
+hPIC and RustBCA are replaced by stubs: the hPIC stub prints a p2c line and a
+particle push count and drops synthetic IEADs in its output directory, and
+the RustBCA stub writes a synthetic sputtered.output next to every input.
+
+Each stage runs as its own process. Its wall time and peak RSS (the largest
+resident set of any single process in the stage) are reported, and the run
+stops at the first stage that fails. The peak RSS is read by a small
+wrapper interpreter that starts the stage (see _RSS_WRAPPER): a process
+started by the harness itself would report the harness's own peak, which
+it inherits across fork.
+
+--scale 1 is roughly a real campaign (72 hPIC runs, 4 species, so ~300
+RustBCA runs per SBE).
+
+usage: python benchmarks/scale_harness.py [--scale N] [--sbe low high]
+           [--sputtered-rows N] [--stages STAGE...] [--keep DIR]
+"""
+
+# SOLPS rows per strike point at --scale 1 (36 + 36 = 72 hPIC simulations)
+_SOLPS_ROWS = 36
+
+# Rows of each stub sputtered.output
+_SPUTTERED_ROWS = 10000
+
+STAGES = [
+    'pushes',
+    'assign',
+    'configure',
+    'hpic',
+    'p2c',
+    'build',
+    'verify',
+    'rustbca',
+    'reduce',
+    'sputtering',
+]
+
+# Runs a command and writes the peak RSS of its processes (ru_maxrss of the
+# wrapper's children, in kilobytes on Linux) to a file. The wrapper's own
+# small footprint (~10 MB) is the floor of every measurement.
+_RSS_WRAPPER = '''
+import sys, resource, subprocess
+status = subprocess.call(sys.argv[2], shell = True)
+with open(sys.argv[1], 'w') as f:
+    f.write(str(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+sys.exit(status if status >= 0 else 128 - status)
+'''
+
+_RSS_FILENAME = 'peak_rss'
+
+# Stands in for hPIC. The first argument after -command_line is the SimID;
+# the prelim script reads the push count from the last line. The PHI output
+# gives the generated scripts' pruning (hpic_output) something to prune.
+_HPIC_STUB = r'''#!/bin/sh
+for f in "$HPIC_STUB_IEAD_DIR"/IEAD_sp*.dat; do
+    cp "$f" "${2}_$(basename $f)"
+done
+head -c 1000000 /dev/zero > "${2}_PHI.dat"
+printf 'p2c     = 1.23456e+08\tPhysical-to-Computational ratio\n'
+echo $((1000000000 + $(echo "$*" | cksum | cut -d' ' -f1) % 1000000000))
+'''
+
+# Stands in for RustBCA, over every input file of the campaign in one process
+_RUSTBCA_STUB = r'''import glob
+import os
+import shutil
+import sys
+
+template = sys.argv[1]
+for input_file in glob.glob('rustbca_simulations/SBE*/*/*input.toml'):
+    shutil.copyfile(template, os.path.join(os.path.dirname(input_file), 'sputtered.output'))
+'''
+
+
+def write_campaign(campaign_dir, scale, sputtered_rows):
+    """
+    Lay out the inputs of a synthetic campaign: SOLPS data, config, the
+    hPIC/RustBCA stubs and the metadata CSVs the scripts expect.
+    """
+    nrows = int(_SOLPS_ROWS * scale)
+    for label, datafile in common.DATAFILES.items():
+        filename = os.path.join(campaign_dir, datafile)
+        util.mkdir(os.path.dirname(filename))
+        fixtures.write_solps_data(filename, nrows)
+
+    shutil.copyfile(
+        os.path.join(_REPO_DIR, common._CONFIG_FILENAME),
+        os.path.join(campaign_dir, common._CONFIG_FILENAME),
+    )
+    for dirname in ('hpic_results', 'rustbca_simulations', 'rustbca_conversion_factors'):
+        util.mkdir(os.path.join(campaign_dir, dirname))
+
+    # The generated scripts call hPIC through ~/..., so HOME points at the
+    # campaign's own home directory with the stub in every place looked up.
+    home = os.path.join(campaign_dir, 'home')
+    stub_dir = os.path.join(campaign_dir, 'stubs')
+    util.mkdir(stub_dir)
+    for hpic_exec in ('hPIC/hpic_1d3v/hpic', 'hPIC-mikhail/hpic_1d3v/hpic', 'bin/hpic'):
+        filename = os.path.join(home, hpic_exec)
+        util.mkdir(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(_HPIC_STUB)
+        util.make_executable(filename)
+
+    # IEADs only for the species RustBCA inputs can be built for
+    config = util.load_yaml(os.path.join(campaign_dir, common._CONFIG_FILENAME))
+    IEAD = fixtures.make_IEAD()
+    for ion_name, hpic_label in common.ion_map(config['ions']).items():
+        if ion_name not in builder.incident_ions:
+            continue
+        np.savetxt(os.path.join(stub_dir, f'IEAD_{hpic_label}.dat'), IEAD, delimiter = ' ', fmt = '%d')
+
+    with open(os.path.join(stub_dir, 'rustbca_stub.py'), 'w') as f:
+        f.write(_RUSTBCA_STUB)
+    fixtures.write_sputtered_output(os.path.join(stub_dir, 'sputtered.output'), sputtered_rows)
+
+    # hPIC simulated time of every simulation, normally collected by hand
+    with open(os.path.join(campaign_dir, 'simulation_times.csv'), 'w') as f:
+        for label, datafile in common.DATAFILES.items():
+            df = util.load_solps_data(os.path.join(campaign_dir, datafile))
+            for _, row in df.iterrows():
+                separation = row['L-Lsep (m)']
+                sign = 'plus_' if separation > 0 else 'minus_'
+                f.write(f'{label}_sop_{sign}{abs(separation):.3f}m_from_sp,1.6e-05\n')
+
+
+def stage_commands(stage, campaign_dir, sbes):
+    """
+    The shell commands of a stage, run from the campaign directory.
+    """
+    python = f'{sys.executable} {_SCRIPTS_DIR}'
+    if stage == 'pushes':
+        return [
+            f'{python}/configure_simulations.py configure-total-pushes-script',
+            'bash scripts/get_total_pushes.sh > total_pushes.csv',
+        ]
+    if stage == 'assign':
+        return [f'{python}/assign_workloads.py total_pushes.csv']
+    if stage == 'configure':
+        return [f'{python}/configure_simulations.py']
+    if stage == 'hpic':
+        # What the generated parent scripts do on the LCPP boxes, one
+        # simulation at a time
+        return [
+            'for s in remote_scripts/generated/mkdirs_*.sh; do bash $s; done',
+            'for s in remote_scripts/generated/*_from_sp_*.sh; do bash $s; done',
+        ]
+    if stage == 'p2c':
+        return [f'{python}/find_p2c_values.py']
+    if stage == 'build':
+        return [f'{python}/build_rustbca_input_files.py {sbe}' for sbe in sbes]
+    if stage == 'verify':
+        return [f'{python}/verify_total_counts.py']
+    if stage == 'rustbca':
+        return [f'{sys.executable} stubs/rustbca_stub.py stubs/sputtered.output']
+    if stage == 'reduce':
+        return [f'{python}/reduce_rustbca_outputs.py']
+    if stage == 'sputtering':
+        return [f'{python}/physical_sputtering_amount.py all']
+    raise ValueError(stage)
+
+
+def run_command(command, campaign_dir, log):
+    """
+    :returns: (exit status, peak RSS in bytes)
+    """
+    env = dict(os.environ)
+    env['HOME'] = os.path.join(campaign_dir, 'home')
+    env['PATH'] = os.path.join(env['HOME'], 'bin') + os.pathsep + env.get('PATH', '')
+    env['HPIC_STUB_IEAD_DIR'] = os.path.join(campaign_dir, 'stubs')
+    env['PYTHONPATH'] = _SCRIPTS_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    env['MPLBACKEND'] = 'Agg'
+
+    log.write(f'$ {command}\n')
+    log.flush()
+    rss_filename = os.path.join(campaign_dir, _RSS_FILENAME)
+    status = subprocess.call(
+        [sys.executable, '-c', _RSS_WRAPPER, rss_filename, command],
+        cwd = campaign_dir,
+        env = env,
+        stdout = log,
+        stderr = subprocess.STDOUT,
+    )
+    with open(rss_filename, 'r') as f:
+        peak_rss = int(f.read()) * 1024
+    os.remove(rss_filename)
+    return status, peak_rss
+
+
+def count_outputs(campaign_dir):
+    return {
+        'hPIC simulations': len(glob.glob(os.path.join(campaign_dir, 'hpic_results/*_from_sp'))),
+        'RustBCA inputs': len(glob.glob(os.path.join(campaign_dir, 'rustbca_simulations/SBE*/*/*input.toml'))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Run the pipeline on a synthetic campaign.')
+    parser.add_argument('--scale', type = float, default = 1.0,
+        help = 'campaign size relative to the real one (e.g. 10, 100)')
+    parser.add_argument('--sbe', nargs = '+', default = ['low'], choices = ['low', 'high'])
+    parser.add_argument('--sputtered-rows', type = int, default = _SPUTTERED_ROWS)
+    parser.add_argument('--stages', nargs = '+', default = STAGES, choices = STAGES)
+    parser.add_argument('--keep', metavar = 'DIR',
+        help = 'build the campaign in DIR and keep it, instead of a temporary directory')
+    args = parser.parse_args()
+
+    if args.keep:
+        util.mkdir(args.keep)
+        campaign_dir = os.path.abspath(args.keep)
+        cleanup = None
+    else:
+        cleanup = tempfile.TemporaryDirectory()
+        campaign_dir = cleanup.name
+
+    print(f'writing a scale {args.scale} campaign to {campaign_dir}...')
+    start = time.perf_counter()
+    write_campaign(campaign_dir, args.scale, args.sputtered_rows)
+    print(f'campaign written in {time.perf_counter() - start:.1f} s')
+
+    log_filename = os.path.join(campaign_dir, 'harness.log')
+    results = []
+    with open(log_filename, 'w') as log:
+        for stage in [stage for stage in STAGES if stage in args.stages]:
+            print(f'running {stage}...')
+            start = time.perf_counter()
+            peak_rss = 0
+            status = 0
+            for command in stage_commands(stage, campaign_dir, args.sbe):
+                status, rss = run_command(command, campaign_dir, log)
+                peak_rss = max(peak_rss, rss)
+                if status != 0:
+                    break
+            results.append((stage, time.perf_counter() - start, peak_rss, status))
+            if status != 0:
+                print(f'{stage} failed (exit status {status}), see {log_filename}')
+                break
+
+    print()
+    for name, count in count_outputs(campaign_dir).items():
+        print(f'{name}: {count}')
+    print(f'{"stage":<12} {"wall (s)":>10} {"peak RSS (MB)":>14}  status')
+    for stage, wall, peak_rss, status in results:
+        print(f'{stage:<12} {wall:>10.2f} {peak_rss / 1e6:>14.1f}  {"ok" if status == 0 else "FAILED"}')
+
+    if cleanup is not None:
+        if results and results[-1][3] != 0:
+            # Keep the log of a failed run around
+            shutil.copyfile(log_filename, 'scale_harness.log')
+            print('log saved to scale_harness.log')
+        cleanup.cleanup()
+
+    if results and results[-1][3] != 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,37 +10,17 @@
 # containing a single line date time string in the format %Y-%m-%dT%H:%S-%Z.
 # Similarlty, it assumes that ones an hPIC simulation is complete, a similar
 # file named "simulation-complete" is created.
+#
+# Simulations are run by run_job.py, which retries failed runs and writes
+# "simulation-failed" (date, failure class, number of attempts) once it gives
+# up. Those are reported as FAILED, and can be moved to another host with
+# scripts/requeue_failed.py.
+#
+# Simulations whose bulky outputs were pruned on completion (hpic_output in
+# config.yaml) also report the disk space that reclaimed.
+#
+# The check is scripts/hpic_status.py (the same as "fnsf status" locally),
+# which configure_simulations.py copies into remote_scripts/generated/ next to
+# run_job.py, so it's sent along with the hPIC scripts.
 
-
-for SimID in hpic_results/*
-do
-    start=$(cat $SimID/simulation-start)
-    end=$(cat $SimID/simulation-complete)
-    python3 -c '''
-import sys
-from datetime import datetime
-
-DEFAULT_DATE = datetime(1970,1,1,0,0,0)
-start = end = DEFAULT_DATE
-
-hostname = sys.argv[1]
-SimID = sys.argv[2].split("hpic_results/")[1]
-if len(sys.argv) < 4:
-    print(f"{hostname}: {SimID:35} not started!")
-    sys.exit(0)
-
-start = datetime.strptime(sys.argv[3], "%Y-%m-%dT%H:%M:%S-%Z")
-if len(sys.argv) < 5:
-    print(f"{hostname}: {SimID:35} still running")
-    sys.exit(0)
-
-end = datetime.strptime(sys.argv[4], "%Y-%m-%dT%H:%M:%S-%Z")
-
-# Maybe the previous hPIC run failed, in which case "simulation-complete"
-# MIGHT exist, but with a stale timestemp.
-if end > start:
-    print(f"{hostname}: {SimID:35} done (took {end - start})")
-else:
-    print(f"{hostname}: {SimID:35} still running")''' $(hostname) $SimID $start $end
- done
-
+python3 hpic_status.py hpic_results
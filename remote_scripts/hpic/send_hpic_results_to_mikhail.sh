@@ -47,9 +47,34 @@ hpic.log
 # destination on mikhail's box
 DEST_DIR=/home/xerxes/npre/research/FNSF
 
-for SimDir in hpic_results/*; do
+# Only complete simulations are sent, each once (simulation-sent), with
+# simulation-complete last: scripts/watch_pipeline.py starts a simulation's
+# RustBCA work as soon as that arrives. With WATCH_SECONDS set, this keeps
+# sending simulations as they complete, every WATCH_SECONDS, until none are
+# left running, e.g.
+#   WATCH_SECONDS=300 nohup ./send_results_to_mikhail.sh &
+send_simulation() {
+    SimDir=$1
     ssh mikhail "mkdir -p $DEST_DIR/$SimDir"
     for pattern in ${FILE_PATTERNS_OF_INTEREST[*]}; do
         scp $SimDir/$pattern mikhail:$DEST_DIR/$SimDir
     done
+    scp $SimDir/simulation-complete mikhail:$DEST_DIR/$SimDir && touch $SimDir/simulation-sent
+}
+
+while true; do
+    running=0
+    for SimDir in hpic_results/*; do
+        if [ -f $SimDir/simulation-complete ] && [ ! $SimDir/simulation-start -nt $SimDir/simulation-complete ]; then
+            if [ ! -f $SimDir/simulation-sent ] || [ $SimDir/simulation-complete -nt $SimDir/simulation-sent ]; then
+                send_simulation $SimDir
+            fi
+        elif [ ! -f $SimDir/simulation-failed ]; then
+            running=$((running+1))
+        fi
+    done
+    if [ -z "$WATCH_SECONDS" ] || [ $running -eq 0 ]; then
+        break
+    fi
+    sleep $WATCH_SECONDS
 done
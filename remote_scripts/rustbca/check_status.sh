@@ -6,8 +6,17 @@ if [ ! -z "$(pgrep -f "rustBCA SBE")" ]; then
     running_status="(RustBCA currently running)"
 fi
 
-# Count the number of completed simulations (or running)
-complete=$(find . -name sputtered.output | wc -l)
+# Count the number of completed simulations (or running). Simulations with
+# binned output write distributions.toml instead of sputtered.output, and
+# finalized simulations may only have sputtered.columns.
+complete=$(find . \( -name sputtered.output -o -name sputtered.columns -o -name distributions.toml \) -exec dirname {} \; | sort -u | wc -l)
 total_simulations=$(find . -name *input.toml | wc -l)
 
-printf "$(whoami): $complete/$total_simulations running or complete $running_status\n"
+# Simulations run_job.py gave up on (see launcher.sh)
+failed=$(find . -name simulation-failed | wc -l)
+failed_status=""
+if [ $failed -gt 0 ]; then
+    failed_status="($failed FAILED, see simulation-failed and attempts.jsonl)"
+fi
+
+printf "$(whoami): $complete/$total_simulations running or complete $running_status $failed_status\n"
@@ -1,7 +1,7 @@
 #!/usr/bin/env bash
 
 for simdir in SBE*/**; do
-    if [ ! -f $simdir/sputtered.output ]; then
+    if [ ! -f $simdir/sputtered.output ] && [ ! -d $simdir/sputtered.columns ] && [ ! -f $simdir/distributions.toml ]; then
         echo $simdir
     fi
 done
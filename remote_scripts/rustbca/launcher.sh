@@ -1,4 +1,70 @@
 #!/usr/bin/env bash
-for f in SBE*/**/*input.toml; do
-    cargo run --release $f
+
+# Inputs built with "particle_input: hdf5" or "output: distributions" need
+# RustBCA built with the matching features, e.g.
+#   RUSTBCA_FEATURES=hdf5_input ./launcher.sh
+#   RUSTBCA_FEATURES=distributions,no_list_output ./launcher.sh
+#
+# After each simulation its list outputs are converted to binary columns (see
+# scripts/finalize_rustbca_outputs.py). Set FINALIZE_TEXT=delete or
+# FINALIZE_TEXT=compress to also remove or gzip the text outputs.
+#
+# Each input file starts with a "# geometry_mode: (0D|1D|2D)" line (see
+# rustbca.geometry in config.yaml), which RustBCA needs before the file name.
+#
+# Each simulation runs through run_job.py, which retries it if it fails
+# (retry in config.yaml) and writes its output to rustbca.log and
+# simulation-start/-complete/-failed next to the input. Pass the retry
+# options in RUN_JOB_OPTIONS, e.g.
+#   RUN_JOB_OPTIONS="--max-attempts=5 --stall-timeout=7200" ./launcher.sh
+# RustBCA prints nothing to rustbca.log, so a simulation counts as stalled
+# once its output files stop changing. Distribution outputs are only written
+# at the end: with "output: distributions", pass a stall timeout longer than
+# the longest simulation.
+# Complete simulations are skipped, so the launcher can be started again at
+# any time, e.g. after a requeue or a reboot.
+#
+# With WATCH_SECONDS set, the launcher looks for new inputs every
+# WATCH_SECONDS, as scripts/watch_pipeline.py sends them while hPIC is still
+# running, and exits once the watcher has written queue-closed and every
+# input has been run, e.g.
+#   WATCH_SECONDS=60 nohup ./launcher.sh &
+#
+# JOBS simulations run at once (default: the number rustbca_tuning.py found
+# best for this host, left in rustbca-jobs by tuning/tune_rustbca.py, else 1).
+# Each worker goes through every input; run_job.py's lock makes the others
+# skip the simulations one of them is running.
+JOBS=${JOBS:-$(cat rustbca-jobs 2>/dev/null || echo 1)}
+
+work() {
+    while true; do
+        # Inputs sent before the queue was closed are run by this last pass
+        closed=$([ -f queue-closed ] && echo 1)
+        for f in SBE*/**/*input.toml; do
+            [ -f $f ] || continue
+            simdir=$(dirname $f)
+            if [ -f $simdir/simulation-complete ] && [ ! $simdir/simulation-start -nt $simdir/simulation-complete ]; then
+                continue
+            fi
+            # Failed simulations are only retried on the first pass
+            if [ -n "$watching" ] && [ -f $simdir/simulation-failed ]; then
+                continue
+            fi
+            mode=$(sed -n 's/^# geometry_mode: //p' $f | head -1)
+            python3 run_job.py --dir=$simdir --log=rustbca.log $RUN_JOB_OPTIONS -- \
+                cargo run --release ${RUSTBCA_FEATURES:+--features $RUSTBCA_FEATURES} ${mode:-2D} $f \
+                && python3 finalize_rustbca_outputs.py ${FINALIZE_TEXT:+--$FINALIZE_TEXT} $simdir
+        done
+        if [ -z "$WATCH_SECONDS" ] || [ -n "$closed" ]; then
+            break
+        fi
+        watching=1
+        sleep $WATCH_SECONDS
+    done
+}
+
+for i in $(seq 2 $JOBS); do
+    work &
 done
+work
+wait
@@ -22,6 +22,9 @@ _SEND_TO_ALL=(
    #rustbca/send_results_to_mikhail.sh
    rustbca/check_status.sh
    #rustbca/find_missing.sh
+   ../scripts/finalize_rustbca_outputs.py
+   ../scripts/rustbca_output.py
+   ../scripts/run_job.py
 )
 
 for host in $lcpp_hosts; do
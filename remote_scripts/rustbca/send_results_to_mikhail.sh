@@ -38,6 +38,8 @@
 
 FILE_PATTERNS_OF_INTEREST=(
 *sputtered.output
+*sputtered.columns
+*distributions.toml
 )
 
 # destination on mikhail's box
@@ -45,9 +47,9 @@ DEST_DIR=/home/xerxes/npre/research/FNSF/rustbca_simulations
 
 for SimDir in SBE*/**; do
     for pattern in ${FILE_PATTERNS_OF_INTEREST[*]}; do
-        if [ ! -f $SimDir/$pattern ]; then
+        if [ ! -e $SimDir/$pattern ]; then
             continue
         fi
-        scp $SimDir/$pattern mikhail:$DEST_DIR/$SimDir/
+        scp -r $SimDir/$pattern mikhail:$DEST_DIR/$SimDir/
     done
 done
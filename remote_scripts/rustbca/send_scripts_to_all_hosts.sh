@@ -28,6 +28,12 @@ for host in $lcpp_hosts; do
         ssh $host bash -c "'if [ -f $REMOTE_DEST_DIR/$SBE/$SimID ];then rm $REMOTE_DEST_DIR/$SBE/$SimID; fi'"
         ssh $host mkdir -p $REMOTE_DEST_DIR/$SBE/$SimID
         scp $input_file $host:$REMOTE_DEST_DIR/$SBE/$SimID
+
+        # HDF5 particle input (rustbca.particle_input: hdf5 in config.yaml)
+        particle_file=$(dirname $input_file)/particles.h5
+        if [ -f $particle_file ]; then
+            scp $particle_file $host:$REMOTE_DEST_DIR/$SBE/$SimID
+        fi
     done
 done
 
@@ -1,6 +1,7 @@
 import sys
-import numpy as np
 import yaml
+import profiling
+import host_capabilities
 from common import _MACHINE_ASSIGNMENTS_FILE
 
 
@@ -16,7 +17,9 @@ then it should be assigned vi/sum_i^n(vi) fraction of the work.
 But what if Bi has M cores? then it can process M*vi particles/second.
 Therefore it should be assigned M*vi/sum_i^n(M*vi) fraction of the work.
 
-The dictionary below represents the results of the above calculation.
+The dictionary below represents the results of the above calculation. Once
+the hosts are calibrated (host_capabilities.py), their measured hPIC
+throughputs are used instead.
 """
 MACHINE_BANDWIDTHS = {
     'my_machine': 0.32 ,
@@ -104,18 +107,24 @@ def assign_workloads(simulation_work_fractions, machine_bandwidths):
     return machine_assignments
 
 
+@profiling.profiled('assign_workloads')
 def main():
     # CSV containing two columns: SIM_ID, TOTAL_HPIC_PARTICLE_PUSHES
     if len(sys.argv) < 2:
         print('usage: python assign_workloads.py <DATAFILE>')
         sys.exit(1)
     datafile = sys.argv[1]
-    workload_fractions = get_fractional_workload_of_each_simulation(datafile)
-    machine_assignments = assign_workloads(workload_fractions, MACHINE_BANDWIDTHS)
+    with profiling.span('total pushes', 'parse'):
+        workload_fractions = get_fractional_workload_of_each_simulation(datafile)
+    with profiling.span('host capabilities', 'load'):
+        machine_bandwidths = host_capabilities.get_hpic_bandwidths(MACHINE_BANDWIDTHS)
+    with profiling.span('assign', 'compute'):
+        machine_assignments = assign_workloads(workload_fractions, machine_bandwidths)
 
     # Save the results for configure_simulations.py to use
-    with open(_MACHINE_ASSIGNMENTS_FILE, 'w') as f:
-        yaml.dump(machine_assignments, f)
+    with profiling.span('machine assignments', 'write'):
+        with open(_MACHINE_ASSIGNMENTS_FILE, 'w') as f:
+            yaml.dump(machine_assignments, f)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,210 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import subprocess
+
+
+"""
+Measure how much hPIC and RustBCA work this host gets through, for
+host_capabilities.py.
+
+Runs on an LCPP box, from the RustBCA run directory (the one with
+Cargo.toml), out of the calibration directory written by
+"python scripts/host_capabilities.py prepare":
+
+    calibration/benchmark_host.py
+    calibration/calibration.json     hPIC command per machine, RustBCA input
+                                     metadata
+    calibration/rustbca_input.toml   small single-threaded RustBCA input
+
+The short hPIC run and the small RustBCA input are each run as 1, 2, 4, ...
+up to MAX_CONCURRENCY (the number of CPUs by default) concurrent copies,
+after one untimed warm-up run (which also builds RustBCA). At each level the
+effective rate is copies / wall time of the slowest copy. The highest rate
+is the host's throughput, and the contention point is the fewest copies
+that get within 5% of it: more copies than that only slow each other down.
+
+The result is written to calibration/<MACHINE>-capability.json and printed
+on one line starting with CAPABILITY, which "host_capabilities.py collect"
+picks out of the output of remote_scripts/run_cmd_on_all_hosts.sh.
+
+Only the standard library is imported.
+
+usage: python3 calibration/benchmark_host.py [--name=MACHINE]
+           [--max-concurrency=N] [--skip=hpic|rustbca]
+"""
+
+CAPABILITY_PREFIX = 'CAPABILITY '
+
+_CALIBRATION_DIR = os.path.dirname(os.path.abspath(__file__))
+_RUNS_DIR = os.path.join(_CALIBRATION_DIR, 'runs')
+
+# A level of concurrency is at the contention point once its effective rate
+# is within this fraction of the best one
+_KNEE_TOLERANCE = 0.05
+
+
+def match_machine_name(hostname, machine_names):
+    """
+    The machine name (e.g. pc85) a hostname (e.g. lcpp-pc85.local) refers
+    to: the longest one contained in it, or None
+    """
+    matches = [name for name in machine_names if name in hostname]
+    if not matches:
+        return None
+    return max(matches, key = len)
+
+
+def get_concurrency_levels(max_concurrency):
+    """
+    1, 2, 4, ... and max_concurrency itself
+    """
+    levels = []
+    level = 1
+    while level < max_concurrency:
+        levels.append(level)
+        level *= 2
+    levels.append(max_concurrency)
+    return levels
+
+
+def find_contention_point(rates):
+    """
+    :param rates: dictionary of concurrency -> effective rate
+    :returns: (best rate, fewest copies within _KNEE_TOLERANCE of it)
+    """
+    best = max(rates.values())
+    knee = min(c for c, rate in rates.items() if rate >= (1 - _KNEE_TOLERANCE) * best)
+    return best, knee
+
+
+def run_copies(commands, copy_dirs):
+    """
+    Start every command at once, each in its own directory
+
+    :returns: wall time of the slowest one, in seconds
+    """
+    start = time.perf_counter()
+    processes = []
+    for command, copy_dir in zip(commands, copy_dirs):
+        log = open(os.path.join(copy_dir, 'benchmark.log'), 'w')
+        processes.append((subprocess.Popen(
+            command, shell = True, cwd = copy_dir, stdout = log, stderr = subprocess.STDOUT,
+        ), log))
+    for process, log in processes:
+        returncode = process.wait()
+        log.close()
+        if returncode != 0:
+            print(f'"{process.args}" failed (exit status {returncode}), see {log.name}')
+            sys.exit(1)
+    return time.perf_counter() - start
+
+
+def make_copy_dirs(label, concurrency):
+    copy_dirs = []
+    for i in range(concurrency):
+        copy_dir = os.path.join(_RUNS_DIR, f'{label}_c{concurrency}_{i}')
+        os.makedirs(copy_dir, exist_ok = True)
+        copy_dirs.append(copy_dir)
+    return copy_dirs
+
+
+def benchmark_hpic(hpic_command, levels):
+    """
+    :returns: dictionary of concurrency -> hPIC runs per second
+    """
+    print('hPIC warm-up run...')
+    run_copies([hpic_command], make_copy_dirs('hpic_warmup', 1))
+    rates = {}
+    for c in levels:
+        wall = run_copies([hpic_command] * c, make_copy_dirs('hpic', c))
+        rates[c] = c / wall
+        print(f'hPIC x{c}: {wall:.1f} s, {rates[c]:.4g} runs/s')
+    return rates
+
+
+def benchmark_rustbca(rustbca_command, mode, N, levels):
+    """
+    Every copy gets its own input, whose output name points into the copy's
+    directory. RustBCA runs from the current directory (Cargo.toml).
+
+    :returns: dictionary of concurrency -> particles per second
+    """
+    with open(os.path.join(_CALIBRATION_DIR, 'rustbca_input.toml'), 'r') as f:
+        template = f.read()
+
+    def commands(label, c):
+        copy_dirs = make_copy_dirs(label, c)
+        result = []
+        for copy_dir in copy_dirs:
+            name = os.path.relpath(copy_dir) + '/'
+            input_filename = os.path.join(copy_dir, 'input.toml')
+            with open(input_filename, 'w') as f:
+                f.write(re.sub(r'(?m)^name\s*=.*$', f'name = "{name}"', template, count = 1))
+            result.append(f'cd {os.getcwd()} && {rustbca_command} {mode} {os.path.relpath(input_filename)}')
+        return result, copy_dirs
+
+    print('RustBCA warm-up run (builds RustBCA if needed)...')
+    run_copies(*commands('rustbca_warmup', 1))
+    rates = {}
+    for c in levels:
+        wall = run_copies(*commands('rustbca', c))
+        rates[c] = c * N / wall
+        print(f'RustBCA x{c}: {wall:.1f} s, {rates[c]:.4g} particles/s')
+    return rates
+
+
+def main():
+    name = None
+    max_concurrency = os.cpu_count() or 1
+    skip = set()
+    for arg in sys.argv[1:]:
+        option, _, value = arg.partition('=')
+        if option == '--name' and value:
+            name = value
+        elif option == '--max-concurrency' and value.isdigit() and int(value) > 0:
+            max_concurrency = int(value)
+        elif option == '--skip' and value in ('hpic', 'rustbca'):
+            skip.add(value)
+        else:
+            print('usage: python3 calibration/benchmark_host.py [--name=MACHINE] '
+                + '[--max-concurrency=N] [--skip=hpic|rustbca]')
+            sys.exit(1)
+
+    with open(os.path.join(_CALIBRATION_DIR, 'calibration.json'), 'r') as f:
+        calibration = json.load(f)
+    hostname = socket.gethostname()
+    name = name or match_machine_name(hostname, calibration['hpic_commands'])
+    if name is None:
+        print(f'{hostname} is none of {", ".join(calibration["hpic_commands"])}, pass --name=MACHINE')
+        sys.exit(1)
+
+    levels = get_concurrency_levels(max_concurrency)
+    capability = {
+        'machine': name,
+        'hostname': hostname,
+        'cpu_count': os.cpu_count(),
+        'calibrated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    if 'hpic' not in skip:
+        rates = benchmark_hpic(calibration['hpic_commands'][name], levels)
+        rate, concurrency = find_contention_point(rates)
+        capability['hpic'] = {'runs_per_second': rate, 'concurrency': concurrency, 'rates': rates}
+    if 'rustbca' not in skip:
+        rustbca = calibration['rustbca']
+        rates = benchmark_rustbca(rustbca['command'], rustbca['mode'], rustbca['N'], levels)
+        rate, concurrency = find_contention_point(rates)
+        capability['rustbca'] = {'particles_per_second': rate, 'concurrency': concurrency, 'rates': rates}
+    shutil.rmtree(_RUNS_DIR, ignore_errors = True)
+
+    with open(os.path.join(_CALIBRATION_DIR, f'{name}-capability.json'), 'w') as f:
+        json.dump(capability, f, indent = 4)
+    print(CAPABILITY_PREFIX + json.dumps(capability))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,13 @@ import sys
 import scientific_constants as sc
 import glob
 import re
+import json
+import hashlib
+import functools
+import profiling
+import host_capabilities
+import rustbca_tuning
+import iead
 
 
 """
@@ -21,10 +28,53 @@ subdirectory, an input.toml file is created for RustBCA to use.
 # fulfill the definition of a "high resolution" simulation
 HIGH_RESOLUTION_N = 1e6
 
+# The total number of simulation particles in an importance-sampled simulation
+# (see get_importance_sampled_counts). Overridden by
+# rustbca.importance_sampling_N in config.yaml.
+IMPORTANCE_SAMPLING_N = 2e5
+
+# Importance-sampled particles from different IEAD bins start at different
+# z-offsets (microns). The target is homogeneous along z, so the offset does
+# not change the physics, but it lets us recover which IEAD bin a sputtered
+# particle came from by looking at its z-coordinate in sputtered.output. The
+# spacing must be much larger than the z-extent of a collision cascade.
+STRATUM_Z_SPACING = 1000.0
+
+# Inputs holding several species (rustbca.combine_species) tag the bins of
+# each species from its own block of tags, species * SPECIES_TAG_STRIDE + bin
+# (the species' position in incident_ions, times the number of bins of
+# hPIC's default IEAD), so every sputtered particle can be traced back to its
+# species and bin. IEADs with more bins use blocks as large as they are.
+SPECIES_TAG_STRIDE = iead.DEFAULT_ENERGY_BINS * iead.DEFAULT_ANGLE_BINS
+
 # Microns
 TARGET_HEIGHT = 1.0
 TARGET_LENGTH = 1.0
 
+# RustBCA geometry modes, passed to RustBCA before the input file name:
+#   2D: the two-triangle target mesh below
+#   1D: layers of material stacked along x, starting at the surface x = 0
+#   0D: a semi-infinite homogeneous target filling x > 0
+# Our targets are flat, homogeneous slabs, so 0D and 1D give the same physics
+# as 2D without a point-in-triangle test at every step. Selected by
+# rustbca.geometry in config.yaml.
+GEOMETRY_MODES = ('0D', '1D', '2D')
+
+# 1D layers (surface first) when rustbca.geometry.layers is not given.
+# deuterium_fraction is the number of deuterium atoms per lithium atom, e.g.
+# for a deuterium-saturated surface layer.
+DEFAULT_LAYERS = [
+    {'thickness': TARGET_LENGTH, 'deuterium_fraction': 0.0},
+]
+
+# Written next to every input file by build_simulation_input, and checked by
+# verify_total_counts.py
+MANIFEST_FILENAME = 'manifest.json'
+
+# The mode is written on the first line of each input file, so that the
+# launchers can pass it on to RustBCA.
+_GEOMETRY_MODE_PREFIX = '# geometry_mode: '
+
 SKIP_IONS = set([
     #'nD+1',
 ])
@@ -42,14 +92,82 @@ machine_core_counts = {
 
 TOTAL_SIMULATIONS = 182
 
+# RustBCA run parameters of every input, unless rustbca_tuning.py found
+# better ones for its machine: particles are split into num_chunks chunks,
+# and output is written every write_buffer_size particles.
+NUM_CHUNKS = 100
+WRITE_BUFFER_SIZE = 8000
+
+# SBE (eV). We don't know a good value for SBE, so we're estimating a range.
+LITHIUM_SURFACE_BINDING_ENERGIES = {
+    'low': 1.0,
+    'high': 4.0,
+}
+
+
+def parse_surface_binding_energy(value):
+    """
+    'low' / 'high' (see LITHIUM_SURFACE_BINDING_ENERGIES) or a number of eV.
+
+    :returns: the SBE in eV, or None if value is neither
+    """
+    value = str(value).lower()
+    if value in LITHIUM_SURFACE_BINDING_ENERGIES:
+        return LITHIUM_SURFACE_BINDING_ENERGIES[value]
+    try:
+        SBE = float(value)
+    except ValueError:
+        return None
+    return SBE if SBE > 0 else None
+
 
-def get_simulations_per_machine():
+def get_SBE_label(lithium_surface_binding_energy):
+    """
+    Directory of the RustBCA simulations for one SBE: SBE_1eV, SBE_2.5eV
+    """
+    if float(lithium_surface_binding_energy).is_integer():
+        return f'SBE_{int(lithium_surface_binding_energy)}eV'
+    return f'SBE_{lithium_surface_binding_energy:g}eV'
+
+
+def get_simulations_per_machine(total_simulations = TOTAL_SIMULATIONS, capacities = None):
+    """
+    :param capacities: dictionary of machine -> relative RustBCA throughput
+        (see host_capabilities.get_rustbca_capacities). Defaults to the
+        core counts.
+    """
+    capacities = capacities or machine_core_counts
     proportions = {}
-    total_capacity = sum((v for v in machine_core_counts.values()))
-    for machine_name, ncores in machine_core_counts.items():
-        proportions[machine_name] = int(ncores * TOTAL_SIMULATIONS /total_capacity) + 1
+    total_capacity = sum((v for v in capacities.values()))
+    for machine_name, capacity in capacities.items():
+        proportions[machine_name] = int(capacity * total_simulations /total_capacity) + 1
     return proportions
 
+def iter_machine_assignments(total_simulations = TOTAL_SIMULATIONS, capacities = None):
+    """
+    The machine to build each successive simulation for: every machine takes
+    its share (see get_simulations_per_machine) in turn, and the last one
+    takes any simulations left over.
+    """
+    proportions = list(get_simulations_per_machine(total_simulations, capacities).items())
+    for machine_name, machine_capacity in proportions:
+        for _ in range(machine_capacity):
+            yield machine_name
+    while True:
+        yield proportions[-1][0]
+
+
+def write_conversion_factor(conversion_factor_files, ion_name, RustBCA_SimID, factor):
+    """
+    Append a simulation's conversion factor to rustbca_conversion_factors/
+    <ion_name>.csv, opening the file on first use.
+    """
+    if ion_name not in conversion_factor_files:
+        fname = f'rustbca_conversion_factors/{ion_name}.csv'
+        conversion_factor_files[ion_name] = open(fname, 'w+')
+    conversion_factor_files[ion_name].write(f'{RustBCA_SimID},{factor}\n')
+
+
 def get_midpoint(p1,p2):
     x1, y1 = p1
     x2, y2 = p2
@@ -95,15 +213,137 @@ def get_target_mesh_triangles():
 
 
 
+# Fields of each row of the "particles" dataset RustBCA reads when it is built
+# with the hdf5_input feature (RustBCA's ParticleInput struct, in order).
+HDF5_PARTICLE_FIELDS = [
+    ('m', '<f8'),
+    ('Z', '<f8'),
+    ('E', '<f8'),
+    ('Ec', '<f8'),
+    ('Es', '<f8'),
+    ('x', '<f8'),
+    ('y', '<f8'),
+    ('z', '<f8'),
+    ('ux', '<f8'),
+    ('uy', '<f8'),
+    ('uz', '<f8'),
+    ('interaction_index', '<u8'),
+]
+
+# Default bins of RustBCA's binned distributions (rustbca.output:
+# distributions), as [min, max, number of bins]. Energies in eV, angles in
+# degrees, positions in microns. Overridden by rustbca.distributions in
+# config.yaml.
+DISTRIBUTION_BINS = {
+    'energy': [0.0, 100.0, 200],
+    'angle': [0.0, 90.0, 90],
+    'x': [-TARGET_LENGTH, TARGET_LENGTH, 100],
+    'y': [-TARGET_HEIGHT, TARGET_HEIGHT, 100],
+    'z': [-TARGET_LENGTH, TARGET_LENGTH, 100],
+}
+
+# The per-entry particle_parameters arrays which go into the HDF5 file
+# instead of the TOML file.
+_PARTICLE_ARRAY_KEYS = ['N', 'm', 'Z', 'E', 'Ec', 'Es', 'interaction_index', 'pos', 'dir']
+
+
+def write_hdf5_particle_input(filename, particle_parameters):
+    """
+    Write particle_parameters as one row per simulation particle (an entry
+    with N = 1000 becomes 1000 identical rows) to the "particles" dataset of
+    an HDF5 file. Values keep the units declared in particle_parameters.
+
+    Identical rows compress extremely well, so the dataset is gzipped.
+    """
+    try:
+        import h5py
+    except ImportError:
+        print('writing HDF5 particle input requires h5py: pip install h5py')
+        sys.exit(1)
+
+    N = np.asarray(particle_parameters['N'], dtype = int)
+    pos = np.asarray(particle_parameters['pos'], dtype = float).reshape(-1, 3)
+    direction = np.asarray(particle_parameters['dir'], dtype = float).reshape(-1, 3)
+    columns = {
+        'm': particle_parameters['m'],
+        'Z': particle_parameters['Z'],
+        'E': particle_parameters['E'],
+        'Ec': particle_parameters['Ec'],
+        'Es': particle_parameters['Es'],
+        'x': pos[:, 0],
+        'y': pos[:, 1],
+        'z': pos[:, 2],
+        'ux': direction[:, 0],
+        'uy': direction[:, 1],
+        'uz': direction[:, 2],
+        'interaction_index': particle_parameters['interaction_index'],
+    }
+
+    particles = np.zeros(np.sum(N), dtype = HDF5_PARTICLE_FIELDS)
+    for field, _ in HDF5_PARTICLE_FIELDS:
+        particles[field] = np.repeat(np.asarray(columns[field]), N)
+
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset(
+            'particles',
+            data = particles,
+            compression = 'gzip',
+            shuffle = True,
+            chunks = True if len(particles) else None,
+        )
+
+
+def read_hdf5_particle_input(filename):
+    """
+    Read back the "particles" dataset written by write_hdf5_particle_input.
+    """
+    import h5py
+    with h5py.File(filename, 'r') as f:
+        return f['particles'][:]
+
+
 def generate_rustbca_input(
     name,
     particle_parameters,
     num_chunks,
     nthreads,
     input_filename,
-    lithium_surface_binding_energy = 1.4):
+    lithium_surface_binding_energy = 1.4,
+    particle_input = 'toml',
+    distribution_bins = None,
+    geometry = None,
+    write_buffer_size = WRITE_BUFFER_SIZE):
+    """
+    :param: particle_input: "toml" writes every particle array into the input
+        file. "hdf5" writes them to particles.h5 next to the input file
+        instead, and RustBCA (built with --features hdf5_input) reads them
+        from there.
+    :param: distribution_bins: if given (see DISTRIBUTION_BINS), RustBCA
+        (built with --features distributions,no_list_output) writes binned
+        energy/angle/position distributions to distributions.toml instead of
+        one line per particle.
+    :param: geometry: see get_geometry. Defaults to the 2D mesh.
+    """
 
     print(f'building {input_filename}...')
+    geometry = geometry or {'mode': '2D'}
+    use_hdf5 = particle_input == 'hdf5' and 'N' in particle_parameters
+    if use_hdf5:
+        # RustBCA is run from the output directory and resolves the
+        # particle input file relative to it, the same way it saves its
+        # output files under "name".
+        with profiling.span('particles.h5', 'write'):
+            write_hdf5_particle_input(
+                os.path.join(os.path.dirname(input_filename), 'particles.h5'),
+                particle_parameters,
+            )
+        particle_parameters = dict(particle_parameters)
+        particle_parameters['particle_input_filename'] = name + 'particles.h5'
+
+        # RustBCA still expects these keys in the TOML file
+        for k in _PARTICLE_ARRAY_KEYS:
+            particle_parameters[k] = []
+
     options = {
         'name': name,
         'track_trajectories': False,
@@ -111,24 +351,29 @@ def generate_rustbca_input(
         'track_displacements': False,
         'track_energy_losses': False,
         'track_recoil_trajectories': False,
-        'write_buffer_size': 8000,
+        'write_buffer_size': write_buffer_size,
         'weak_collision_order': 0,
         'suppress_deep_recoils': False,
         'high_energy_free_flight_paths': False,
         'num_threads': nthreads,
         'num_chunks': num_chunks,
-        'use_hdf5': False,
+        'use_hdf5': use_hdf5,
         'electronic_stopping_mode': 'LOW_ENERGY_NONLOCAL',
         'mean_free_path_model': 'LIQUID',
         'interaction_potential': [['KR_C']],
     }
+    if distribution_bins is not None:
+        for quantity, (low, high, num) in distribution_bins.items():
+            options[f'{quantity}_min'] = float(low)
+            options[f'{quantity}_max'] = float(high)
+            options[f'{quantity}_num'] = int(num)
 
     """
     Target Material (Lithium) properties (values from ./materials_info.txt)
     """
     # Density (atoms per cubic micron)
     # LIQUID lithium density
-    n_target = 4.442103e+10
+    n_target = Lithium['n']
 
     # Bulk Binding Energy (eV). Using Heat of Formation from JP's paper
     Eb_target = 1.1
@@ -157,19 +402,50 @@ def generate_rustbca_input(
 
     energy_barrier_thickness = n_target**(-1./3.)
 
-    target_boundary_points = get_target_boundary_points()
-    triangles = get_target_mesh_triangles()
-
-    # 2D Mesh
-    geometry_input = {
-        'length_unit': 'MICRON',
-        'energy_barrier_thickness': energy_barrier_thickness,
-        'triangles': triangles,
-        'densities': [[n_target]] * len(triangles),
-        'material_boundary_points': target_boundary_points,
-        'simulation_boundary_points': get_simulation_boundary_points(broadening_factor=1),
-        'electronic_stopping_correction_factors': [ 1.0 ] * len(triangles) ,
-    }
+    if geometry['mode'] == '2D':
+        target_boundary_points = get_target_boundary_points()
+        triangles = get_target_mesh_triangles()
+
+        # 2D Mesh
+        geometry_input = {
+            'length_unit': 'MICRON',
+            'energy_barrier_thickness': energy_barrier_thickness,
+            'triangles': triangles,
+            'densities': [[n_target]] * len(triangles),
+            'material_boundary_points': target_boundary_points,
+            'simulation_boundary_points': get_simulation_boundary_points(broadening_factor=1),
+            'electronic_stopping_correction_factors': [ 1.0 ] * len(triangles) ,
+        }
+    elif geometry['mode'] == '0D':
+        geometry_input = {
+            'length_unit': 'MICRON',
+            'densities': [n_target],
+            'electronic_stopping_correction_factor': 1.0,
+        }
+    else:
+        layers = geometry.get('layers', DEFAULT_LAYERS)
+        densities = [[n_target] for _ in layers]
+
+        # Deuterium in any layer becomes a second target species
+        if any(layer.get('deuterium_fraction', 0.0) > 0 for layer in layers):
+            for k, v in (
+                    ('Eb', 0.0),
+                    ('Es', Deuterium['Es']),
+                    ('Ec', Deuterium['Ec']),
+                    ('Z', Deuterium['Z']),
+                    ('m', Deuterium['mass']),
+                    ('interaction_index', 0)):
+                material_parameters[k].append(v)
+            for layer_densities, layer in zip(densities, layers):
+                layer_densities.append(n_target * layer.get('deuterium_fraction', 0.0))
+
+        # 1D layers
+        geometry_input = {
+            'length_unit': 'MICRON',
+            'layer_thicknesses': [layer['thickness'] for layer in layers],
+            'densities': densities,
+            'electronic_stopping_correction_factors': [1.0] * len(layers),
+        }
 
 
     input_file = {
@@ -179,15 +455,20 @@ def generate_rustbca_input(
         'options': options,
     }
 
-    with open(input_filename, 'w') as f:
-        toml.dump(input_file, f, encoder=toml.TomlNumpyEncoder())
+    with profiling.span('input TOML', 'serialize'):
+        input_toml = toml.dumps(input_file, encoder=toml.TomlNumpyEncoder())
+
+    with profiling.span('input TOML', 'write'):
+        with open(input_filename, 'w') as f:
+            f.write(f'{_GEOMETRY_MODE_PREFIX}{geometry["mode"]}\n')
+            f.write(input_toml)
 
-        # Since the 'options' section will be at the end (alphabetical order),
-        # we can write these extra bits after the rest of the toml and they
-        # will become part of the 'options' section.
-        f.write(r'scattering_integral = [["MENDENHALL_WELLER"]]')
-        f.write('\n')
-        f.write(r'root_finder = [[{"NEWTON"={max_iterations = 100, tolerance=1E-3}}]]')
+            # Since the 'options' section will be at the end (alphabetical order),
+            # we can write these extra bits after the rest of the toml and they
+            # will become part of the 'options' section.
+            f.write(r'scattering_integral = [["MENDENHALL_WELLER"]]')
+            f.write('\n')
+            f.write(r'root_finder = [[{"NEWTON"={max_iterations = 100, tolerance=1E-3}}]]')
 
 
 Deuterium = {
@@ -211,6 +492,13 @@ Neon = {
     'Es': 0.0,       # Surface Binding Energy, eV
 }
 
+Lithium = {
+    'mass': 6.941,   # Average Mass (a.m.u.)
+    'Z': 3,          # Proton Count
+    'Ec': 1.5,       # Cutoff Energy, eV
+    'n': 4.442103e+10, # LIQUID density, atoms per cubic micron
+}
+
 """
 The names come from hPIC labels. These are pinned down in config.yaml, which
 configures the hPIC simulations and avoids ambiguity in post-processing.
@@ -232,6 +520,102 @@ def angle_to_dir(angle):
     return np.round(particle_dir, decimals = 5)
 
 
+def get_incident_energies(Te, grid = iead.DEFAULT_GRID):
+    """
+    Return the incident energy (eV) of every IEAD bin, in the same order as
+    IEAD.flatten(): the middle of the bin's energy range (see iead.py).
+
+    On hPIC's default grid (240 energies from 0 to 24*Te, 90 angles):
+    first 90 elements: 0.05 * Te
+    next 90 elements:  0.15 * Te
+    ...
+    final 90 elements: 23.95 * Te
+    """
+    N_a = iead.get_shape(grid)[1]
+    return [E * Te for E in iead.get_energy_centers(grid) for _ in range(N_a)]
+
+
+def estimate_sputtering_yield(E, particle, lithium_surface_binding_energy):
+    """
+    A rough prior for the sputtering yield of lithium, used ONLY to decide
+    where to spend simulation particles, never to compute results.
+
+    Below the Bohdansky threshold energy nothing is sputtered. Above it,
+    the yield rises with the Bohdansky threshold factor
+    (1 - (Eth/E)^(2/3)) * (1 - Eth/E)^2.
+
+    :param: E: array of incident energies (eV)
+    :param: particle: incident ion properties (e.g. Deuterium)
+    :param: lithium_surface_binding_energy: SBE of the target (eV)
+    :returns: array of (unnormalized) yields, same shape as E
+    """
+    m1 = particle['mass']
+    m2 = Lithium['mass']
+    mass_ratio = m1 / m2
+    if mass_ratio <= 0.3:
+        # Maximum fraction of energy transferred in a head-on collision
+        gamma = 4 * m1 * m2 / (m1 + m2)**2
+        E_threshold = lithium_surface_binding_energy / (gamma * (1 - gamma))
+    else:
+        E_threshold = 8 * lithium_surface_binding_energy * mass_ratio**(2./5.)
+
+    ratio = np.clip(E_threshold / np.asarray(E, dtype = float), 0.0, 1.0)
+    return (1 - ratio**(2./3.)) * (1 - ratio)**2
+
+
+def get_importance_sampled_counts(
+        IEAD,
+        incident_energies,
+        particle,
+        lithium_surface_binding_energy,
+        N_total = IMPORTANCE_SAMPLING_N,
+        floor = 0.05):
+    """
+    Choose how many simulation particles to run from each IEAD bin so that
+    the variance of the sputtering yield is minimized for a fixed total
+    number of simulation particles (Neyman allocation).
+
+    If p_i is the fraction of incident ions in bin i and Y_i its sputtering
+    yield, the number of atoms sputtered per incident ion in bin i is roughly
+    Poisson, with standard deviation sqrt(Y_i). The yield estimator
+        Y = sum_i p_i * Nsput_i / n_i
+    has minimum variance when n_i is proportional to p_i * sqrt(Y_i).
+
+    Y_i comes from estimate_sputtering_yield. Since that is only a prior,
+    sqrt(Y_i) is never allowed to drop below a fraction "floor" of its
+    maximum, and every non-empty bin gets at least one particle. This keeps
+    the estimator unbiased even where the prior is wrong.
+
+    :returns: (counts, weights). counts[i] is the number of simulation
+        particles for bin i. weights[i] is the number of real incident ions
+        each of those simulation particles stands for (0 for empty bins).
+    """
+    real_counts = IEAD.flatten().astype(float)
+    p = real_counts / np.sum(real_counts)
+
+    sigma = np.sqrt(estimate_sputtering_yield(
+        incident_energies,
+        particle,
+        lithium_surface_binding_energy,
+    ))
+    if sigma.max() > 0:
+        sigma = np.maximum(sigma, floor * sigma.max())
+    else:
+        # Every bin is below threshold. Fall back to sampling the IEAD itself.
+        sigma = np.ones_like(sigma)
+
+    allocation = p * sigma
+    allocation = N_total * allocation / np.sum(allocation)
+
+    counts = np.where(real_counts > 0, np.maximum(np.round(allocation), 1), 0)
+    counts = counts.astype(int)
+
+    weights = np.zeros_like(real_counts)
+    nonempty = counts > 0
+    weights[nonempty] = real_counts[nonempty] / counts[nonempty]
+    return counts, weights
+
+
 def get_particle_parameters_from_IEAD(
         IEAD,
         Te,
@@ -239,30 +623,40 @@ def get_particle_parameters_from_IEAD(
         particle_starting_positions,
         particle_directions,
         example = False,
-        factor = 1):
+        factor = 1,
+        counts = None,
+        tag_offset = 0,
+        grid = iead.DEFAULT_GRID):
     """
     Incident ion properties
-    """
-    max_E = Te * 24.0
 
-    # N_e = num different energy values
-    N_e = 240
-
-    # get energies.
-    # first 90 elements: 0.05 * Te
-    # next 90 elements:  0.15 * Te
-    # ...
-    # final 90 elements: 23.95 * Te
-    incident_energies = [(Ei + 0.5)  * max_E / N_e for Ei in range(N_e) for _ in range(90)]
+    If counts (one per IEAD bin) is given, it is used as-is instead of
+    multiplying the IEAD by factor. Only non-empty bins are written, and each
+    bin starts at its own z-offset (see STRATUM_Z_SPACING) so its sputtered
+    particles can be traced back to it. Bin i gets tag tag_offset + i.
 
+    :param: grid: the IEAD's bins (see iead.py)
+    """
+    incident_energies = get_incident_energies(Te, grid)
 
-    particle_counts = IEAD.flatten()
-    M = IEAD.size
+    if counts is None:
+        particle_counts = (IEAD.flatten() * factor).astype(int)
+    else:
+        bins = np.flatnonzero(counts)
+        particle_counts = counts[bins]
+        incident_energies = [incident_energies[i] for i in bins]
+        particle_directions = [particle_directions[i] for i in bins]
+        particle_starting_positions = [
+            particle_starting_positions[i] + np.array([0.0, 0.0, (tag_offset + i) * STRATUM_Z_SPACING])
+            for i in bins
+        ]
+
+    M = len(particle_counts)
     particle_parameters = {
         'length_unit': 'MICRON',
         'energy_unit': 'EV',
         'mass_unit': 'AMU',
-        'N': list((particle_counts * factor).astype(int)),
+        'N': list(particle_counts),
         'm': [particle['mass']] * M ,
         'Z': [particle['Z']] * M,
         'E': incident_energies,
@@ -283,6 +677,50 @@ def get_particle_parameters_from_IEAD(
             del particle_parameters[k]
     return particle_parameters
 
+
+def write_strata_file(filename, counts, weights):
+    """
+    Save the per-bin particle counts and weights of an importance-sampled
+    simulation, so that physical_sputtering_amount.py can weight each
+    sputtered particle by the IEAD bin it came from.
+
+    Columns: tag (flat IEAD bin index, i.e. z-offset / STRATUM_Z_SPACING),
+    N (simulation particles), weight (real incident ions per simulation
+    particle).
+    """
+    with open(filename, 'w') as f:
+        f.write('tag,N,weight\n')
+        for tag in np.flatnonzero(counts):
+            f.write(f'{tag},{counts[tag]},{weights[tag]:.8e}\n')
+
+
+def write_species_strata_file(filename, species_strata):
+    """
+    strata.csv of an input holding several species (see
+    build_combined_simulation_input). Same columns as write_strata_file, plus
+    the ion each tag belongs to.
+
+    :param: species_strata: list of (ion name, tag offset, counts, weights)
+    """
+    with open(filename, 'w') as f:
+        f.write('tag,ion,N,weight\n')
+        for ion_name, tag_offset, counts, weights in species_strata:
+            for i in np.flatnonzero(counts):
+                f.write(f'{tag_offset + i},{ion_name},{counts[i]},{weights[i]:.8e}\n')
+
+
+def concatenate_particle_parameters(parameter_sets):
+    """
+    Merge the particle_parameters of several species into one. Every
+    per-entry array is concatenated; the units are shared.
+    """
+    combined = dict(parameter_sets[0])
+    for k in _PARTICLE_ARRAY_KEYS:
+        if k in combined:
+            combined[k] = [x for parameters in parameter_sets for x in parameters[k]]
+    return combined
+
+
 def get_particle_parameters(
     particle,
     particle_starting_positions,
@@ -337,172 +775,665 @@ def get_Te_for_Lsep(Lsep, df):
     return Te_eV
 
 
+def get_particle_input_format(rustbca_config):
+    """
+    rustbca.particle_input in config.yaml: where RustBCA reads incident
+    particles from (toml|hdf5)
+    """
+    particle_input = rustbca_config.get('particle_input', 'toml')
+    if particle_input not in ('toml', 'hdf5'):
+        print(f'unknown rustbca.particle_input: "{particle_input}" (toml|hdf5)')
+        sys.exit(1)
+    return particle_input
 
-def main():
-    # SBE (eV). We don't know a good value for SBE, so we're estimating a range.
-    lithium_surface_binding_energy = 1.0
-    if len(sys.argv) >= 2:
-        if sys.argv[1].lower() != 'low' and sys.argv[1].lower() != 'high':
-            print('usage: python build_rustbca_input_files.py (high|low) [example]')
-            sys.exit(1)
-        elif sys.argv[1].lower() == 'high':
-            lithium_surface_binding_energy = 4.0
 
-    example = False
-    if len(sys.argv) == 3:
-        if sys.argv[2].lower() != 'example':
-            print('usage: python build_rustbca_input_files.py (high|low) [example]')
-            sys.exit(1)
-        else:
-            example = True
+def get_output_format(rustbca_config):
+    """
+    rustbca.output in config.yaml: what RustBCA writes (list|distributions).
 
-    SBE_label = f'SBE_{int(lithium_surface_binding_energy)}eV'
+    :returns: the distribution bins to request from RustBCA, or None for the
+        per-particle list output.
+    """
+    output = rustbca_config.get('output', 'list')
+    if output not in ('list', 'distributions'):
+        print(f'unknown rustbca.output: "{output}" (list|distributions)')
+        sys.exit(1)
+    if output == 'list':
+        return None
 
-    output_dir = f'rustbca_simulations'
-    if example:
-        output_dir = f'rustbca_simulation_examples'
-    util.mkdir(output_dir)
+    if rustbca_config.get('particle_allocation', 'uniform') == 'importance':
+        # Sputtered particles are traced back to their IEAD bin through
+        # their position, which only the list output has.
+        print('rustbca.particle_allocation: importance requires rustbca.output: list')
+        sys.exit(1)
 
-    # Pin down species names in a config file so we're never wondering what
-    # ion "sp4" is.
-    config = util.load_yaml(common._CONFIG_FILENAME)
-    ion_names = common.invert_ion_map(config['ions'])
+    distribution_bins = dict(DISTRIBUTION_BINS)
+    distribution_bins.update(rustbca_config.get('distributions', {}))
+    return distribution_bins
 
 
-    if SKIP_IONS:
-        print(f'\nSKIPPING the following ions: {SKIP_IONS}\n')
-    datafiles = common.DATAFILES
-    solps_data = {}
-    for data_set_label, datafile in datafiles.items():
-        solps_data[data_set_label] = util.load_solps_data(datafile)
+def get_combine_species(rustbca_config):
+    """
+    rustbca.combine_species in config.yaml: one input per simulation holding
+    every species, instead of one per species.
+    """
+    combine_species = bool(rustbca_config.get('combine_species', False))
+    if combine_species and get_output_format(rustbca_config) is not None:
+        # Sputtered particles are traced back to their species through
+        # their position, which only the list output has.
+        print('rustbca.combine_species requires rustbca.output: list')
+        sys.exit(1)
+    return combine_species
+
+
+def get_rustbca_features(rustbca_config):
+    """
+    The cargo features RustBCA must be built with to run inputs built with
+    this config.
+    """
+    features = []
+    if get_particle_input_format(rustbca_config) == 'hdf5':
+        features.append('hdf5_input')
+    if get_output_format(rustbca_config) is not None:
+        features += ['distributions', 'no_list_output']
+    return features
+
+
+def get_strike_point(geometry_mode = '2D'):
+    """
+    Where the incident particles strike the target
+    """
+    if geometry_mode == '2D':
+        # we want the particles to strike the target halfway up the left side,
+        # coming from the left.
+        top_left_corner, bottom_left_corner, _, _ = get_target_boundary_points()
+        return get_midpoint(top_left_corner, bottom_left_corner)
+    return np.zeros(3)
+
+
+def get_particle_start(strike_point, direction, geometry_mode = '2D'):
+    """
+    Starting position of a particle which moves along direction and hits
+    strike_point.
+
+    In 2D, particles start a unit length from the strike point. In 0D and 1D,
+    RustBCA only simulates a few energy barrier thicknesses in front of the
+    surface, so particles start 2 energy barrier thicknesses in front of it.
+    """
+    if geometry_mode == '2D':
+        return strike_point - direction
+    energy_barrier_thickness = Lithium['n']**(-1./3.)
+    return strike_point - direction * 2 * energy_barrier_thickness / direction[0]
+
+
+def get_IEAD_particle_starts_and_directions(geometry_mode = '2D', grid = iead.DEFAULT_GRID):
+    """
+    Starting positions and directions of the incident particles for every
+    IEAD bin, in the same order as IEAD.flatten(). Particles of a bin come in
+    at the middle of its angle range (see iead.py).
+    """
+    N_e = iead.get_shape(grid)[0]
+    return _get_IEAD_particle_starts_and_directions(
+        geometry_mode, N_e, tuple(iead.get_angle_centers(grid)),
+    )
 
 
-    # Initialize directions head of time. This is based on the assumptino that
-    # the IEAD has 240 rows (240 energies ranging from 0 to 24*Te) and 90
-    # columns (one for each angle between 0 and 90)
+@functools.lru_cache()
+def _get_IEAD_particle_starts_and_directions(geometry_mode, N_e, angles):
     particle_directions = []
     particle_starting_positions = []
 
-    # we want the particles to strike the target halfway up the left side,
-    # coming from the left.
-    top_left_corner, bottom_left_corner, _, _ = get_target_boundary_points()
-    mesh_strike_point = get_midpoint(top_left_corner, bottom_left_corner)
+    strike_point = get_strike_point(geometry_mode)
 
     # Rotate just a tad to avoid gimball lock (x-direction cannot equal 1 )
-    directions = [rotate(angle_to_dir(x), 0.0001) for x in range(90)]
-    N_e = 240
+    directions = [rotate(angle_to_dir(x), 0.0001) for x in angles]
+    starts = [get_particle_start(strike_point, d, geometry_mode) for d in directions]
     for _ in range(N_e):
-        for theta in range(90):
+        for theta in range(len(angles)):
             particle_directions.append(directions[theta])
-            particle_starting_positions.append(mesh_strike_point - directions[theta])
+            particle_starting_positions.append(starts[theta])
 
+    return particle_starting_positions, particle_directions
 
-    machine_workloads = iter(get_simulations_per_machine().items())
-    machine_name, machine_capacity = next(machine_workloads)
-    simulations_assigned = 0
 
-    conversion_factor_files = {}
-    for SimID in glob.glob('hpic_results/*'):
-        if SimID == 'hpic_results/p2c.csv':
-            continue
-        dataset_for_sim = common.get_dataset_from_SimID(SimID)
-        SimLsep = common.get_Lsep_from_SimID(SimID)
-        Te = get_Te_for_Lsep(SimLsep, solps_data[dataset_for_sim])
-
-        for IEADfile in glob.glob(SimID + '/*_IEAD_*.dat'):
-            # Get this species name
-            iead_label = re.search('IEAD_sp[0-9]{1,2}', IEADfile).group()
-            species_label = iead_label.split('_')[1]
-            ion_name = ion_names[species_label]
-            if ion_name in SKIP_IONS:
-                continue
-
-
-            # include the output dir in the Sim name so the results get saved
-            # to the subdirectory
-            SimID = SimID.replace("hpic_results/", "")
-            RustBCA_SimID = f'{SBE_label}/{SimID}{ion_name}/'
-            util.mkdir(RustBCA_SimID)
-            rustbca_input_file =  f'{output_dir}/{RustBCA_SimID}{machine_name}-input.toml'
-            IEAD = np.genfromtxt(IEADfile, delimiter = ' ')
-
-            # Multiply each count in the IEAD by a factor to each a total
-            # number of simulation particles to count as a "high resolution"
-            # simulation
-            factor = 1
-            if np.sum(IEAD) == 0:
-                print(
-                    f'Warning Iead file: "{IEADfile}" empty, no Rustbca '
-                    + 'simulation will be run.',
-                )
-                continue
-            elif np.sum(IEAD) < 1e6:
-               factor = np.ceil(1e6/np.sum(IEAD))
-
-            # Save the conversion factor
-            if ion_name not in conversion_factor_files:
-                fname = f'rustbca_conversion_factors/{ion_name}.csv'
-                f =  open(fname, 'w+')
-                conversion_factor_files[ion_name] = f
-            conversion_factor_file = conversion_factor_files[ion_name]
-            conversion_factor_file.write(f'{RustBCA_SimID},{factor}\n')
-
-            simulations_assigned += 1
-            if simulations_assigned == machine_capacity:
-                simulations_assigned = 0
-                try:
-                    machine_name, machine_capacity = next(machine_workloads)
-                except StopIteration:
-                    pass
+def get_geometry(rustbca_config):
+    """
+    Target geometry from the rustbca.geometry section of config.yaml:
+    {'mode': '0D'|'1D'|'2D', 'layers': [...]} (layers are 1D only)
+    """
+    geometry = dict(rustbca_config.get('geometry', {}))
+    geometry['mode'] = str(geometry.get('mode', '2D')).upper()
+    if geometry['mode'] not in GEOMETRY_MODES:
+        print(f'unknown rustbca.geometry.mode: "{geometry["mode"]}" (0D|1D|2D)')
+        sys.exit(1)
+    if geometry['mode'] == '1D':
+        geometry['layers'] = geometry.get('layers') or DEFAULT_LAYERS
+        for layer in geometry['layers']:
+            if layer.get('thickness', 0) <= 0:
+                print(f'rustbca.geometry.layers: every layer needs a positive thickness, got {layer}')
+                sys.exit(1)
+    return geometry
+
+
+def get_geometry_mode(input_filename):
+    """
+    The geometry mode an input file was built for (see generate_rustbca_input).
+    Input files from before geometry modes existed are 2D.
+    """
+    with open(input_filename, 'r') as f:
+        first_line = f.readline()
+    if first_line.startswith(_GEOMETRY_MODE_PREFIX):
+        return first_line[len(_GEOMETRY_MODE_PREFIX):].strip()
+    return '2D'
 
-            continue
-            incident_ion = incident_ions[ion_name]
-            particle_parameters = get_particle_parameters_from_IEAD(
+
+def get_surface_x(geometry_mode):
+    """
+    x-coordinate of the target surface the incident particles strike. The
+    target is at larger x.
+    """
+    return get_strike_point(geometry_mode)[0]
+
+
+def build_simulation_input(
+        IEAD,
+        Te,
+        ion_name,
+        lithium_surface_binding_energy,
+        RustBCA_SimID,
+        output_dir,
+        input_filename,
+        nthreads,
+        particle_allocation = 'uniform',
+        N_total = HIGH_RESOLUTION_N,
+        example = False,
+        particle_input = 'toml',
+        distribution_bins = None,
+        geometry = None,
+        IEAD_filename = None,
+        machine_name = None,
+        grid = iead.DEFAULT_GRID,
+        num_chunks = NUM_CHUNKS,
+        write_buffer_size = WRITE_BUFFER_SIZE,
+        sampled_counts = None):
+    """
+    Write the RustBCA input file for a single IEAD (and its strata.csv, for
+    importance-sampled simulations).
+
+    :param: N_total: for "uniform" allocation, the minimum number of total
+        simulation particles. For "importance" allocation, the particle
+        budget.
+    :param: sampled_counts: for "uniform" allocation, simulation particles
+        per IEAD bin to use instead of multiplying the IEAD by a factor, e.g.
+        a sample of the IEAD smaller than the IEAD itself (see
+        run_rustbca_batches.sample_IEAD). N_total is then ignored.
+    :param: particle_input: "toml" or "hdf5" (see generate_rustbca_input)
+    :param: distribution_bins: see generate_rustbca_input
+    :param: geometry: see get_geometry. Defaults to the 2D mesh.
+    :param: IEAD_filename, machine_name: only recorded in the manifest (see
+        write_manifest)
+    :param: grid: the IEAD's bins (see iead.load_IEAD)
+    :param: num_chunks, write_buffer_size: see rustbca_tuning.py
+    :returns: the conversion factor, i.e. simulation particles per real
+        incident ion.
+    """
+    incident_ion = incident_ions[ion_name]
+
+    # Multiply each count in the IEAD by a factor to each a total
+    # number of simulation particles to count as a "high resolution"
+    # simulation
+    factor = 1
+    if np.sum(IEAD) < N_total:
+        factor = np.ceil(N_total/np.sum(IEAD))
+
+    counts = None
+    if particle_allocation == 'importance':
+        with profiling.span('importance sampling', 'compute'):
+            counts, weights = get_importance_sampled_counts(
+                IEAD,
+                get_incident_energies(Te, grid),
+                incident_ion,
+                lithium_surface_binding_energy,
+                N_total = N_total,
+            )
+        with profiling.span('strata.csv', 'write'):
+            write_strata_file(
+                f'{output_dir}/{RustBCA_SimID}strata.csv',
+                counts,
+                weights,
+            )
+        # The sputtering yield is computed from the per-bin weights
+        # in strata.csv. Keep the average factor for reference.
+        factor = np.sum(counts) / np.sum(IEAD)
+
+    geometry = geometry or {'mode': '2D'}
+    with profiling.span('particle parameters', 'compute'):
+        particle_starting_positions, particle_directions = get_IEAD_particle_starts_and_directions(
+            geometry['mode'],
+            grid,
+        )
+        particle_parameters = get_particle_parameters_from_IEAD(
+            IEAD if sampled_counts is None else sampled_counts,
+            Te,
+            incident_ion,
+            particle_starting_positions,
+            particle_directions,
+            example = example,
+            factor = factor if sampled_counts is None else 1,
+            counts = counts,
+            grid = grid,
+        )
+
+    generate_rustbca_input(
+        RustBCA_SimID,
+        particle_parameters,
+        num_chunks,
+        nthreads,
+        input_filename,
+        lithium_surface_binding_energy = lithium_surface_binding_energy,
+        particle_input = particle_input,
+        distribution_bins = distribution_bins,
+        geometry = geometry,
+        write_buffer_size = write_buffer_size,
+    )
+
+    if counts is None and sampled_counts is not None:
+        N_simulated = np.sum(np.asarray(sampled_counts).astype(int))
+        factor = N_simulated / np.sum(IEAD)
+    elif counts is None:
+        N_simulated = np.sum((IEAD.flatten() * factor).astype(int))
+        # A rebinned IEAD (see iead.rebin) holds fractional counts, which
+        # lose their fractional particles above. Record the factor actually
+        # simulated, so N is still IEAD total x factor.
+        factor = N_simulated / np.sum(IEAD)
+    else:
+        N_simulated = np.sum(counts)
+    with profiling.span('manifest', 'write'):
+        write_manifest(
+            input_filename,
+            IEAD_filename,
+            np.sum(IEAD),
+            factor,
+            N_simulated,
+            machine_name,
+            grid = grid,
+        )
+    return factor
+
+
+def build_combined_simulation_input(
+        IEADs,
+        Te,
+        lithium_surface_binding_energy,
+        RustBCA_SimID,
+        output_dir,
+        input_filename,
+        nthreads,
+        particle_allocation = 'uniform',
+        N_total = HIGH_RESOLUTION_N,
+        example = False,
+        particle_input = 'toml',
+        geometry = None,
+        IEAD_filenames = None,
+        machine_name = None,
+        grid = iead.DEFAULT_GRID,
+        num_chunks = NUM_CHUNKS,
+        write_buffer_size = WRITE_BUFFER_SIZE):
+    """
+    Write ONE RustBCA input file holding every species of a simulation
+    (rustbca.combine_species), instead of one per species, and its
+    strata.csv.
+
+    Each species gets the particles build_simulation_input would give it
+    (N_total is per species). Its bins are tagged from its own block of tags
+    (see SPECIES_TAG_STRIDE), and strata.csv records the species and the
+    weight of every tag, so physical_sputtering_amount.py can split the
+    sputtered particles by species again. With uniform allocation, the
+    weight of each bin is 1 / factor.
+
+    :param: IEADs: dictionary of ion name -> IEAD, in incident_ions order
+    :param: IEAD_filenames: ion name -> IEAD filename, for the manifest
+    :param: grid: the bins every IEAD is on (see iead.load_IEAD)
+    :param: num_chunks, write_buffer_size: see rustbca_tuning.py
+    :returns: dictionary of ion name -> conversion factor
+    """
+    geometry = geometry or {'mode': '2D'}
+    particle_starting_positions, particle_directions = get_IEAD_particle_starts_and_directions(
+        geometry['mode'],
+        grid,
+    )
+
+    species_ions = list(incident_ions)
+    N_e, N_a = iead.get_shape(grid)
+    tag_stride = max(SPECIES_TAG_STRIDE, N_e * N_a)
+    factors = {}
+    species_strata = []
+    parameter_sets = []
+    for ion_name, IEAD in IEADs.items():
+        incident_ion = incident_ions[ion_name]
+        tag_offset = species_ions.index(ion_name) * tag_stride
+
+        with profiling.span('particle counts', 'compute'):
+            if particle_allocation == 'importance':
+                counts, weights = get_importance_sampled_counts(
+                    IEAD,
+                    get_incident_energies(Te, grid),
+                    incident_ion,
+                    lithium_surface_binding_energy,
+                    N_total = N_total,
+                )
+            else:
+                factor = 1
+                if np.sum(IEAD) < N_total:
+                    factor = np.ceil(N_total/np.sum(IEAD))
+                real_counts = IEAD.flatten().astype(float)
+                counts = (real_counts * factor).astype(int)
+                weights = np.zeros_like(real_counts)
+                weights[counts > 0] = real_counts[counts > 0] / counts[counts > 0]
+        factors[ion_name] = np.sum(counts) / np.sum(IEAD)
+        species_strata.append((ion_name, tag_offset, counts, weights))
+
+        with profiling.span('particle parameters', 'compute'):
+            parameter_sets.append(get_particle_parameters_from_IEAD(
                 IEAD,
                 Te,
                 incident_ion,
                 particle_starting_positions,
                 particle_directions,
                 example = example,
-                factor = factor,
-            )
+                counts = counts,
+                tag_offset = tag_offset,
+                grid = grid,
+            ))
 
-            num_chunks = 100
-            nthreads = machine_core_counts[machine_name]
+    with profiling.span('strata.csv', 'write'):
+        write_species_strata_file(f'{output_dir}/{RustBCA_SimID}strata.csv', species_strata)
 
-            generate_rustbca_input(
-                RustBCA_SimID,
-                particle_parameters,
-                num_chunks,
-                nthreads,
-                rustbca_input_file,
-                lithium_surface_binding_energy = lithium_surface_binding_energy,
-            )
+    generate_rustbca_input(
+        RustBCA_SimID,
+        concatenate_particle_parameters(parameter_sets),
+        num_chunks,
+        nthreads,
+        input_filename,
+        lithium_surface_binding_energy = lithium_surface_binding_energy,
+        particle_input = particle_input,
+        geometry = geometry,
+        write_buffer_size = write_buffer_size,
+    )
 
-    for f in conversion_factor_files.values():
-        f.close()
+    IEAD_total = sum(np.sum(IEAD) for IEAD in IEADs.values())
+    N_simulated = sum(np.sum(counts) for _, _, counts, _ in species_strata)
+    with profiling.span('manifest', 'write'):
+        write_manifest(
+            input_filename,
+            [IEAD_filenames[ion_name] for ion_name in IEADs] if IEAD_filenames else None,
+            IEAD_total,
+            N_simulated / IEAD_total,
+            N_simulated,
+            machine_name,
+            species = list(IEADs),
+            grid = grid,
+        )
+    return factors
+
+
+def get_file_hash(filename):
+    """
+    sha256 of a file, read in blocks so large inputs never sit in memory.
+    """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def write_manifest(
+        input_filename,
+        IEAD_filename,
+        IEAD_total,
+        factor,
+        N,
+        machine_name,
+        species = None,
+        grid = None):
+    """
+    Record what went into an input file in MANIFEST_FILENAME next to it, so
+    the input can be verified (verify_total_counts.py) without parsing it.
 
+    N is the total number of simulation particles, and the hashes let the
+    verifier tell whether the input or its particles.h5 changed since.
+    Inputs holding several species list their IEAD files and species. The
+    IEAD grid the input was built on is recorded as bin edges.
+    """
+    dirname = os.path.dirname(input_filename)
+    particle_filename = os.path.join(dirname, 'particles.h5')
+    manifest = {
+        'input_file': os.path.basename(input_filename),
+        'input_sha256': get_file_hash(input_filename),
+        'particles_sha256': (
+            get_file_hash(particle_filename) if os.path.exists(particle_filename) else None
+        ),
+        'IEAD_file': IEAD_filename,
+        'IEAD_total': float(IEAD_total),
+        'factor': float(factor),
+        'N': int(N),
+        'machine': machine_name,
+    }
+    if species is not None:
+        manifest['species'] = species
+    if grid is not None:
+        manifest['IEAD_grid'] = iead.describe_grid(grid)
+    with open(os.path.join(dirname, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent = 4)
 
-def format_single_calibration_file(lithium_surface_binding_energy):
+
+def get_build_settings(config, lithium_surface_binding_energy, example = False):
     """
-    I'm having a difficult time finding an accurate value for energy
-    barrier thickness for liquid lithium. So instead I'm going to take JP's
-    2003 paper on Liquid lithium sputtering rates, and fine tune a simulation
-    until I can get similar results to his.
+    Everything build_hpic_simulation_inputs needs that's the same for every
+    hPIC simulation: the rustbca options of config.yaml, the SOLPS data and
+    the machines' RustBCA capacities
     """
+    output_dir = f'rustbca_simulations'
+    if example:
+        output_dir = f'rustbca_simulation_examples'
 
-    output_dir = 'rustbca_simulations'
-    util.mkdir(output_dir)
+    # How simulation particles are distributed across IEAD bins.
+    rustbca_config = config.get('rustbca', {})
+    particle_allocation = rustbca_config.get('particle_allocation', 'uniform')
+    if particle_allocation not in ('uniform', 'importance'):
+        print(f'unknown rustbca.particle_allocation: "{particle_allocation}" (uniform|importance)')
+        sys.exit(1)
+    if particle_allocation == 'importance':
+        N_total = rustbca_config.get('importance_sampling_N', IMPORTANCE_SAMPLING_N)
+    else:
+        N_total = HIGH_RESOLUTION_N
 
-    # include the outut directory in the simulation name so RustBCA
-    # saves the data in the subdirectory.
-    SimID = output_dir + f'/he_on_liquid_lithium_calibration/SBE_{int(lithium_surface_binding_energy)}eV/'
-    util.mkdir(SimID)
-    rustbca_input_filename = SimID + 'input.toml'
+    solps_data = {}
+    for data_set_label, datafile in common.DATAFILES.items():
+        with profiling.span(f'SOLPS {data_set_label}', 'load'):
+            solps_data[data_set_label] = util.load_solps_data(datafile)
+
+    # Measured by host_capabilities.py and rustbca_tuning.py, if the hosts
+    # were calibrated or tuned
+    core_counts, capacities = host_capabilities.get_rustbca_capacities(machine_core_counts)
+    return {
+        'config': config,
+        'lithium_surface_binding_energy': lithium_surface_binding_energy,
+        'SBE_label': get_SBE_label(lithium_surface_binding_energy),
+        'example': example,
+        'output_dir': output_dir,
+        # Pin down species names in a config file so we're never wondering
+        # what ion "sp4" is.
+        'ion_names': common.invert_ion_map(config['ions']),
+        'particle_allocation': particle_allocation,
+        'N_total': N_total,
+        'particle_input': get_particle_input_format(rustbca_config),
+        'distribution_bins': get_output_format(rustbca_config),
+        'geometry': get_geometry(rustbca_config),
+        'combine_species': get_combine_species(rustbca_config),
+        'solps_data': solps_data,
+        'core_counts': core_counts,
+        'capacities': capacities,
+        'run_parameters': rustbca_tuning.get_run_parameters(),
+    }
 
-    # Number of incident He ions in simulation
-    N = 10000
 
+def build_hpic_simulation_inputs(simdir, settings, machines):
+    """
+    Build the RustBCA inputs of one hPIC simulation: one per species, or one
+    for all of them (rustbca.combine_species)
+
+    :param: simdir: hpic_results/<SimID>
+    :param: settings: see get_build_settings
+    :param: machines: iterator of the machine to build each input for (see
+        iter_machine_assignments)
+    :returns: list of (ion name, RustBCA SimID, machine name, conversion
+        factor), one per species
+    """
+    Te = get_Te_for_Lsep(
+        common.get_Lsep_from_SimID(simdir),
+        settings['solps_data'][common.get_dataset_from_SimID(simdir)],
+    )
+    output_dir = settings['output_dir']
+    SBE_label = settings['SBE_label']
+
+    IEADs = {}
+    IEAD_filenames = {}
+    grids = {}
+    for IEADfile in glob.glob(simdir + '/*_IEAD_*.dat'):
+        # Get this species name
+        iead_label = re.search('IEAD_sp[0-9]{1,2}', IEADfile).group()
+        species_label = iead_label.split('_')[1]
+        ion_name = settings['ion_names'][species_label]
+        if ion_name in SKIP_IONS:
+            continue
+
+        with profiling.span('IEAD', 'parse'):
+            IEAD, grid = iead.load_IEAD(IEADfile, settings['config'])
+        if np.sum(IEAD) == 0:
+            print(
+                f'Warning Iead file: "{IEADfile}" empty, no Rustbca '
+                + 'simulation will be run.',
+            )
+            continue
+        IEADs[ion_name] = IEAD
+        IEAD_filenames[ion_name] = IEADfile
+        grids[ion_name] = grid
+
+    # include the output dir in the Sim name so the results get saved
+    # to the subdirectory
+    SimID = simdir.replace("hpic_results/", "")
+
+    if settings['combine_species']:
+        # One input for all species, in incident_ions order
+        IEADs = {ion_name: IEADs[ion_name] for ion_name in incident_ions if ion_name in IEADs}
+        if not IEADs:
+            return []
+        grid = grids[next(iter(IEADs))]
+        if any(grids[ion_name] != grid for ion_name in IEADs):
+            print(f'the IEADs of {SimID} are on different grids, they cannot be combined')
+            sys.exit(1)
+        machine_name = next(machines)
+        RustBCA_SimID = f'{SBE_label}/{SimID}/'
+        util.mkdir(f'{output_dir}/{RustBCA_SimID}')
+        factors = build_combined_simulation_input(
+            IEADs,
+            Te,
+            settings['lithium_surface_binding_energy'],
+            RustBCA_SimID,
+            output_dir,
+            f'{output_dir}/{RustBCA_SimID}{machine_name}-input.toml',
+            settings['core_counts'][machine_name],
+            particle_allocation = settings['particle_allocation'],
+            N_total = settings['N_total'],
+            example = settings['example'],
+            particle_input = settings['particle_input'],
+            geometry = settings['geometry'],
+            IEAD_filenames = IEAD_filenames,
+            machine_name = machine_name,
+            grid = grid,
+            **settings['run_parameters'].get(machine_name, {}),
+        )
+        return [(ion_name, RustBCA_SimID, machine_name, factor) for ion_name, factor in factors.items()]
+
+    built = []
+    for ion_name, IEAD in IEADs.items():
+        machine_name = next(machines)
+        RustBCA_SimID = f'{SBE_label}/{SimID}{ion_name}/'
+        util.mkdir(f'{output_dir}/{RustBCA_SimID}')
+        rustbca_input_file =  f'{output_dir}/{RustBCA_SimID}{machine_name}-input.toml'
+
+        factor = build_simulation_input(
+            IEAD,
+            Te,
+            ion_name,
+            settings['lithium_surface_binding_energy'],
+            RustBCA_SimID,
+            output_dir,
+            rustbca_input_file,
+            settings['core_counts'][machine_name],
+            particle_allocation = settings['particle_allocation'],
+            N_total = settings['N_total'],
+            example = settings['example'],
+            particle_input = settings['particle_input'],
+            distribution_bins = settings['distribution_bins'],
+            geometry = settings['geometry'],
+            IEAD_filename = IEAD_filenames[ion_name],
+            machine_name = machine_name,
+            grid = grids[ion_name],
+            **settings['run_parameters'].get(machine_name, {}),
+        )
+        built.append((ion_name, RustBCA_SimID, machine_name, factor))
+    return built
+
+
+@profiling.profiled('build_rustbca_input_files')
+def main():
+    lithium_surface_binding_energy = LITHIUM_SURFACE_BINDING_ENERGIES['low']
+    if len(sys.argv) >= 2:
+        lithium_surface_binding_energy = parse_surface_binding_energy(sys.argv[1])
+        if lithium_surface_binding_energy is None:
+            print('usage: python build_rustbca_input_files.py (high|low|<SBE_eV>) [example]')
+            sys.exit(1)
+
+    example = False
+    if len(sys.argv) == 3:
+        if sys.argv[2].lower() != 'example':
+            print('usage: python build_rustbca_input_files.py (high|low|<SBE_eV>) [example]')
+            sys.exit(1)
+        else:
+            example = True
+
+    config = util.load_yaml(common._CONFIG_FILENAME)
+    settings = get_build_settings(config, lithium_surface_binding_energy, example)
+    util.mkdir(settings['output_dir'])
+
+    if SKIP_IONS:
+        print(f'\nSKIPPING the following ions: {SKIP_IONS}\n')
+
+    # Combined inputs hold all species, so there are fewer simulations to
+    # spread across the machines
+    machines = iter_machine_assignments(
+        TOTAL_SIMULATIONS // len(incident_ions) if settings['combine_species'] else TOTAL_SIMULATIONS,
+        settings['capacities'],
+    )
+    conversion_factor_files = {}
+    for simdir in glob.glob('hpic_results/*'):
+        if simdir == 'hpic_results/p2c.csv':
+            continue
+        for ion_name, RustBCA_SimID, _, factor in build_hpic_simulation_inputs(simdir, settings, machines):
+            write_conversion_factor(conversion_factor_files, ion_name, RustBCA_SimID, factor)
+
+    for f in conversion_factor_files.values():
+        f.close()
+
+
+def get_calibration_particle_parameters(N):
+    """
+    N He ions at 700 eV and 80 degrees, as in JP's 2003 paper on liquid
+    lithium sputtering rates
+    """
     # Figures specific to JP's paper
     # [eV]
     He_incident_E = 700
@@ -516,15 +1447,101 @@ def format_single_calibration_file(lithium_surface_binding_energy):
     particle_starting_positions = [mesh_strike_point - He_incident_dir]
     particle_incident_energies = [He_incident_E]
 
-    particle_parameters = get_particle_parameters(
+    return get_particle_parameters(
         Helium,
         particle_starting_positions,
         particle_directions,
         particle_incident_energies,
         N,
     )
+
+
+def build_host_benchmark_input(input_filename, N, geometry = None):
+    """
+    Small single-threaded RustBCA input timed on each host by
+    benchmark_host.py (see host_capabilities.py), which points "name" at
+    its own output directories.
+    """
+    generate_rustbca_input(
+        'calibration/',
+        get_calibration_particle_parameters(N),
+        min(N, 10),
+        1,
+        input_filename,
+        geometry = geometry,
+    )
+
+
+def build_tuning_input(input_filename, IEAD, Te, ion_name, N, grid = iead.DEFAULT_GRID, geometry = None):
+    """
+    Representative RustBCA input timed by tune_rustbca.py (see
+    rustbca_tuning.py): a real IEAD, importance-sampled down to about N
+    particles, single-threaded. tune_rustbca.py sets the run parameters and
+    points "name" at its own output directories.
+
+    :returns: the number of simulation particles
+    """
+    incident_ion = incident_ions[ion_name]
+    lithium_surface_binding_energy = LITHIUM_SURFACE_BINDING_ENERGIES['low']
+    counts, _ = get_importance_sampled_counts(
+        IEAD,
+        get_incident_energies(Te, grid),
+        incident_ion,
+        lithium_surface_binding_energy,
+        N_total = N,
+    )
+    geometry = geometry or {'mode': '2D'}
+    particle_starting_positions, particle_directions = get_IEAD_particle_starts_and_directions(
+        geometry['mode'],
+        grid,
+    )
+    generate_rustbca_input(
+        'tuning/',
+        get_particle_parameters_from_IEAD(
+            IEAD,
+            Te,
+            incident_ion,
+            particle_starting_positions,
+            particle_directions,
+            counts = counts,
+            grid = grid,
+        ),
+        NUM_CHUNKS,
+        1,
+        input_filename,
+        lithium_surface_binding_energy = lithium_surface_binding_energy,
+        geometry = geometry,
+    )
+    return int(np.sum(counts))
+
+
+def format_single_calibration_file(lithium_surface_binding_energy):
+    """
+    I'm having a difficult time finding an accurate value for energy
+    barrier thickness for liquid lithium. So instead I'm going to take JP's
+    2003 paper on Liquid lithium sputtering rates, and fine tune a simulation
+    until I can get similar results to his.
+    """
+
+    output_dir = 'rustbca_simulations'
+    util.mkdir(output_dir)
+
+    # include the outut directory in the simulation name so RustBCA
+    # saves the data in the subdirectory.
+    SimID = output_dir + f'/he_on_liquid_lithium_calibration/{get_SBE_label(lithium_surface_binding_energy)}/'
+    util.mkdir(SimID)
+    rustbca_input_filename = SimID + 'input.toml'
+
+    # Number of incident He ions in simulation
+    N = 10000
+    particle_parameters = get_calibration_particle_parameters(N)
     num_chunks = min(N, 10)
     nthreads = 12
+
+    # This is also the quickest way to try out the HDF5 particle input on a
+    # local RustBCA build (see README)
+    config = util.load_yaml(common._CONFIG_FILENAME)
+    particle_input = get_particle_input_format(config.get('rustbca', {}))
     generate_rustbca_input(
         SimID,
         particle_parameters,
@@ -532,12 +1549,21 @@ def format_single_calibration_file(lithium_surface_binding_energy):
         nthreads,
         rustbca_input_filename,
         lithium_surface_binding_energy = lithium_surface_binding_energy,
+        particle_input = particle_input,
     )
 
 
 
+def calibrate():
+    if len(sys.argv) < 2:
+        print('usage: python build_rustbca_input_files.py calibrate <SURFACE_BINDING_ENERGY_eV>')
+        sys.exit(1)
+    format_single_calibration_file(float(sys.argv[1]))
+
+
 if __name__ == '__main__':
     if len(sys.argv) > 1 and sys.argv[1].lower() == 'calibrate':
-        format_single_calibration_file(float(sys.argv[2]))
+        del sys.argv[1]
+        calibrate()
         sys.exit(0)
     main()
@@ -1,9 +1,12 @@
 import sys
 import os
 import stat
-from gyroradius import gyroradius_for_row
-from debye_length import compute_debye_length_for_row
+import shutil
+from plasma_parameters import gyroradius_for_row, compute_debye_length_for_row
 import util
+import profiling
+import run_job
+import hpic_status
 from common import DATAFILES, _MACHINE_ASSIGNMENTS_FILE, _ions_of_interest, _CONFIG_FILENAME
 import scientific_constants as sc
 import yaml
@@ -30,6 +33,23 @@ _KFLUID = 10 # Number of times fluid data is saved
 _NGyro = 10  # Number of Gyroradii per domain
 
 
+"""
+What to do with bulky hPIC outputs once a simulation completes
+(hpic_output in the config):
+    keep:     nothing
+    compress: gzip them
+    delete:   delete them
+Outputs are matched by name, *<PATTERN>*. IEADs, hpic.log and the
+simulation-* status files are never touched.
+"""
+_PRUNE_POLICIES = ('keep', 'compress', 'delete')
+_PRUNE_PATTERNS = ['ENERGY', 'RHS', 'TIMESERIES', 'PHI', 'PARTICLEDATA', 'SPECIES']
+
+# Written next to the outputs after pruning: policy, number of files,
+# bytes before and after. Summed up by check_hpic_status.sh / hpic_status.py.
+PRUNE_REPORT_FILENAME = 'simulation-pruned'
+
+
 def get_domain_debye_lengths(df_row, ngyro, debye_length, rg):
     """
     :param: df_row: a single row of SOLPS output data
@@ -160,14 +180,55 @@ def get_simulation_id(data_set_label, df_row):
     return simulation_id
 
 
+def get_prune_config(config):
+    """
+    :returns: (policy, patterns) from the hpic_output section of the config
+    """
+    hpic_output = config.get('hpic_output') or {}
+    policy = hpic_output.get('policy', 'keep')
+    if policy not in _PRUNE_POLICIES:
+        print(f'unknown hpic_output.policy: "{policy}" ({"|".join(_PRUNE_POLICIES)})')
+        sys.exit(1)
+    return policy, hpic_output.get('patterns', _PRUNE_PATTERNS)
+
+
+def format_prune_commands(policy, patterns):
+    """
+    Shell commands, run in the simulation directory right after
+    simulation-complete is written, which compress or delete the bulky
+    outputs and write PRUNE_REPORT_FILENAME.
+    """
+    if policy == 'keep' or not patterns:
+        return ''
+
+    name_tests = ' -o '.join(f"-name '*{pattern}*'" for pattern in patterns)
+    action = '-delete' if policy == 'delete' else '-exec gzip -f {} +'
+    return f'''
+    # Prune bulky outputs (hpic_output.policy: {policy})
+    before=$(du -sb . | cut -f1)
+    pruned=$(find . -maxdepth 1 -type f \\( {name_tests} \\) ! -name '*IEAD*' ! -name hpic.log ! -name 'simulation-*' ! -name '*.gz' | wc -l)
+    find . -maxdepth 1 -type f \\( {name_tests} \\) ! -name '*IEAD*' ! -name hpic.log ! -name 'simulation-*' ! -name '*.gz' {action}
+    after=$(du -sb . | cut -f1)
+    echo "{policy} $pruned $before $after" > {PRUNE_REPORT_FILENAME}'''
+
+
+def get_retry_options(config):
+    """
+    :returns: run_job.py options from the retry section of the config
+    """
+    return run_job.format_options(config.get('retry') or {})
+
+
 def mkdir(dirname):
     if not os.path.exists(dirname):
         os.mkdir(dirname)
 
 
+@profiling.profiled('configure_simulations')
 def main():
     # Load config
-    config = util.load_yaml(_CONFIG_FILENAME)
+    with profiling.span('config', 'load'):
+        config = util.load_yaml(_CONFIG_FILENAME)
     ngyro = config.get('ngyro')
     hpic_params = config.get('hpic_params', {})
     ions = config.get('ions')
@@ -195,9 +256,13 @@ def main():
         if sys.argv[1] != 'configure-total-pushes-script':
             print('usage: python configure_simulations.py [configure-total-pushes-script]')
             return
-        build_prelim_bash_script(hpic_commands)
+        with profiling.span('prelim script', 'write'):
+            build_prelim_bash_script(hpic_commands)
     else:
-        build_simulation_bash_scripts(hpic_commands)
+        prune_policy, prune_patterns = get_prune_config(config)
+        retry_options = get_retry_options(config)
+        with profiling.span('simulation scripts', 'write'):
+            build_simulation_bash_scripts(hpic_commands, prune_policy, prune_patterns, retry_options)
 
 
 def append_to_hpic_commands(
@@ -209,17 +274,19 @@ def append_to_hpic_commands(
 
         hpic_commands):
 
-    df = util.load_solps_data(datafile)
-    for index, row in df.iterrows():
-        SimID = get_simulation_id(data_set_label, row)
-        hpic_command_line_args = format_hPIC_command(
-            row,
-            SimID,
-            hpic_params,
-            ngyro,
-            ion_list,
-        )
-        hpic_commands[SimID] = hpic_command_line_args
+    with profiling.span(f'SOLPS {data_set_label}', 'load'):
+        df = util.load_solps_data(datafile)
+    with profiling.span(f'hPIC commands {data_set_label}', 'compute'):
+        for index, row in df.iterrows():
+            SimID = get_simulation_id(data_set_label, row)
+            hpic_command_line_args = format_hPIC_command(
+                row,
+                SimID,
+                hpic_params,
+                ngyro,
+                ion_list,
+            )
+            hpic_commands[SimID] = hpic_command_line_args
 
 
 def build_prelim_bash_script(hpic_commands):
@@ -255,12 +322,28 @@ def build_prelim_bash_script(hpic_commands):
     util.make_executable(prelim_script_name)
 
 
-def build_simulation_bash_scripts(hpic_commands):
+def build_simulation_bash_scripts(
+        hpic_commands,
+        prune_policy = 'keep',
+        prune_patterns = _PRUNE_PATTERNS,
+        retry_options = ''):
     machine_assignments = util.load_yaml(_MACHINE_ASSIGNMENTS_FILE)
+    prune_commands = format_prune_commands(prune_policy, prune_patterns)
+    if prune_commands:
+        # Only once, right after the run that completed the simulation
+        prune_commands = f'''
+if [ $? -eq 0 ] && [ ! -f {PRUNE_REPORT_FILENAME} ]; then{prune_commands}
+fi'''
 
     base_dir = 'remote_scripts/generated'
     util.mkdir(base_dir)
 
+    # Every simulation runs through run_job.py, which is sent to the hosts
+    # along with the scripts, and so is hpic_status.py, for
+    # check_hpic_status.sh
+    shutil.copy(run_job.__file__, base_dir)
+    shutil.copy(hpic_status.__file__, base_dir)
+
     for machine_name, assignments in machine_assignments.items():
         # create new bash scripts for commands. one hpic simulation is one line in the
         # bash script.
@@ -303,13 +386,12 @@ i=0
             simulation_script.write(f'''
 #!/usr/bin/env bash
 
-# Run the simulation for {SimID}
+# Run the simulation for {SimID}, retrying it if it fails. run_job.py
+# writes simulation-start/-complete/-failed, and skips the simulation if it's
+# already complete or running.
+RUN_JOB="$(cd "$(dirname "$0")" && pwd)/run_job.py"
 cd {simulation_dir}
-date +%Y-%m-%dT%H:%M:%S-%Z > simulation-start
-{hpic_command} > hpic.log 2>&1
-if [ $? -eq 0 ]; then
-    date +%Y-%m-%dT%H:%M:%S-%Z > simulation-complete
-fi
+python3 "$RUN_JOB" --log=hpic.log {retry_options} -- {hpic_command}{prune_commands}
 ''')
 
             simulation_script.close()
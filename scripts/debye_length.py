@@ -1,38 +1,19 @@
 from common import _all_ions, get_data_set_label
 import util
 import sys
-import scientific_constants as sc
+from plasma_parameters import compute_debye_length_for_row
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 
 
-def compute_debye_length_for_row(df_row):
-    """
-    return the debye length for a row in meters.
-    """
-    # Assumption: the electron density is equal to the sum of
-    # all lithium, neon, and deuterium ion densities.
-    ne = df_row['nD+1']
-
-    Te = df_row['Te (eV)']
-
-    # Compute the debye length [m]
-    debye_length = np.sqrt(sc.eps0 * Te / (sc.qe * ne))
-    return debye_length
-
-
 def compute_debye_lengths(df):
     """
     return a 2-column np array. column 1 = Lsep, column2 = debye length (m)
     """
     D = np.zeros((len(df), 2))
-    for n, row in df.iterrows():
-        Lsep = row['L-Lsep (m)']
-        debye_length = compute_debye_length_for_row(row)
-
-        D[n][0] = Lsep
-        D[n][1] = debye_length
+    D[:, 0] = df['L-Lsep (m)'].to_numpy()
+    D[:, 1] = compute_debye_length_for_row(df)
 
     # Convert to a Dataframe for named columns
     columns = ['L-Lsep (m)', 'Debye Length (m)']
@@ -0,0 +1,164 @@
+import os
+import sys
+import gzip
+import shutil
+import numpy as np
+import pandas as pd
+import rustbca_output
+
+
+"""
+This script is meant to run on the LCPP boxes right after a RustBCA
+simulation completes (see remote_scripts/rustbca/launcher.sh).
+
+It converts each comma-separated list output (sputtered.output, ...) of a
+simulation directory into a binary columnar directory (sputtered.columns/,
+one <column>.npy per column), checks that no rows were lost, and optionally
+deletes or gzips the text version. Analysis scripts memory-map the columns
+(see rustbca_output.py) instead of parsing text.
+
+usage: python scripts/finalize_rustbca_outputs.py [--delete|--compress] <SIMDIR>...
+"""
+
+# Columns which need double precision. z holds the IEAD bin tag of
+# importance-sampled particles (build_rustbca_input_files.STRATUM_Z_SPACING)
+# on top of a sub-micron position. Everything else fits in float32.
+FLOAT64_COLUMNS = set(['z'])
+
+# Bytes read at a time when counting lines
+_READ_BLOCK = 1 << 24
+
+
+def count_rows(filename):
+    """
+    Number of non-empty lines in a text file, without parsing it.
+    """
+    rows = 0
+    last = b'\n'
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(_READ_BLOCK)
+            if not block:
+                break
+            rows += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        rows += 1
+    return rows
+
+
+def get_column_names(filename, kind):
+    """
+    Named columns (rustbca_output.OUTPUT_COLUMNS) followed by col<i> for any
+    extra trailing columns RustBCA writes.
+    """
+    with open(filename, 'r') as f:
+        ncols = len(f.readline().split(','))
+    names = list(rustbca_output.OUTPUT_COLUMNS[kind])[:ncols]
+    return names + [f'col{i}' for i in range(len(names), ncols)]
+
+
+def convert_output(filename, kind):
+    """
+    Convert one list output into <kind>.columns/<column>.npy.
+
+    :returns: the number of rows converted
+    """
+    nrows = count_rows(filename)
+    names = get_column_names(filename, kind)
+
+    dirname = rustbca_output.columnar_dirname(filename)
+    tmp_dirname = dirname + '.tmp'
+    if os.path.exists(tmp_dirname):
+        shutil.rmtree(tmp_dirname)
+    os.makedirs(tmp_dirname)
+
+    columns = {}
+    for name in names:
+        dtype = np.float64 if name in FLOAT64_COLUMNS else np.float32
+        columns[name] = np.lib.format.open_memmap(
+            os.path.join(tmp_dirname, f'{name}.npy'),
+            mode = 'w+',
+            dtype = dtype,
+            shape = (nrows,),
+        )
+
+    converted = 0
+    reader = pd.read_csv(
+        filename,
+        header = None,
+        names = names,
+        dtype = np.float64,
+        chunksize = rustbca_output.CHUNK_ROWS,
+    )
+    for chunk in reader:
+        n = len(chunk)
+        if converted + n > nrows:
+            raise ValueError(f'{filename}: more rows parsed than lines counted')
+        for name in names:
+            columns[name][converted:converted + n] = chunk[name].to_numpy()
+        converted += n
+
+    if converted != nrows:
+        raise ValueError(f'{filename}: {nrows} lines, but {converted} rows converted')
+    for column in columns.values():
+        column.flush()
+    del columns
+
+    # Only replace a previous conversion once this one is known to be good
+    if os.path.exists(dirname):
+        shutil.rmtree(dirname)
+    os.rename(tmp_dirname, dirname)
+    return converted
+
+
+def compress_output(filename):
+    with open(filename, 'rb') as src, gzip.open(filename + '.gz', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(filename)
+
+
+def finalize_simulation(rustbca_simdir, text_policy = None):
+    """
+    :param: text_policy: None (keep the text outputs), 'delete' or 'compress'
+    """
+    for kind in rustbca_output.OUTPUT_COLUMNS:
+        filename = rustbca_output.output_filename(rustbca_simdir, kind)
+        if not os.path.exists(filename):
+            continue
+        if not os.path.getsize(filename):
+            # Nothing to convert, but make sure readers see an empty output
+            # if the text version goes away.
+            rows = 0
+            dirname = rustbca_output.columnar_dirname(filename)
+            os.makedirs(dirname, exist_ok = True)
+            for name in rustbca_output.OUTPUT_COLUMNS[kind]:
+                dtype = np.float64 if name in FLOAT64_COLUMNS else np.float32
+                np.save(os.path.join(dirname, f'{name}.npy'), np.zeros(0, dtype = dtype))
+        else:
+            rows = convert_output(filename, kind)
+
+        text_size = os.path.getsize(filename)
+        if text_policy == 'delete':
+            os.remove(filename)
+        elif text_policy == 'compress':
+            compress_output(filename)
+        print(f'{filename}: {rows} rows, {text_size} bytes of text converted')
+
+
+def main():
+    usage = 'usage: python finalize_rustbca_outputs.py [--delete|--compress] <SIMDIR>...'
+    args = sys.argv[1:]
+    text_policy = None
+    if args and args[0] in ('--delete', '--compress'):
+        text_policy = args.pop(0)[2:]
+    if not args:
+        print(usage)
+        sys.exit(1)
+
+    for rustbca_simdir in args:
+        finalize_simulation(rustbca_simdir, text_policy)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
-import pandas as pd
+import os
+import csv
 import glob
 import re
+import profiling
 
 """
 This script is to be fun after hPIC simulations are completed. The assumption
@@ -9,6 +11,8 @@ the log contains the p2c value (calculated by hPIC). We need the p2c value
 for obtaining accurate sputtering yields.
 """
 
+P2C_FILE = 'hpic_results/p2c.csv'
+
 
 def find_p2c_value(filename):
     """
@@ -26,18 +30,43 @@ def find_p2c_value(filename):
                 # block
                 return float(match.groups()[0])
 
+def read_p2c_file(filename = P2C_FILE):
+    """
+    :returns: dictionary of SimID -> p2c (None where hPIC's log had none),
+        empty if there's no p2c file yet
+    """
+    p2c_values = {}
+    if not os.path.exists(filename):
+        return p2c_values
+    with open(filename, 'r', newline = '') as f:
+        for row in csv.DictReader(f):
+            p2c_values[row['SimID']] = float(row['p2c']) if row['p2c'] else None
+    return p2c_values
+
+
+def write_p2c_file(p2c_values, filename = P2C_FILE):
+    """
+    Same layout as pandas' DataFrame.to_csv (leading index column), written
+    with the csv module so this script doesn't pay for importing pandas.
+    """
+    with open(filename, 'w', newline = '') as f:
+        writer = csv.writer(f)
+        writer.writerow(['', 'SimID', 'p2c'])
+        for i, (SimID, p2c) in enumerate(p2c_values.items()):
+            writer.writerow([i, SimID, '' if p2c is None else p2c])
+
+
+@profiling.profiled('find_p2c_values')
 def main():
-    p2c_data = {'SimID': [], 'p2c': []}
+    p2c_values = {}
     simdirs = glob.glob('hpic_results/*')
     for simdir in simdirs:
         SimID =  simdir.replace('hpic_results/', '')
-        p2c = find_p2c_value(simdir + '/hpic.log')
-
-        p2c_data['SimID'].append(SimID)
-        p2c_data['p2c'].append(p2c)
+        with profiling.span('hpic.log', 'parse'):
+            p2c_values[SimID] = find_p2c_value(simdir + '/hpic.log')
 
-    df = pd.DataFrame(p2c_data)
-    df.to_csv('hpic_results/p2c.csv')
+    with profiling.span('p2c.csv', 'write'):
+        write_p2c_file(p2c_values)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import importlib
+
+
+"""
+One command for every pipeline script:
+
+    fnsf <SUBCOMMAND> [ARGS...]
+
+e.g. fnsf status
+     fnsf assign total_pushes.csv
+     fnsf build low --profile
+
+Each subcommand runs the main() of the script listed in SUBCOMMANDS with the
+remaining arguments, exactly as "python scripts/<script>.py ARGS..." would.
+Scripts are imported only when their subcommand runs, so heavy dependencies
+(matplotlib, pandas, toml, h5py) are only loaded by the subcommands that use
+them, and light ones like status, assign and find-p2c start about as fast as
+a bare interpreter.
+
+usage: python scripts/fnsf.py <SUBCOMMAND> [ARGS...]
+"""
+
+# subcommand -> (module, function, description)
+SUBCOMMANDS = {
+    'status': ('hpic_status', 'main', 'which hPIC simulations are done/running/failed'),
+    'requeue': ('requeue_failed', 'main', 'move failed simulations to another host'),
+    'sweep': ('plan_sweep', 'main', 'expand the parameter sweep and forecast its cost'),
+    'configure': ('configure_simulations', 'main', 'generate the hPIC simulation scripts'),
+    'calibrate-hosts': ('host_capabilities', 'main', 'measure host throughputs for the assigners'),
+    'history': ('runtime_history', 'main', 'learn host throughputs from past runtimes'),
+    'tune-rustbca': ('rustbca_tuning', 'main', 'tune RustBCA threads, chunks and buffers per host'),
+    'assign': ('assign_workloads', 'main', 'assign hPIC simulations to machines'),
+    'find-p2c': ('find_p2c_values', 'main', 'collect hPIC p2c values into hpic_results/p2c.csv'),
+    'build': ('build_rustbca_input_files', 'main', 'build the RustBCA input files'),
+    'watch': ('watch_pipeline', 'main', 'build and send RustBCA inputs as hPIC runs complete'),
+    'calibrate': ('build_rustbca_input_files', 'calibrate', 'build a single RustBCA calibration input'),
+    'run-batches': ('run_rustbca_batches', 'main', 'run a RustBCA simulation in batches'),
+    'verify': ('verify_total_counts', 'main', 'verify RustBCA input particle counts'),
+    'finalize': ('finalize_rustbca_outputs', 'main', 'convert RustBCA outputs to columnar files'),
+    'reduce': ('reduce_rustbca_outputs', 'main', 'reduce RustBCA outputs to distributions'),
+    'sputtering': ('physical_sputtering_amount', 'main', 'compute physical sputtering amounts'),
+    'plot-iead': ('plot_all_iead', 'main', 'render the IEAD of every simulation'),
+    'plot-mesh': ('plot_rustbca_material_mesh', 'main', 'plot the mesh of a RustBCA input file'),
+    'gyroradius': ('gyroradius', 'main', 'plot ion gyroradii along the divertor'),
+    'debye-length': ('debye_length', 'main', 'plot Debye lengths along the divertor'),
+    'density': ('density', 'main', 'plot ion densities along the divertor'),
+}
+
+
+def print_usage():
+    print('usage: fnsf <SUBCOMMAND> [ARGS...]\n\nsubcommands:')
+    for name, (module, _, description) in SUBCOMMANDS.items():
+        print(f'    {name:<14} {description} ({module}.py)')
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help', 'help'):
+        print_usage()
+        sys.exit(0 if len(sys.argv) >= 2 else 1)
+
+    name = sys.argv[1]
+    if name not in SUBCOMMANDS:
+        print(f'unknown subcommand "{name}"\n')
+        print_usage()
+        sys.exit(1)
+
+    module_name, function_name, _ = SUBCOMMANDS[name]
+
+    # The scripts import each other as top-level modules
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    if scripts_dir not in sys.path:
+        sys.path.insert(0, scripts_dir)
+
+    # Scripts parse sys.argv themselves, so make it look like they were run
+    # directly: "fnsf build low" -> ["build_rustbca_input_files.py", "low"]
+    sys.argv = [f'{module_name}.py'] + sys.argv[2:]
+    module = importlib.import_module(module_name)
+    getattr(module, function_name)()
+
+
+if __name__ == '__main__':
+    main()
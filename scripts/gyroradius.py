@@ -4,7 +4,7 @@ import util
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import scientific_constants as sc
+from plasma_parameters import Qe, amu2kg, gyroradius, gyroradius_for_row
 
 
 """
@@ -13,59 +13,6 @@ to calculate the gyroradius of the incoming ions to make sure they're
 not intersecting the diverter before the strike point.
 """
 
-Qe = 1.602176e-19
-
-
-# 1 Dalton [kg]
-amu2kg = 1.6605e-27
-
-
-# Boltzmann Constant [J/K]
-kB = 1.380649e-23
-
-
-def gyroradius_for_row(df_row):
-    """
-    Calculate the gyroradius given a row (i.e. a LOCATION) at the divertor.
-
-    Since all other ions have a low density compared to deuterium, we consider
-    ONLY the deuterium mass/charge when determining the gyroradius.
-
-    :param: df_row: a single row in the SOLPS output data.
-    :returns: gyroradius, in meters
-    """
-
-    B0 = df_row['|B| (T)']
-    Ti = df_row['Ti (eV)']
-
-    dt_ion_info = _ions_of_interest['nD+1']
-    A_D = dt_ion_info['Ai']
-    q_D = dt_ion_info['qi'] * sc.qe
-    m_D = A_D * sc.amu2kg
-
-    # Since all other ions have a low density compared to deuterium,
-    # consider ONLY the deuterium mass/charge to determine the gyroradius.
-    rg = gyroradius(Ti, m_D, q_D, B0)
-    return rg
-
-
-def gyroradius(T, m, q, B):
-    """
-    Calculate the gyroradius of a species in the tokamak.
-
-    To compute v_parallel, use the mean velocity formula: sqrt(8/pi * kT/m)
-
-    :param: T: ion temperature, in eV
-    :param: m: ion mass, in kg
-    :param: q: ion charge, in Coulombs
-    :param: B: B field strength, in Tesla
-
-    :returns: gyroradius, in meters
-    """
-    v = np.sqrt(2 * Qe * T / m)
-    rg = m * v / q / B
-    return rg
-
 
 def compute_gyroradii(df):
     N = len(df)
@@ -79,32 +26,26 @@ def compute_gyroradii(df):
 
     ions = sorted(_ions_of_interest.keys())
 
-    for n, row in df.iterrows():
-        Lsep = row['L-Lsep (m)']
-        B0 = row['|B| (T)']
-        phi = row['Bangle (deg)']
-        Ti = row['Ti (eV)']
-
-        # The first column holds the x-position
-        Rg[n][0] = Lsep
-        dX[n][0] = Lsep
-
-        m = 1
+    Lsep = df['L-Lsep (m)'].to_numpy()
+    B0 = df['|B| (T)'].to_numpy()
+    phi = df['Bangle (deg)'].to_numpy()
+    Ti = df['Ti (eV)'].to_numpy()
 
-        for ion in ions:
-            ion_info = _ions_of_interest[ion]
-            Ai = ion_info['Ai']
-            Zi = ion_info['Zi']
-            qi = ion_info['qi'] * Qe
+    # The first column holds the x-position
+    Rg[:, 0] = Lsep
+    dX[:, 0] = Lsep
 
-            mi = Ai * amu2kg
+    # Every location at once, one ion at a time
+    for m, ion in enumerate(ions, start = 1):
+        ion_info = _ions_of_interest[ion]
+        Ai = ion_info['Ai']
+        qi = ion_info['qi'] * Qe
 
-            rg = gyroradius(Ti, mi, qi, B0)
-            Rg[n][m] = rg
+        mi = Ai * amu2kg
 
-            delta_x = rg / np.sin(np.pi/2 - phi*np.pi/180)
-            dX[n][m] = delta_x
-            m += 1
+        rg = gyroradius(Ti, mi, qi, B0)
+        Rg[:, m] = rg
+        dX[:, m] = rg / np.sin(np.pi/2 - phi*np.pi/180)
 
     # Create pandas DFs so we can refer to columns by header
     columns = ['L-Lsep (m)'] + [x.replace('n','') for x in ions]
@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import shutil
+import yaml
+import util
+import common
+import profiling
+import benchmark_host
+import rustbca_tuning
+
+
+"""
+Measured capabilities of the LCPP boxes, which replace the hand-set
+assign_workloads.MACHINE_BANDWIDTHS and
+build_rustbca_input_files.machine_core_counts once they exist.
+
+    prepare     write remote_scripts/generated/calibration/: a short hPIC
+                run (a representative SOLPS row with fewer particles per
+                cell), a small RustBCA input and benchmark_host.py
+    collect     read the CAPABILITY lines printed by benchmark_host.py from
+                FILEs (or stdin) into HOST_CAPABILITIES_FILE
+    show        compare the measured and hand-set values
+
+On every host, from the RustBCA run directory (see benchmark_host.py):
+
+    cd remote_scripts
+    for host in $(grep -Ev '^$|#.*' lcpp_hosts.txt); do
+        scp -r generated/calibration $host:my-rustbca-sims/
+    done
+    ./run_cmd_on_all_hosts.sh cd my-rustbca-sims\\; python3 calibration/benchmark_host.py \\
+        | python ../scripts/host_capabilities.py collect
+
+HOST_CAPABILITIES_FILE holds, per machine, the hPIC runs per second and the
+RustBCA particles per second at the best level of concurrency, and the
+concurrency past which copies contend. assign_workloads.py then shares out
+hPIC work by hPIC throughput, and build_rustbca_input_files.py shares out
+RustBCA simulations by RustBCA throughput, giving each input as many threads
+as the contention point. Machines that weren't calibrated keep their
+hand-set value, scaled to the calibrated ones. RustBCA threads and
+throughputs found by rustbca_tuning.py take precedence over the
+calibration, and throughputs learned from past campaigns
+(runtime_history.py) over all of them, the same way.
+
+usage: python scripts/host_capabilities.py (prepare|collect [FILE...]|show)
+"""
+
+HOST_CAPABILITIES_FILE = 'host_capabilities.yaml'
+
+_CALIBRATION_DIR = 'remote_scripts/generated/calibration'
+
+# The benchmark hPIC run: the SOLPS row with the median Te, with fewer
+# particles per cell (p5) than a real run
+_BENCHMARK_PARTICLES_PER_CELL = 50
+
+# Simulation particles of the benchmark RustBCA input
+_BENCHMARK_RUSTBCA_N = 2000
+
+
+def load_host_capabilities(filename = HOST_CAPABILITIES_FILE):
+    """
+    :returns: dictionary of machine -> capabilities, empty if there's no
+        capabilities file
+    """
+    if not os.path.exists(filename):
+        return {}
+    return util.load_yaml(filename) or {}
+
+
+def fill_uncalibrated(measured, defaults):
+    """
+    :param measured: dictionary of machine -> measured rate
+    :param defaults: dictionary of machine -> hand-set value
+    :returns: dictionary of machine -> rate for every machine of either,
+        with the uncalibrated machines' hand-set values scaled by how the
+        measured rates compare to the hand-set values of the same machines
+    """
+    both = [m for m in measured if m in defaults and defaults[m] > 0]
+    if both:
+        scale = sum(measured[m] for m in both) / sum(defaults[m] for m in both)
+    else:
+        scale = (sum(measured.values()) / len(measured)) / (sum(defaults.values()) / len(defaults))
+    rates = {m: value * scale for m, value in defaults.items()}
+    rates.update(measured)
+    return rates
+
+
+def load_learned_throughputs(stage):
+    """
+    Throughputs learned from past campaigns (runtime_history.py)
+    """
+    import runtime_history
+    return runtime_history.load_learned_throughputs(stage)
+
+
+def get_hpic_bandwidths(default_bandwidths, capabilities = None, learned = None):
+    """
+    Fraction of the hPIC work each machine should get: hPIC throughputs
+    learned from past campaigns, else measured by the calibration, else
+    default_bandwidths, normalized to the same total as default_bandwidths
+    (the assigner checks the work fits).
+    """
+    if capabilities is None:
+        capabilities = load_host_capabilities()
+    if learned is None:
+        learned = load_learned_throughputs('hpic')
+    measured = {
+        m: c['hpic']['runs_per_second'] for m, c in capabilities.items() if 'hpic' in c
+    }
+    bandwidths = dict(default_bandwidths)
+    total = sum(default_bandwidths.values())
+    for rates in (measured, learned):
+        if rates:
+            rates = fill_uncalibrated(rates, bandwidths)
+            bandwidths = {m: total * rate / sum(rates.values()) for m, rate in rates.items()}
+    return bandwidths
+
+
+def get_rustbca_capacities(default_core_counts, capabilities = None, learned = None, tuning = None):
+    """
+    :returns: (dictionary of machine -> threads per RustBCA input,
+        dictionary of machine -> relative RustBCA throughput). The threads
+        are the tuned ones (rustbca_tuning.py), else the measured contention
+        point, else the hand-set core count. Throughputs are learned from
+        past campaigns, else tuned, else measured by the calibration, else
+        the core counts.
+    """
+    if capabilities is None:
+        capabilities = load_host_capabilities()
+    if learned is None:
+        learned = load_learned_throughputs('rustbca')
+    if tuning is None:
+        tuning = rustbca_tuning.load_tuning()
+    measured = {
+        m: c['rustbca'] for m, c in capabilities.items() if 'rustbca' in c
+    }
+    threads = dict(default_core_counts)
+    threads.update({m: c['concurrency'] for m, c in measured.items()})
+    threads.update({m: t['num_threads'] for m, t in tuning.items()})
+    rates = dict(default_core_counts)
+    for measured_rates in (
+            {m: c['particles_per_second'] for m, c in measured.items()},
+            {m: t['particles_per_second'] for m, t in tuning.items()},
+            learned):
+        if measured_rates:
+            rates = fill_uncalibrated(measured_rates, rates)
+    return threads, rates
+
+
+def prepare():
+    import configure_simulations as configure
+    import build_rustbca_input_files as builder
+    from assign_workloads import MACHINE_BANDWIDTHS
+
+    config = util.load_yaml(common._CONFIG_FILENAME)
+    ions = config.get('ions')
+    ion_list = [list(x.keys())[0] for x in ions] if ions else sorted(common._ions_of_interest)
+    hpic_params = dict(config.get('hpic_params', {}))
+    hpic_params['p5'] = _BENCHMARK_PARTICLES_PER_CELL
+
+    label, datafile = next(iter(common.DATAFILES.items()))
+    df = util.load_solps_data(datafile)
+    row = df.iloc[(df['Te (eV)'] - df['Te (eV)'].median()).abs().argmin()]
+    hpic_command = configure.format_hPIC_command(
+        row, 'calibration', hpic_params, config.get('ngyro') or configure._NGyro, ion_list,
+    )
+
+    machines = list(MACHINE_BANDWIDTHS) + [m for m in builder.machine_core_counts if m not in MACHINE_BANDWIDTHS]
+    hpic_commands = {
+        m: hpic_command.replace(configure._HPIC_EXEC, configure.alt_hpic_execs.get(m, configure._HPIC_EXEC))
+        for m in machines
+    }
+
+    util.mkdir('remote_scripts/generated')
+    util.mkdir(_CALIBRATION_DIR)
+    geometry = builder.get_geometry(config.get('rustbca', {}))
+    builder.build_host_benchmark_input(
+        os.path.join(_CALIBRATION_DIR, 'rustbca_input.toml'), _BENCHMARK_RUSTBCA_N, geometry,
+    )
+    calibration = {
+        'hpic_commands': hpic_commands,
+        'rustbca': {'command': 'cargo run --release', 'mode': geometry['mode'], 'N': _BENCHMARK_RUSTBCA_N},
+    }
+    with open(os.path.join(_CALIBRATION_DIR, 'calibration.json'), 'w') as f:
+        json.dump(calibration, f, indent = 4)
+    shutil.copy(benchmark_host.__file__, _CALIBRATION_DIR)
+    print(f'wrote {_CALIBRATION_DIR} for {len(machines)} machines ({label} SOLPS row, Te = {row["Te (eV)"]:.3g} eV)')
+
+
+def collect(lines):
+    capabilities = load_host_capabilities()
+    collected = 0
+    for line in lines:
+        if not line.startswith(benchmark_host.CAPABILITY_PREFIX):
+            continue
+        capability = json.loads(line[len(benchmark_host.CAPABILITY_PREFIX):])
+        for code in ('hpic', 'rustbca'):
+            if code in capability:
+                capability[code]['rates'] = {int(c): r for c, r in capability[code]['rates'].items()}
+        capabilities[capability.pop('machine')] = capability
+        collected += 1
+
+    if not collected:
+        print('no CAPABILITY lines found (see benchmark_host.py)')
+        sys.exit(1)
+    with open(HOST_CAPABILITIES_FILE, 'w') as f:
+        yaml.dump(capabilities, f, sort_keys = True)
+    print(f'{collected} machines written to {HOST_CAPABILITIES_FILE}')
+
+
+def show():
+    from assign_workloads import MACHINE_BANDWIDTHS
+    from build_rustbca_input_files import machine_core_counts
+
+    capabilities = load_host_capabilities()
+    if not capabilities:
+        print(f'no {HOST_CAPABILITIES_FILE}, only the hand-set values and runtime history are used')
+    bandwidths = get_hpic_bandwidths(MACHINE_BANDWIDTHS, capabilities)
+    threads, rates = get_rustbca_capacities(machine_core_counts, capabilities)
+    total_rate = sum(rates.values())
+
+    print(f'{"machine":<12} {"calibrated":<20} {"hPIC share":>10} {"(hand-set)":>10} '
+        + f'{"RustBCA share":>13} {"threads":>7} {"(hand-set)":>10}')
+    for m in sorted(set(bandwidths) | set(threads)):
+        calibrated = capabilities.get(m, {}).get('calibrated', '-')
+        print(
+            f'{m:<12} {calibrated:<20} {bandwidths.get(m, 0):>10.3f} {MACHINE_BANDWIDTHS.get(m, 0):>10.3f} '
+            + f'{rates.get(m, 0) / total_rate:>13.3f} {threads.get(m, 0):>7} {machine_core_counts.get(m, 0):>10}'
+        )
+
+
+@profiling.profiled('host_capabilities')
+def main():
+    usage = 'usage: python scripts/host_capabilities.py (prepare|collect [FILE...]|show)'
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == 'prepare':
+        with profiling.span('calibration', 'write'):
+            prepare()
+    elif command == 'collect':
+        lines = []
+        if len(sys.argv) > 2:
+            for filename in sys.argv[2:]:
+                with open(filename, 'r') as f:
+                    lines.extend(f.readlines())
+        else:
+            lines = sys.stdin.readlines()
+        with profiling.span('capabilities', 'write'):
+            collect(lines)
+    elif command == 'show':
+        show()
+    else:
+        print(usage)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import os
+import sys
+import glob
+import json
+import socket
+from datetime import datetime
+
+
+"""
+Report which hPIC simulations are complete, which ones are still running and
+which ones failed, from the "simulation-start", "simulation-complete" and
+"simulation-failed" files written next to each simulation's output by
+run_job.py (remote_scripts/hpic/check_hpic_status.sh runs this script on
+the LCPP boxes), and how much disk space pruning their bulky
+outputs reclaimed (see configure_simulations.format_prune_commands),
+followed by a count of the RustBCA simulations that have output.
+
+Only the standard library is imported, so this starts about as fast as a
+bare interpreter.
+
+usage: python scripts/hpic_status.py [HPIC_RESULTS_DIR]
+"""
+
+_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S-%Z'
+
+# Kept in sync with configure_simulations.PRUNE_REPORT_FILENAME, which isn't
+# imported to keep this script's startup fast
+_PRUNE_REPORT_FILENAME = 'simulation-pruned'
+# Likewise for run_job.FAILED_FILENAME and run_job.ATTEMPTS_FILENAME
+_FAILED_FILENAME = 'simulation-failed'
+_ATTEMPTS_FILENAME = 'attempts.jsonl'
+_PRUNED = {'compress': 'compressed', 'delete': 'deleted'}
+_RUSTBCA_OUTPUTS = ('sputtered.output', 'sputtered.columns', 'distributions.toml')
+
+
+def read_timestamp(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r') as f:
+        return datetime.strptime(f.read().strip(), _DATE_FORMAT)
+
+
+def read_failure(simdir):
+    """
+    :returns: (date, failure class, number of attempts) from
+        simulation-failed, or None
+    """
+    filename = os.path.join(simdir, _FAILED_FILENAME)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r') as f:
+        date, failure, attempts = f.read().split()
+    return datetime.strptime(date, _DATE_FORMAT), failure, int(attempts)
+
+
+def read_last_failure(simdir):
+    """
+    :returns: (number of attempts, class of the last failed attempt) from
+        attempts.jsonl, or None if no attempt failed
+    """
+    filename = os.path.join(simdir, _ATTEMPTS_FILENAME)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r') as f:
+        attempts = [json.loads(line) for line in f if line.strip()]
+    failures = [attempt['class'] for attempt in attempts if attempt['class']]
+    if not failures:
+        return None
+    return len(attempts), failures[-1]
+
+
+def get_simulation_status(simdir):
+    start = read_timestamp(os.path.join(simdir, 'simulation-start'))
+    if start is None:
+        return 'not started!'
+    end = read_timestamp(os.path.join(simdir, 'simulation-complete'))
+
+    # Maybe the previous hPIC run failed, in which case "simulation-complete"
+    # MIGHT exist, but with a stale timestamp.
+    if end is not None and end >= start:
+        return f'done (took {end - start})'
+
+    failure = read_failure(simdir)
+    if failure is not None and failure[0] >= start:
+        _, failure_class, attempts = failure
+        return f'FAILED ({failure_class} after {attempts} attempt{"s" if attempts != 1 else ""})'
+    last_failure = read_last_failure(simdir)
+    if last_failure is not None:
+        attempts, failure_class = last_failure
+        return f'still running (attempt {attempts + 1}, last failure: {failure_class})'
+    return 'still running'
+
+
+def get_reclaimed_bytes(simdir):
+    """
+    :returns: (policy, number of files pruned, bytes reclaimed), or None if
+        the simulation's outputs weren't pruned
+    """
+    filename = os.path.join(simdir, _PRUNE_REPORT_FILENAME)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r') as f:
+        policy, files, before, after = f.read().split()
+    return policy, int(files), int(before) - int(after)
+
+
+def format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1000:
+            return f'{n:.1f} {unit}'
+        n /= 1000
+    return f'{n:.1f} TB'
+
+
+def count_rustbca_simulations():
+    """
+    :returns: (simulations with output, total simulations)
+    """
+    inputs = glob.glob('rustbca_simulations/**/*input.toml', recursive = True)
+    complete = sum(
+        any(os.path.exists(os.path.join(os.path.dirname(f), output)) for output in _RUSTBCA_OUTPUTS)
+        for f in inputs
+    )
+    return complete, len(inputs)
+
+
+def main():
+    results_dir = sys.argv[1] if len(sys.argv) > 1 else 'hpic_results'
+    hostname = socket.gethostname()
+    total_reclaimed = 0
+    for simdir in sorted(glob.glob(os.path.join(results_dir, '*'))):
+        if not os.path.isdir(simdir):
+            continue
+        status = get_simulation_status(simdir)
+        pruned = get_reclaimed_bytes(simdir)
+        if pruned is not None:
+            policy, files, reclaimed = pruned
+            total_reclaimed += reclaimed
+            status += f', {_PRUNED[policy]} {files} outputs ({format_bytes(reclaimed)} reclaimed)'
+        print(f'{hostname}: {os.path.basename(simdir):35} {status}')
+    if total_reclaimed:
+        print(f'{hostname}: {format_bytes(total_reclaimed)} reclaimed by pruning hPIC outputs')
+
+    complete, total = count_rustbca_simulations()
+    if total:
+        print(f'{hostname}: {complete}/{total} RustBCA simulations running or complete')
+
+
+if __name__ == '__main__':
+    main()
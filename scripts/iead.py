@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import numpy as np
+
+
+"""
+Binning of the IEADs (ion energy-angle distributions) hPIC writes.
+
+Each IEAD file is a table of counts, one row per energy bin and one column
+per angle bin. The grid is described by its bin edges:
+
+    energy_edges    in units of Te, so one grid serves every simulation
+    angle_edges     in degrees from the surface normal
+
+hPIC's grid (240 energies from 0 to 24 Te, 90 angles from 0 to 90 degrees
+by default) is set by the iead section of config.yaml. An IEAD written on a
+different grid can say so in a sidecar, <IEAD file>.grid.json, holding
+{"energy_edges": [...], "angle_edges": [...]}, which takes precedence.
+
+iead.rebin in config.yaml gives a coarser grid the RustBCA inputs are built
+on (get_coarse_grid). Rebinning conserves counts: each old bin's counts are
+shared among the new bins it overlaps in proportion to the overlap, so it is
+exact where the new edges are a subset of the old ones (e.g. merging 1
+degree angle bins into 5 degree ones).
+"""
+
+DEFAULT_ENERGY_BINS = 240
+DEFAULT_MAX_ENERGY = 24.0
+DEFAULT_ANGLE_BINS = 90
+DEFAULT_MAX_ANGLE = 90.0
+
+GRID_SUFFIX = '.grid.json'
+
+ENERGY_SPACINGS = ('linear', 'log')
+
+_REBIN_OPTIONS = ('angle_step', 'energy_step', 'energy_bins', 'energy_spacing', 'min_energy')
+
+
+def make_grid(
+        energy_bins = DEFAULT_ENERGY_BINS,
+        max_energy = DEFAULT_MAX_ENERGY,
+        angle_bins = DEFAULT_ANGLE_BINS,
+        max_angle = DEFAULT_MAX_ANGLE):
+    """
+    A grid of evenly spaced bins starting at 0 eV and 0 degrees
+    """
+    return {
+        'energy_edges': tuple(np.linspace(0.0, max_energy, energy_bins + 1)),
+        'angle_edges': tuple(np.linspace(0.0, max_angle, angle_bins + 1)),
+    }
+
+
+DEFAULT_GRID = make_grid()
+
+
+def get_grid(config):
+    """
+    hPIC's IEAD grid, from the iead section of config.yaml
+    """
+    iead_config = config.get('iead') or {}
+    return make_grid(
+        int(iead_config.get('energy_bins', DEFAULT_ENERGY_BINS)),
+        float(iead_config.get('max_energy', DEFAULT_MAX_ENERGY)),
+        int(iead_config.get('angle_bins', DEFAULT_ANGLE_BINS)),
+        float(iead_config.get('max_angle', DEFAULT_MAX_ANGLE)),
+    )
+
+
+def get_shape(grid):
+    """
+    (number of energy bins, number of angle bins)
+    """
+    return len(grid['energy_edges']) - 1, len(grid['angle_edges']) - 1
+
+
+def get_energy_centers(grid):
+    """
+    Energy (units of Te) at the middle of every energy bin
+    """
+    edges = np.asarray(grid['energy_edges'])
+    return (edges[:-1] + edges[1:]) / 2
+
+
+def get_angle_centers(grid):
+    """
+    Angle (degrees) at the middle of every angle bin
+    """
+    edges = np.asarray(grid['angle_edges'])
+    return (edges[:-1] + edges[1:]) / 2
+
+
+def describe_grid(grid):
+    """
+    Edges as plain lists, for manifests and sidecars
+    """
+    return {k: [float(x) for x in grid[k]] for k in ('energy_edges', 'angle_edges')}
+
+
+def _step_edges(edges, step, label):
+    if not isinstance(step, int) or step < 1:
+        print(f'iead.rebin.{label} must be a positive integer, got {step}')
+        sys.exit(1)
+    coarse = edges[::step]
+    if coarse[-1] != edges[-1]:
+        coarse = coarse + (edges[-1],)
+    return coarse
+
+
+def get_coarse_grid(grid, rebin_config):
+    """
+    The grid of the iead.rebin section of config.yaml, from grid:
+
+        angle_step:     merge every angle_step angle bins
+        energy_step:    merge every energy_step energy bins
+        energy_bins:    or, replace the energy bins by this many, covering
+                        the same range
+        energy_spacing: linear (default) or log, for energy_bins. Log bins
+                        start with one bin from 0 to min_energy.
+        min_energy:     units of Te, for log spacing. Defaults to the width
+                        of grid's first energy bin.
+
+    :returns: grid itself if rebin_config is empty
+    """
+    if not rebin_config:
+        return grid
+    unknown = set(rebin_config) - set(_REBIN_OPTIONS)
+    if unknown:
+        print(f'unknown iead.rebin options: {", ".join(sorted(unknown))} ({", ".join(_REBIN_OPTIONS)})')
+        sys.exit(1)
+    if 'energy_step' in rebin_config and 'energy_bins' in rebin_config:
+        print('iead.rebin: give energy_step or energy_bins, not both')
+        sys.exit(1)
+
+    energy_edges = grid['energy_edges']
+    angle_edges = grid['angle_edges']
+    if 'angle_step' in rebin_config:
+        angle_edges = _step_edges(angle_edges, rebin_config['angle_step'], 'angle_step')
+    if 'energy_step' in rebin_config:
+        energy_edges = _step_edges(energy_edges, rebin_config['energy_step'], 'energy_step')
+    elif 'energy_bins' in rebin_config:
+        n = int(rebin_config['energy_bins'])
+        spacing = rebin_config.get('energy_spacing', 'linear')
+        if spacing not in ENERGY_SPACINGS:
+            print(f'unknown iead.rebin.energy_spacing: "{spacing}" ({"|".join(ENERGY_SPACINGS)})')
+            sys.exit(1)
+        low, high = energy_edges[0], energy_edges[-1]
+        if spacing == 'linear':
+            energy_edges = tuple(np.linspace(low, high, n + 1))
+        else:
+            min_energy = float(rebin_config.get('min_energy', energy_edges[1]))
+            if not low < min_energy < high or n < 2:
+                print(f'iead.rebin: log spacing needs {low} < min_energy < {high} and energy_bins >= 2')
+                sys.exit(1)
+            energy_edges = (low,) + tuple(np.geomspace(min_energy, high, n))
+    return {'energy_edges': tuple(energy_edges), 'angle_edges': tuple(angle_edges)}
+
+
+def _overlap_fractions(edges, new_edges):
+    """
+    fractions[i, j]: fraction of old bin i that falls in new bin j
+    """
+    edges = np.asarray(edges, dtype = float)
+    new_edges = np.asarray(new_edges, dtype = float)
+    lo = np.maximum(edges[:-1, None], new_edges[None, :-1])
+    hi = np.minimum(edges[1:, None], new_edges[None, 1:])
+    return np.clip(hi - lo, 0.0, None) / np.diff(edges)[:, None]
+
+
+def rebin(IEAD, grid, new_grid):
+    """
+    Counts of IEAD (on grid) on new_grid, assuming counts are spread evenly
+    within each old bin. new_grid must cover grid, so no counts are lost.
+    """
+    if new_grid == grid:
+        return IEAD
+    for k in ('energy_edges', 'angle_edges'):
+        if new_grid[k][0] > grid[k][0] or new_grid[k][-1] < grid[k][-1]:
+            print(f'cannot rebin: the new {k} do not cover [{grid[k][0]}, {grid[k][-1]}]')
+            sys.exit(1)
+    energy_fractions = _overlap_fractions(grid['energy_edges'], new_grid['energy_edges'])
+    angle_fractions = _overlap_fractions(grid['angle_edges'], new_grid['angle_edges'])
+    return energy_fractions.T @ IEAD @ angle_fractions
+
+
+def read_grid(IEADfile, default_grid):
+    """
+    The grid of an IEAD file: its sidecar's if it has one, else default_grid
+    """
+    sidecar = IEADfile + GRID_SUFFIX
+    if not os.path.exists(sidecar):
+        return default_grid
+    with open(sidecar, 'r') as f:
+        grid = json.load(f)
+    return {k: tuple(float(x) for x in grid[k]) for k in ('energy_edges', 'angle_edges')}
+
+
+def read_IEAD(IEADfile, default_grid = DEFAULT_GRID):
+    """
+    :returns: (IEAD counts, grid)
+    """
+    IEAD = np.atleast_2d(np.genfromtxt(IEADfile, delimiter = ' '))
+    grid = read_grid(IEADfile, default_grid)
+    if IEAD.shape != get_shape(grid):
+        print(
+            f'{IEADfile} is {IEAD.shape[0]} x {IEAD.shape[1]}, but its grid is '
+            + f'{get_shape(grid)[0]} x {get_shape(grid)[1]} (see the iead section of config.yaml)'
+        )
+        sys.exit(1)
+    return IEAD, grid
+
+
+def load_IEAD(IEADfile, config):
+    """
+    An IEAD on the grid RustBCA inputs are built on: read on hPIC's grid
+    (or its sidecar's), then rebinned as iead.rebin in config.yaml says
+
+    :returns: (IEAD counts, grid)
+    """
+    IEAD, grid = read_IEAD(IEADfile, get_grid(config))
+    coarse_grid = get_coarse_grid(grid, (config.get('iead') or {}).get('rebin'))
+    return rebin(IEAD, grid, coarse_grid), coarse_grid
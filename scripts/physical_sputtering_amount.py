@@ -3,11 +3,16 @@ import common
 import glob
 import numpy as np
 import scientific_constants as sc
+import rustbca_output
+import profiling
+from build_rustbca_input_files import STRATUM_Z_SPACING
 import pandas as pd
 from collections import defaultdict
-import matplotlib.pyplot as plt
 import os
 import sys
+import toml
+import json
+from concurrent.futures import ProcessPoolExecutor
 
 # These are the values for Lithium surface binding energy
 # which were used in rustbca simulations. The results must
@@ -17,6 +22,37 @@ SBEs = [
     '4eV',
 ]
 
+# Output files of a RustBCA simulation directory which physical_sputtering
+# reads. A cached result is reused only if none of them changed.
+_SIMULATION_RESULT_FILES = [
+    'sputtered.output',
+    'sputtered.columns/z.npy',
+    'distributions.toml',
+    'strata.csv',
+    'batches.csv',
+]
+
+# Per-simulation results of previous runs (see count_all_sputtered)
+_CACHE_FILE = 'rustbca_simulations/sputtering_cache.json'
+
+# Combined table of every ion, SBE and strike point ("all" mode)
+_COMBINED_OUTPUT_FILE = 'sputtering_yields.csv'
+
+# Columns of the sputtering table, which has them even when it's empty
+_SPUTTERING_TABLE_COLUMNS = [
+    'ion',
+    'p2c',
+    'rustbca_conversion_factor',
+    'Nsput',
+    'strike_point',
+    'Li-SBE (eV)',
+    'L-Lsep (m)',
+    'simulation time',
+    'Nincident',
+    'sputtering_yield',
+    'gamma',
+]
+
 
 def energy_to_velocity(E, m):
     """
@@ -40,6 +76,146 @@ def get_conversion_factors(ion_name):
 
     return factors
 
+def get_strata_weights(rustbca_simdir):
+    """
+    Importance-sampled simulations (see build_rustbca_input_files.py) come
+    with a strata.csv which maps each IEAD bin (tag) to the number of real
+    incident ions each of its simulation particles stands for.
+
+    @returns: array of weights indexed by tag, or None for simulations which
+        were not importance-sampled.
+    """
+    strata_file = rustbca_simdir + '/strata.csv'
+    if not os.path.exists(strata_file):
+        return None
+    strata = pd.read_csv(strata_file)
+    weights = np.zeros(strata['tag'].max() + 1)
+    weights[strata['tag']] = strata['weight']
+    return weights
+
+
+def get_combined_species(rustbca_simdir):
+    """
+    Simulations built with rustbca.combine_species hold every species in one
+    input, and their strata.csv has an "ion" column mapping each tag to its
+    species.
+
+    @returns: the species of the simulation, or None if it isn't combined
+    """
+    strata_file = rustbca_simdir + '/strata.csv'
+    if not os.path.exists(strata_file):
+        return None
+    with open(strata_file, 'r') as f:
+        if 'ion' not in f.readline().strip().split(','):
+            return None
+    return list(pd.read_csv(strata_file, usecols = ['ion'])['ion'].unique())
+
+
+def load_distributions(distributions_file):
+    """
+    Load the binned distributions RustBCA writes when built with the
+    "distributions" feature. Arrays (serialized by ndarray as
+    {v, dim, data}) are reshaped to their dimensions.
+
+    @returns: dictionary of name -> np.array, e.g. 'sputtered_ead' (energy x
+        angle counts of sputtered particles), 'energies', 'angles'.
+    """
+    with open(distributions_file, 'r') as f:
+        raw = toml.load(f)
+
+    distributions = {}
+    for name, value in raw.items():
+        if isinstance(value, dict) and 'dim' in value:
+            distributions[name] = np.array(value['data']).reshape(value['dim'])
+        else:
+            distributions[name] = np.array(value)
+    return distributions
+
+
+def get_sputtered_weight_sums(sputtered_datafile, strata_weights = None):
+    """
+    @param sputtered_datafile: RustBCA sputtered.output
+    @param strata_weights: weights indexed by tag (see get_strata_weights)
+
+    @returns: (number of sputtered particles, sum of their weights, sum of
+        their squared weights). For importance-sampled simulations each
+        particle is weighted by the IEAD bin it came from, otherwise every
+        weight is 1. The output is streamed, so no per-particle array is
+        ever kept.
+
+    Simulations run with binned output (rustbca.output: distributions) have a
+    distributions.toml instead of a sputtered.output, and the number of
+    sputtered particles is the sum of the sputtered energy-angle histogram.
+    """
+    distributions_file = os.path.join(os.path.dirname(sputtered_datafile), 'distributions.toml')
+    if os.path.exists(distributions_file):
+        Nsput = float(np.sum(load_distributions(distributions_file)['sputtered_ead']))
+        return Nsput, Nsput, Nsput
+
+    Nsput = 0
+    weight_sum = 0.0
+    squared_weight_sum = 0.0
+    for chunk in rustbca_output.iter_output_chunks(sputtered_datafile, 'sputtered'):
+        if strata_weights is None:
+            Nsput += len(chunk['z'])
+            weight_sum += len(chunk['z'])
+            squared_weight_sum += len(chunk['z'])
+            continue
+        tags = np.round(chunk['z'] / STRATUM_Z_SPACING).astype(int)
+        tags = tags[(tags >= 0) & (tags < len(strata_weights))]
+        weights = strata_weights[tags]
+        Nsput += len(weights)
+        weight_sum += np.sum(weights)
+        squared_weight_sum += np.sum(weights**2)
+    return Nsput, weight_sum, squared_weight_sum
+
+
+def get_sputtered_tag_counts(sputtered_datafile, ntags):
+    """
+    @returns: number of sputtered particles per tag (see STRATUM_Z_SPACING),
+        for tags 0..ntags-1
+    """
+    tag_counts = np.zeros(ntags)
+    for chunk in rustbca_output.iter_output_chunks(sputtered_datafile, 'sputtered'):
+        tags = np.round(chunk['z'] / STRATUM_Z_SPACING).astype(int)
+        tags = tags[(tags >= 0) & (tags < ntags)]
+        tag_counts += np.bincount(tags, minlength = ntags)
+    return tag_counts
+
+
+def count_species_sputtered(rustbca_simdir):
+    """
+    Split the sputtered particles of a combined multi-species simulation (see
+    get_combined_species) by species, in one pass over the output.
+
+    @returns: dictionary of ion name -> the count_simulation_sputtered result
+        of that species alone
+    """
+    strata = pd.read_csv(rustbca_simdir + '/strata.csv')
+    tag_counts = get_sputtered_tag_counts(
+        rustbca_simdir + '/sputtered.output',
+        strata['tag'].max() + 1,
+    )
+    species = {}
+    for ion_name, ion_strata in strata.groupby('ion'):
+        Nsput = tag_counts[ion_strata['tag'].to_numpy()]
+        species[ion_name] = {
+            'Nsput': float(np.sum(Nsput)),
+            'Nsput_real': float(np.sum(Nsput * ion_strata['weight'].to_numpy())),
+            'N': float(ion_strata['N'].sum()),
+        }
+    return species
+
+
+def count_sputtered(sputtered_datafile, strata_weights = None):
+    """
+    @returns: the number of sputtered particles. For importance-sampled
+        simulations the result is already in units of real sputtered
+        particles (see get_sputtered_weight_sums).
+    """
+    return get_sputtered_weight_sums(sputtered_datafile, strata_weights)[1]
+
+
 def get_simulation_times():
     total_times = {}
     with open('simulation_times.csv', 'r') as f:
@@ -61,59 +237,261 @@ def get_p2c_coefficients():
     return p2c_coefficients
 
 
-def physical_sputtering(ion_name, hpic_ion_label):
-    conversion_factors = get_conversion_factors(ion_name)
-    p2c_coefficients = get_p2c_coefficients()
-    simulation_times = get_simulation_times()
+def _file_signature(filename):
+    """
+    (size, mtime) of a file, or None if it doesn't exist. Used to decide
+    whether a cached result is still valid.
+    """
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime]
 
-    # Load solps data so we can look up various ion densities
-    solps_data = {}
-    for data_set_label, datafile in common.DATAFILES.items():
-        solps_data[data_set_label] = util.load_solps_data(datafile)
 
-    df_data = defaultdict(list)
-    for SBE_dir in glob.glob('rustbca_simulations/SBE*'):
-        for rustbca_simdir in glob.glob(SBE_dir + f'/*{ion_name}'):
-            SimID = rustbca_simdir.split('/')[-1].split('from_sp')[0] + 'from_sp'
-            ion_name = rustbca_simdir.split('/')[-1].split('from_sp')[1]
-
-            sputtered_datafile = rustbca_simdir + '/sputtered.output'
-            if os.path.exists(sputtered_datafile) and os.path.getsize(sputtered_datafile):
-                Nsput = np.size(np.genfromtxt(sputtered_datafile, delimiter = ','))
+def get_cache_key(rustbca_simdir):
+    return [
+        _file_signature(os.path.join(rustbca_simdir, filename))
+        for filename in _SIMULATION_RESULT_FILES
+    ]
+
+
+def count_simulation_sputtered(rustbca_simdir):
+    """
+    Read the RustBCA output of one simulation directory. This is the
+    expensive part of physical_sputtering, and what runs in the process pool.
+
+    @returns: dictionary with
+        Nsput: number of sputtered simulation particles (weighted, for
+            importance-sampled simulations)
+        Nsput_real: number of REAL sputtered particles, or None when it
+            still has to be divided by the simulation's conversion factor
+        N: total simulation particles, for batched simulations (else None)
+    or, for combined multi-species simulations, {'species': {ion name ->
+    such a dictionary}}.
+    """
+    if get_combined_species(rustbca_simdir) is not None:
+        return {'species': count_species_sputtered(rustbca_simdir)}
+
+    batches_file = rustbca_simdir + '/batches.csv'
+    if os.path.exists(batches_file):
+        # Run in batches by run_rustbca_batches.py. Each batch
+        # represents the whole IEAD once, so average over batches.
+        batches = pd.read_csv(batches_file)
+        return {
+            'Nsput': float(batches['Nsput'].sum()),
+            'Nsput_real': float(batches['Nsput_real'].mean()),
+            'N': float(batches['N'].sum()),
+        }
+
+    sputtered_datafile = rustbca_simdir + '/sputtered.output'
+    strata_weights = get_strata_weights(rustbca_simdir)
+    Nsput = float(count_sputtered(sputtered_datafile, strata_weights))
+
+    # Importance-sampled counts are already weighted per IEAD bin.
+    return {
+        'Nsput': Nsput,
+        'Nsput_real': None if strata_weights is None else Nsput,
+        'N': None,
+    }
+
+
+def load_cache():
+    if not os.path.exists(_CACHE_FILE):
+        return {}
+    with open(_CACHE_FILE, 'r') as f:
+        return json.load(f)
+
+
+def save_cache(cache):
+    with open(_CACHE_FILE, 'w') as f:
+        json.dump(cache, f, indent = 1)
+
+
+def count_all_sputtered(rustbca_simdirs, processes = None):
+    """
+    count_simulation_sputtered for every simulation directory, in a process
+    pool. Results are cached by the size and modification time of the
+    output files, so reruns only read new or changed outputs.
+
+    @returns: dictionary of simulation directory -> result
+    """
+    cache = load_cache()
+    results = {}
+    stale = []
+    for rustbca_simdir in rustbca_simdirs:
+        key = get_cache_key(rustbca_simdir)
+        cached = cache.get(rustbca_simdir)
+        if cached is not None and cached['key'] == key:
+            results[rustbca_simdir] = cached['result']
+        else:
+            stale.append((rustbca_simdir, key))
+
+    print(f'{len(results)} cached, reading {len(stale)} simulation outputs...')
+    if stale:
+        with ProcessPoolExecutor(max_workers = processes) as pool:
+            counts = pool.map(
+                count_simulation_sputtered,
+                [simdir for simdir, _ in stale],
+            )
+            for (rustbca_simdir, key), result in zip(stale, counts):
+                results[rustbca_simdir] = result
+                cache[rustbca_simdir] = {'key': key, 'result': result}
+        save_cache(cache)
+
+    return results
+
+
+def get_IEAD_totals(IEADfiles, processes = None):
+    """
+    Total incident particles in each IEAD file, cached like the simulation
+    outputs.
+    """
+    cache = load_cache()
+    totals = {}
+    stale = []
+    for IEADfile in IEADfiles:
+        cached = cache.get(IEADfile)
+        if cached is not None and cached['key'] == _file_signature(IEADfile):
+            totals[IEADfile] = cached['result']
+        else:
+            stale.append(IEADfile)
+
+    if stale:
+        with ProcessPoolExecutor(max_workers = processes) as pool:
+            for IEADfile, total in zip(stale, pool.map(_IEAD_total, stale)):
+                totals[IEADfile] = total
+                cache[IEADfile] = {'key': _file_signature(IEADfile), 'result': total}
+        save_cache(cache)
+    return totals
+
+
+def _IEAD_total(IEADfile):
+    return float(np.sum(np.genfromtxt(IEADfile)))
+
+
+def physical_sputtering_all(ions, ion_map, processes = None):
+    """
+    Sputtering yield and sputtered flux (gamma) for every RustBCA simulation
+    of the given ions, across all SBEs and strike points.
+
+    p2c values, simulation times and conversion factors are read once, and
+    the simulation outputs are read in parallel (see count_all_sputtered).
+
+    @param ions: list of ion names, e.g. ['nD+1', 'nNe+1']
+    @param ion_map: ion name -> hPIC label (see common.ion_map)
+    @returns: one combined DataFrame, with an "ion" column
+    """
+    with profiling.span('p2c, times, conversion factors', 'load'):
+        p2c_coefficients = get_p2c_coefficients()
+        simulation_times = get_simulation_times()
+        conversion_factors = {}
+        for ion_name in ions:
+            if os.path.exists(f'rustbca_conversion_factors/{ion_name}.csv'):
+                conversion_factors[ion_name] = get_conversion_factors(ion_name)
             else:
-                Nsput = 0
-
-            dataset_for_sim = common.get_dataset_from_SimID(SimID)
-            SimLsep = common.get_Lsep_from_SimID(SimID)
-
-            Nincident = np.sum(np.genfromtxt(
-                f'hpic_results/{SimID}/{SimID}_IEAD_{hpic_ion_label}.dat',
-            ))
-
-            p2c = p2c_coefficients[SimID]
-            sim_time = simulation_times[SimID]
-            try:
-                conversion_factor = conversion_factors[SimID]
-            except KeyError:
-                breakpoint()
-
-            SBE = SBE_dir.split('_')[-1]
-
-            df_data['p2c'].append(p2c)
-            df_data['rustbca_conversion_factor'].append(conversion_factor)
-            df_data['Nsput'].append(Nsput)
-            df_data['strike_point'].append(dataset_for_sim)
-            df_data['Li-SBE (eV)'].append(SBE)
-            df_data['L-Lsep (m)'].append(SimLsep)
-            df_data['simulation time'].append(sim_time)
-            df_data['Nincident'].append(Nincident)
-            df_data['sputtering_yield'].append(Nsput / conversion_factor / Nincident)
-            df_data['gamma'].append(Nsput * p2c / sim_time / conversion_factor)
-
-    df = pd.DataFrame(data = df_data)
+                conversion_factors[ion_name] = {}
+
+    simulations = []
+    for SBE_dir in sorted(glob.glob('rustbca_simulations/SBE*')):
+        for rustbca_simdir in sorted(glob.glob(SBE_dir + '/*from_sp*')):
+            simdir_name = rustbca_simdir.split('/')[-1]
+            SimID = simdir_name.split('from_sp')[0] + 'from_sp'
+            ion_name = simdir_name.split('from_sp')[1]
+
+            # Combined simulations (no ion in the directory name) hold
+            # several species, each of which is a row of the table
+            simulation_ions = [ion_name]
+            if not ion_name:
+                simulation_ions = get_combined_species(rustbca_simdir) or []
+
+            for ion_name in simulation_ions:
+                if ion_name not in ions:
+                    continue
+                IEADfile = f'hpic_results/{SimID}/{SimID}_IEAD_{ion_map[ion_name]}.dat'
+                simulations.append((SBE_dir, rustbca_simdir, SimID, ion_name, IEADfile))
+
+    with profiling.span('RustBCA outputs', 'parse'):
+        sputtered_counts = count_all_sputtered(
+            sorted(set(simulation[1] for simulation in simulations)),
+            processes = processes,
+        )
+    with profiling.span('IEAD totals', 'parse'):
+        IEAD_totals = get_IEAD_totals(
+            [simulation[4] for simulation in simulations],
+            processes = processes,
+        )
+
+    with profiling.span('yields', 'compute'):
+        return _build_sputtering_table(
+            simulations,
+            sputtered_counts,
+            IEAD_totals,
+            p2c_coefficients,
+            simulation_times,
+            conversion_factors,
+        )
+
+
+def _build_sputtering_table(
+        simulations,
+        sputtered_counts,
+        IEAD_totals,
+        p2c_coefficients,
+        simulation_times,
+        conversion_factors):
+
+    df_data = defaultdict(list)
+    for SBE_dir, rustbca_simdir, SimID, ion_name, IEADfile in simulations:
+        dataset_for_sim = common.get_dataset_from_SimID(SimID)
+        SimLsep = common.get_Lsep_from_SimID(SimID)
+        Nincident = IEAD_totals[IEADfile]
+        p2c = p2c_coefficients[SimID]
+        sim_time = simulation_times[SimID]
+
+        counts = sputtered_counts[rustbca_simdir]
+        if 'species' in counts:
+            counts = counts['species'].get(ion_name)
+            if counts is None:
+                print(f'Warning: no {ion_name} particles in {rustbca_simdir}, skipping')
+                continue
+        Nsput = counts['Nsput']
+        if counts['N'] is not None:
+            conversion_factor = counts['N'] / Nincident
+        elif SimID in conversion_factors[ion_name]:
+            conversion_factor = conversion_factors[ion_name][SimID]
+        else:
+            print(f'Warning: no conversion factor for {rustbca_simdir}, skipping')
+            continue
+
+        # Number of REAL sputtered particles this simulation represents.
+        Nsput_real = counts['Nsput_real']
+        if Nsput_real is None:
+            Nsput_real = Nsput / conversion_factor
+
+        SBE = SBE_dir.split('_')[-1]
+
+        df_data['ion'].append(ion_name)
+        df_data['p2c'].append(p2c)
+        df_data['rustbca_conversion_factor'].append(conversion_factor)
+        df_data['Nsput'].append(Nsput)
+        df_data['strike_point'].append(dataset_for_sim)
+        df_data['Li-SBE (eV)'].append(SBE)
+        df_data['L-Lsep (m)'].append(SimLsep)
+        df_data['simulation time'].append(sim_time)
+        df_data['Nincident'].append(Nincident)
+        df_data['sputtering_yield'].append(Nsput_real / Nincident)
+        df_data['gamma'].append(Nsput_real * p2c / sim_time)
+
+    df = pd.DataFrame(data = df_data, columns = _SPUTTERING_TABLE_COLUMNS)
     return df
 
 
+def physical_sputtering(ion_name, hpic_ion_label):
+    df = physical_sputtering_all([ion_name], {ion_name: hpic_ion_label})
+    return df.drop(columns = ['ion'])
+
+
 def get_density_for_Lsep(Lsep, df, ion_name):
     """
     Lsep: the separation from the SP (in meters)
@@ -147,6 +525,9 @@ def plot_sputtered_gamma(df, ion_name, strike_point_label):
     Y-axis: gamma (sputtered particles per meter square per second
     X-Axis: L-Lsep (m)
     """
+    # Only the plotting paths pay for importing matplotlib
+    import matplotlib.pyplot as plt
+
     _, ax = plt.subplots(figsize=(12,10))
     ax.tick_params(axis = 'both', which = 'major', labelsize = 16)
     ax.tick_params(axis = 'both', which = 'minor', labelsize = 16)
@@ -179,6 +560,8 @@ def plot_sputtering_yields(df, ion_name, strike_point_label):
     Y-axis: Y (ratio of sputtered to incident particles)
     X-Axis: L-Lsep (m)
     """
+    import matplotlib.pyplot as plt
+
     _, ax = plt.subplots(figsize=(12,10))
     ax.tick_params(axis = 'both', which = 'major', labelsize = 16)
     ax.tick_params(axis = 'both', which = 'minor', labelsize = 16)
@@ -204,10 +587,25 @@ def plot_sputtering_yields(df, ion_name, strike_point_label):
     )
     plt.show()
 
-if __name__ == '__main__':
+@profiling.profiled('physical_sputtering_amount')
+def main():
+    usage = 'usage: python physical_sputtering_amount.py (<ION_NAME>|all [NUM_PROCESSES])'
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
 
     config = util.load_yaml(common._CONFIG_FILENAME)
     ion_map = common.ion_map(config['ions'])
+
+    if sys.argv[1] == 'all':
+        # Batch mode: every ion, SBE and strike point in one table
+        processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        sputtered = physical_sputtering_all(list(ion_map.keys()), ion_map, processes)
+        with profiling.span(_COMBINED_OUTPUT_FILE, 'write'):
+            sputtered.to_csv(_COMBINED_OUTPUT_FILE, index = False)
+        print(f'saved {len(sputtered)} rows to {_COMBINED_OUTPUT_FILE}')
+        return
+
     ions = [
         #'nD+1',
         #'nNe+1',
@@ -219,3 +617,7 @@ if __name__ == '__main__':
             df = sputtered[(sputtered['strike_point'] == strike_point_label)]
             plot_sputtered_gamma(df, ion_name, strike_point_label)
             #plot_sputtering_yields(df, ion_name, strike_point_label)
+
+
+if __name__ == '__main__':
+    main()
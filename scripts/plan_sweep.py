@@ -0,0 +1,334 @@
+import os
+import sys
+import copy
+import json
+import hashlib
+import itertools
+import yaml
+import util
+import common
+import profiling
+import plasma_parameters
+import configure_simulations as configure
+import build_rustbca_input_files as builder
+
+
+"""
+Expand the parameter sweep in config.yaml (or SPEC_FILE) into a job matrix,
+and forecast its cost before anything runs.
+
+The sweep section gives lists or ranges for the hPIC parameters (ngyro,
+p2-p5) and for the lithium SBE of the RustBCA simulations:
+
+    sweep:
+        ngyro: [5, 10, 20]
+        p3: {start: 10, stop: 40, step: 10}    # stop is included
+        lithium_sbe: [low, high, 2.5]
+
+Parameters left out of the sweep take their value from config.yaml
+(ngyro, hpic_params), or configure_simulations.py's defaults.
+
+Every distinct set of hPIC parameters gets a stable ID, a hash of the
+parameters (e.g. hpic-3f2a9c1e), so the same set always maps to the same
+hPIC runs however the sweep is written. Duplicates (e.g. "low" and 1.0 for
+the SBE, or repeated list entries) are dropped. RustBCA jobs that only
+differ in RustBCA parameters (the SBE) share one hPIC run.
+
+Written to sweep/:
+    jobs.csv                one line per hPIC and RustBCA job, with the job
+                            it depends on and its forecast core-hours
+                            (floored=1 for hPIC jobs whose push estimate
+                            was at or below zero, see floor_hpic_core_hours)
+    <hpic_id>/config.yaml   config.yaml with that set of hPIC parameters, to
+                            run the set as its own campaign directory
+
+Core-hours are forecast from configure_simulations' particle push estimate
+and the throughputs under sweep.forecast; RustBCA jobs assume every IEAD
+is non-empty, so they are an upper bound.
+
+usage: python scripts/plan_sweep.py [SPEC_FILE]
+"""
+
+SWEEP_DIR = 'sweep'
+
+HPIC_PARAMETERS = ('ngyro', 'p2', 'p3', 'p4', 'p5')
+
+# Parameters that estimate_total_particle_pushes' regression was fitted at.
+# Pushes scale with the number of particles (cells per Debye length x
+# particles per cell) times the number of time steps (steps per gyroperiod x
+# transit times).
+_REGRESSION_PARAMETERS = {'p2': 1, 'p3': 20, 'p4': 1, 'p5': 500}
+
+# Rough single-core throughputs; override them in sweep.forecast with values
+# measured on the LCPP boxes.
+_HPIC_PUSHES_PER_CORE_SECOND = 2.0e7
+_RUSTBCA_PARTICLES_PER_CORE_SECOND = 1.0e3
+
+
+def expand_values(value):
+    """
+    A scalar, a list, or a {start, stop, step} range (stop included) -> list
+    of values, without duplicates, in order.
+    """
+    if isinstance(value, dict):
+        start, stop, step = value['start'], value['stop'], value.get('step', 1)
+        if step <= 0 or stop < start:
+            print(f'bad sweep range {value}: need start <= stop and step > 0')
+            sys.exit(1)
+        count = int(round((stop - start) / step)) + 1
+        values = [round(start + i * step, 12) for i in range(count)]
+        if all(isinstance(x, int) for x in (start, stop, step)):
+            values = [int(x) for x in values]
+    elif isinstance(value, list):
+        values = value
+    else:
+        values = [value]
+
+    unique = []
+    for x in values:
+        if x not in unique:
+            unique.append(x)
+    return unique
+
+
+def get_hpic_id(hpic_parameters):
+    """
+    Stable ID of a set of hPIC parameters
+    """
+    canonical = json.dumps({k: float(v) for k, v in hpic_parameters.items()}, sort_keys = True)
+    return 'hpic-' + hashlib.sha1(canonical.encode()).hexdigest()[:8]
+
+
+def expand_hpic_parameters(sweep, config):
+    """
+    :returns: (number of combinations before deduplication,
+        dictionary of hPIC ID -> parameters)
+    """
+    hpic_params = config.get('hpic_params', {})
+    base = {
+        'ngyro': config.get('ngyro') or configure._NGyro,
+        'p2': hpic_params.get('p2') or configure.get_grid_points_per_debye_length(None),
+        'p3': hpic_params.get('p3') or configure.get_time_steps_per_gyroperiod(None),
+        'p4': hpic_params.get('p4') or configure.get_num_ion_transit_times(None),
+        'p5': hpic_params.get('p5') or configure.get_num_particles_per_cell(None),
+    }
+    axes = [expand_values(sweep.get(name, base[name])) for name in HPIC_PARAMETERS]
+
+    combinations = 0
+    hpic_sets = {}
+    for values in itertools.product(*axes):
+        combinations += 1
+        parameters = dict(zip(HPIC_PARAMETERS, values))
+        hpic_sets.setdefault(get_hpic_id(parameters), parameters)
+    return combinations, hpic_sets
+
+
+def expand_surface_binding_energies(sweep):
+    """
+    :returns: sorted, deduplicated SBEs in eV
+    """
+    SBEs = set()
+    for value in expand_values(sweep.get('lithium_sbe', list(builder.LITHIUM_SURFACE_BINDING_ENERGIES))):
+        SBE = builder.parse_surface_binding_energy(value)
+        if SBE is None:
+            print(f'bad sweep.lithium_sbe value "{value}" (low|high|<SBE_eV>)')
+            sys.exit(1)
+        SBEs.add(SBE)
+    return sorted(SBEs)
+
+
+def get_rustbca_species(config):
+    """
+    Species that get a RustBCA simulation, in config order
+    """
+    return [
+        ion_name for ion_name in common.ion_map(config['ions'])
+        if ion_name in builder.incident_ions and ion_name not in builder.SKIP_IONS
+    ]
+
+
+def estimate_hpic_pushes(df_row, parameters):
+    """
+    Can be zero or negative: the regression's intercept is negative, so it
+    goes below zero for small ngyro x gyroradius / Debye length (see
+    floor_hpic_core_hours).
+    """
+    rg = plasma_parameters.gyroradius_for_row(df_row)
+    debye_length = plasma_parameters.compute_debye_length_for_row(df_row)
+    pushes = configure.estimate_total_particle_pushes(rg, debye_length, parameters['ngyro'])
+    for name, fitted in _REGRESSION_PARAMETERS.items():
+        pushes *= parameters[name] / fitted
+    return pushes
+
+
+def floor_hpic_core_hours(jobs):
+    """
+    hPIC jobs whose push estimate isn't positive would be forecast as free.
+    Give them the smallest positive hPIC forecast instead, and mark them as
+    floored so the forecast can say how many there are.
+
+    :returns: the number of floored jobs
+    """
+    hpic_jobs = [job for job in jobs if job['stage'] == 'hpic']
+    positive = [job['core_hours'] for job in hpic_jobs if job['core_hours'] > 0]
+    floor = min(positive) if positive else 0.0
+    floored = 0
+    for job in hpic_jobs:
+        job['floored'] = job['core_hours'] <= 0
+        if job['floored']:
+            job['core_hours'] = floor
+            floored += 1
+    return floored
+
+
+def get_rustbca_particles(config):
+    """
+    Simulation particles per RustBCA job
+    """
+    rustbca_config = config.get('rustbca', {})
+    if rustbca_config.get('particle_allocation', 'uniform') == 'importance':
+        return rustbca_config.get('importance_sampling_N', builder.IMPORTANCE_SAMPLING_N)
+    return builder.HIGH_RESOLUTION_N
+
+
+def build_job_matrix(config, sweep):
+    """
+    :returns: (list of job dictionaries, dictionary of hPIC ID -> parameters,
+        summary dictionary)
+    """
+    forecast = sweep.get('forecast', {})
+    pushes_per_second = forecast.get('hpic_pushes_per_core_second', _HPIC_PUSHES_PER_CORE_SECOND)
+    particles_per_second = forecast.get(
+        'rustbca_particles_per_core_second', _RUSTBCA_PARTICLES_PER_CORE_SECOND,
+    )
+
+    combinations, hpic_sets = expand_hpic_parameters(sweep, config)
+    SBEs = expand_surface_binding_energies(sweep)
+    species = get_rustbca_species(config)
+    rustbca_core_hours = get_rustbca_particles(config) / particles_per_second / 3600
+
+    solps_data = {}
+    for data_set_label, datafile in common.DATAFILES.items():
+        with profiling.span(f'SOLPS {data_set_label}', 'load'):
+            solps_data[data_set_label] = util.load_solps_data(datafile)
+
+    jobs = []
+    for hpic_id, parameters in sorted(hpic_sets.items()):
+        for data_set_label, df in solps_data.items():
+            for _, row in df.iterrows():
+                SimID = configure.get_simulation_id(data_set_label, row)
+                hpic_job_id = f'{hpic_id}/{SimID}'
+                jobs.append({
+                    'job_id': hpic_job_id,
+                    'stage': 'hpic',
+                    'depends_on': '',
+                    'SimID': SimID,
+                    'ion': '',
+                    'hpic_id': hpic_id,
+                    **parameters,
+                    'SBE': '',
+                    'core_hours': estimate_hpic_pushes(row, parameters) / pushes_per_second / 3600,
+                })
+                for SBE in SBEs:
+                    for ion_name in species:
+                        jobs.append({
+                            'job_id': f'{hpic_id}/{builder.get_SBE_label(SBE)}/{SimID}{ion_name}',
+                            'stage': 'rustbca',
+                            'depends_on': hpic_job_id,
+                            'SimID': SimID,
+                            'ion': ion_name,
+                            'hpic_id': hpic_id,
+                            **parameters,
+                            'SBE': SBE,
+                            'core_hours': rustbca_core_hours,
+                        })
+
+    floored = floor_hpic_core_hours(jobs)
+
+    summary = {
+        'hPIC parameter combinations': combinations,
+        'distinct hPIC parameter sets': len(hpic_sets),
+        'SBEs': len(SBEs),
+        'RustBCA species': len(species),
+        'hPIC jobs with a floored forecast': floored,
+    }
+    return jobs, hpic_sets, summary
+
+
+def print_forecast(jobs, summary):
+    for name, value in summary.items():
+        print(f'{name}: {value}')
+
+    print(f'\n{"stage":<10} {"jobs":>8} {"core-hours":>12}')
+    total = 0.0
+    for stage in ('hpic', 'rustbca'):
+        stage_jobs = [job for job in jobs if job['stage'] == stage]
+        core_hours = sum(job['core_hours'] for job in stage_jobs)
+        total += core_hours
+        print(f'{stage:<10} {len(stage_jobs):>8} {core_hours:>12.1f}')
+    print(f'{"total":<10} {len(jobs):>8} {total:>12.1f}')
+
+    floored = [job['job_id'] for job in jobs if job.get('floored')]
+    if floored:
+        print(
+            f'\n{len(floored)} hPIC jobs have a push estimate at or below zero and are forecast at '
+            + 'the smallest positive hPIC estimate instead (floored=1 in jobs.csv):'
+        )
+        for job_id in floored:
+            print(f'    {job_id}')
+
+    hpic_jobs = sum(job['stage'] == 'hpic' for job in jobs)
+    if hpic_jobs:
+        shared = (len(jobs) - hpic_jobs) / hpic_jobs
+        print(f'\neach hPIC run is shared by {shared:.0f} RustBCA jobs')
+
+
+def write_job_matrix(jobs, hpic_sets, config):
+    util.mkdir(SWEEP_DIR)
+    columns = ['job_id', 'stage', 'depends_on', 'SimID', 'ion', 'hpic_id', *HPIC_PARAMETERS, 'SBE', 'core_hours', 'floored']
+    with open(os.path.join(SWEEP_DIR, 'jobs.csv'), 'w') as f:
+        f.write(','.join(columns) + '\n')
+        for job in jobs:
+            values = [job[column] for column in columns[:-2]] + [
+                f'{job["core_hours"]:.4g}',
+                int(job.get('floored', False)),
+            ]
+            f.write(','.join(str(value) for value in values) + '\n')
+
+    for hpic_id, parameters in hpic_sets.items():
+        hpic_config = copy.deepcopy(config)
+        hpic_config.pop('sweep', None)
+        hpic_config['ngyro'] = parameters['ngyro']
+        hpic_config.setdefault('hpic_params', {})
+        for name in HPIC_PARAMETERS[1:]:
+            hpic_config['hpic_params'][name] = parameters[name]
+        util.mkdir(os.path.join(SWEEP_DIR, hpic_id))
+        with open(os.path.join(SWEEP_DIR, hpic_id, common._CONFIG_FILENAME), 'w') as f:
+            yaml.dump(hpic_config, f, sort_keys = False)
+    print(f'\nwrote {len(jobs)} jobs to {SWEEP_DIR}/jobs.csv')
+
+
+@profiling.profiled('plan_sweep')
+def main():
+    with profiling.span('config', 'load'):
+        config = util.load_yaml(common._CONFIG_FILENAME)
+        sweep = config.get('sweep') or {}
+        if len(sys.argv) > 1:
+            sweep = util.load_yaml(sys.argv[1])
+            sweep = sweep.get('sweep', sweep)
+
+    unknown = set(sweep) - set(HPIC_PARAMETERS) - {'lithium_sbe', 'forecast'}
+    if unknown:
+        print(f'unknown sweep parameters: {", ".join(sorted(unknown))}')
+        print(f'(sweepable: {", ".join(HPIC_PARAMETERS)}, lithium_sbe)')
+        sys.exit(1)
+
+    with profiling.span('job matrix', 'compute'):
+        jobs, hpic_sets, summary = build_job_matrix(config, sweep)
+    print_forecast(jobs, summary)
+    with profiling.span('jobs.csv', 'write'):
+        write_job_matrix(jobs, hpic_sets, config)
+
+
+if __name__ == '__main__':
+    main()
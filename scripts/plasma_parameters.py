@@ -0,0 +1,83 @@
+import numpy as np
+import scientific_constants as sc
+from common import _ions_of_interest
+
+
+"""
+Plasma parameters computed from SOLPS data at the divertor. These are the
+physics helpers shared by configure_simulations.py and the exploratory
+plotting scripts (gyroradius.py, debye_length.py); they live here so that
+configuring simulations never pulls in matplotlib or pandas.
+"""
+
+Qe = sc.qe
+
+
+# 1 Dalton [kg]
+amu2kg = sc.amu2kg
+
+
+# Boltzmann Constant [J/K]
+kB = sc.kB
+
+
+def gyroradius_for_row(df_row):
+    """
+    Calculate the gyroradius given a row (i.e. a LOCATION) at the divertor.
+
+    Since all other ions have a low density compared to deuterium, we consider
+    ONLY the deuterium mass/charge when determining the gyroradius.
+
+    :param: df_row: a single row in the SOLPS output data, or the whole
+        DataFrame to compute every row at once.
+    :returns: gyroradius, in meters
+    """
+
+    B0 = df_row['|B| (T)']
+    Ti = df_row['Ti (eV)']
+
+    dt_ion_info = _ions_of_interest['nD+1']
+    A_D = dt_ion_info['Ai']
+    q_D = dt_ion_info['qi'] * sc.qe
+    m_D = A_D * sc.amu2kg
+
+    # Since all other ions have a low density compared to deuterium,
+    # consider ONLY the deuterium mass/charge to determine the gyroradius.
+    rg = gyroradius(Ti, m_D, q_D, B0)
+    return rg
+
+
+def gyroradius(T, m, q, B):
+    """
+    Calculate the gyroradius of a species in the tokamak.
+
+    To compute v_parallel, use the mean velocity formula: sqrt(8/pi * kT/m)
+
+    All arguments may be arrays.
+
+    :param: T: ion temperature, in eV
+    :param: m: ion mass, in kg
+    :param: q: ion charge, in Coulombs
+    :param: B: B field strength, in Tesla
+
+    :returns: gyroradius, in meters
+    """
+    v = np.sqrt(2 * Qe * T / m)
+    rg = m * v / q / B
+    return rg
+
+
+def compute_debye_length_for_row(df_row):
+    """
+    return the debye length for a row in meters. Also works on the whole
+    DataFrame, returning the debye length of every row.
+    """
+    # Assumption: the electron density is equal to the sum of
+    # all lithium, neon, and deuterium ion densities.
+    ne = df_row['nD+1']
+
+    Te = df_row['Te (eV)']
+
+    # Compute the debye length [m]
+    debye_length = np.sqrt(sc.eps0 * Te / (sc.qe * ne))
+    return debye_length
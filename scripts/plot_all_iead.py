@@ -1,39 +1,59 @@
+import os
+import sys
+import glob
+import shutil
+import subprocess
 import util
 import common
-import glob
+import iead
 import numpy as np
+import matplotlib
+# Frames are only ever written to disk; never open a window
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import pandas as pd
+from build_rustbca_input_files import get_Te_for_Lsep
+from concurrent.futures import ProcessPoolExecutor
+
+
+"""
+This script renders the IEAD of every hPIC simulation, for every species, as
+one frame per simulation in hpic_results/video/<ION_NAME>/, ordered by
+divertor position. With "animate", the frames of each species are also
+assembled into hpic_results/video/iead_<ION_NAME>.mp4 (requires ffmpeg).
 
-FIG_NUM=0
+Frames are rendered in a process pool, one figure at a time per process.
 
-def plot_iead(iead_datafile, Te_eV, data_set_label, SimLsep, SimID):
-    global FIG_NUM
-    plt.figure(FIG_NUM)
+usage: python scripts/plot_all_iead.py [NUM_PROCESSES] [animate]
+"""
 
-    IEAD   = np.genfromtxt(iead_datafile,delimiter=' ')
-    energy = np.linspace(0.0,24.0*Te_eV,240)
-    angles = np.linspace(0,90,90)
+_VIDEO_DIR = 'hpic_results/video'
+_DPI = 300
+_FRAMES_PER_SECOND = 4
+
+
+def plot_iead(iead_datafile, grid, Te_eV, data_set_label, SimLsep, ion_name, frame_filename):
+    IEAD, grid = iead.read_IEAD(iead_datafile, grid)
+    energy = iead.get_energy_centers(grid) * Te_eV
+    angles = iead.get_angle_centers(grid)
     E,A = np.meshgrid(angles,energy)
-    plt.contourf(E,A,IEAD)
-    plt.xlabel('Angle [deg]')
-    plt.ylabel('Energy [eV]')
-    plt.ylim([0,50])
-    plt.title(f'IEAD for {data_set_label} SOP, Lsep = {SimLsep:.4}m, Te = {Te_eV:.3}eV')
-
-    plt.savefig(
-        f'hpic_results/video/iead_{FIG_NUM:02}.png',
-        dpi = 300,
-    )
-    FIG_NUM += 1
 
+    fig, ax = plt.subplots()
+    ax.contourf(E,A,IEAD)
+    ax.set_xlabel('Angle [deg]')
+    ax.set_ylabel('Energy [eV]')
+    ax.set_ylim([0,50])
+    ax.set_title(f'{ion_name} IEAD for {data_set_label} SOP, Lsep = {SimLsep:.4}m, Te = {Te_eV:.3}eV')
 
-def main():
-    datafiles = common.DATAFILES
-    solps_data = {}
-    for data_set_label, datafile in datafiles.items():
-        solps_data[data_set_label] = util.load_solps_data(datafile)
+    fig.savefig(frame_filename, dpi = _DPI)
+    plt.close(fig)
+    return frame_filename
+
+
+def _plot_iead(args):
+    return plot_iead(*args)
 
+
+def get_sorted_sims():
     # "minus_0.004m" is logically greater than "minux_0.139" but
     # lexicographically less than it. Achieve logical order by processing
     # globs in chunks.
@@ -41,40 +61,89 @@ def main():
     chunk2 = sorted(glob.glob('hpic_results/inner_sop_plus*'))
     chunk3 = sorted(glob.glob('hpic_results/outer_sop_minus*'), reverse = True)
     chunk4 = sorted(glob.glob('hpic_results/outer_sop_plus*'))
-    sims = chunk1 + chunk2 + chunk3 + chunk4
-    for SimID in sims:
+    return chunk1 + chunk2 + chunk3 + chunk4
+
+
+def assemble_animation(frame_dir, movie_filename):
+    if shutil.which('ffmpeg') is None:
+        print(f'ffmpeg not found, not creating {movie_filename}')
+        return
+    subprocess.run(
+        [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-framerate', str(_FRAMES_PER_SECOND),
+            '-i', os.path.join(frame_dir, 'iead_%03d.png'),
+            # libx264 needs even frame dimensions
+            '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+            '-pix_fmt', 'yuv420p',
+            movie_filename,
+        ],
+        check = True,
+    )
+    print(f'wrote {movie_filename}')
+
+
+def main():
+    processes = None
+    animate = False
+    for arg in sys.argv[1:]:
+        if arg == 'animate':
+            animate = True
+        elif arg.isdigit():
+            processes = int(arg)
+        else:
+            print('usage: python plot_all_iead.py [NUM_PROCESSES] [animate]')
+            sys.exit(1)
+
+    config = util.load_yaml(common._CONFIG_FILENAME)
+    ion_map = common.ion_map(config['ions'])
+    grid = iead.get_grid(config)
+
+    solps_data = {}
+    for data_set_label, datafile in common.DATAFILES.items():
+        solps_data[data_set_label] = util.load_solps_data(datafile)
+
+    jobs = []
+    # Frames are numbered per species, without gaps for ffmpeg
+    frames = dict.fromkeys(ion_map, 0)
+    for ion_name in ion_map:
+        util.mkdir(f'{_VIDEO_DIR}/{ion_name}')
+        # Frames left over from a run with more simulations would end up at
+        # the end of the video
+        for frame_filename in glob.glob(f'{_VIDEO_DIR}/{ion_name}/iead_*.png'):
+            os.remove(frame_filename)
+
+    for SimID in get_sorted_sims():
         # we need to find the electron temperature for the divertor position
         # value associated with this hPIC simulation.
         dataset_for_sim = common.get_dataset_from_SimID(SimID)
-
         SimLsep = common.get_Lsep_from_SimID(SimID)
+        Te_eV = get_Te_for_Lsep(SimLsep, solps_data[dataset_for_sim])
 
-        # When the hPIC simulations were configured, Lsep was truncated at
-        # 3 decimal points and converted to a string. So we need to go back
-        # and inspect the SOLPS data to fiture out which row of data has
-        # the closest Lsep value to the one we used for the Simulation ID,
-        # i.e. find which was SOLPS data row was used to configure this
-        # hPIC simulation in the first place.
-        idx = solps_data[dataset_for_sim]['L-Lsep (m)'].searchsorted(SimLsep)
-        if idx == len(solps_data[dataset_for_sim]):
-            idx -= 1
-
-        # searchsorted returns the index at which WOULD be appropriate to
-        # insert the requested value into the array, to preserve order.
-        # Since the SOLPS data contains both +/- values, the row we are
-        # looking for could be at i-1.
-        NextLsep = solps_data[dataset_for_sim].iloc[idx]['L-Lsep (m)']
-        PrevLsep =  solps_data[dataset_for_sim].iloc[idx-1]['L-Lsep (m)']
-
-        if abs(NextLsep - SimLsep) < abs(PrevLsep - SimLsep):
-            Te_eV = solps_data[dataset_for_sim].iloc[idx]['Te (eV)']
-        else:
-            Te_eV = solps_data[dataset_for_sim].iloc[idx-1]['Te (eV)']
+        for ion_name, hpic_label in ion_map.items():
+            iead_datafiles = glob.glob(f'{SimID}/*IEAD_{hpic_label}.dat')
+            if not iead_datafiles:
+                print(f'no {ion_name} IEAD in {SimID}, skipping it')
+                continue
+            iead_datafile = iead_datafiles[0]
+            frame_filename = f'{_VIDEO_DIR}/{ion_name}/iead_{frames[ion_name]:03}.png'
+            frames[ion_name] += 1
+            jobs.append((iead_datafile, grid, Te_eV, dataset_for_sim, SimLsep, ion_name, frame_filename))
+
+    print(f'rendering {len(jobs)} frames...')
+    with ProcessPoolExecutor(max_workers = processes) as pool:
+        for frame_filename in pool.map(_plot_iead, jobs, chunksize = 4):
+            print(f'wrote {frame_filename}')
 
-        iead_datafile = glob.glob(f'{SimID}/*IEAD_sp0.dat')[0]
-        plot_iead(iead_datafile, Te_eV, data_set_label, SimLsep, SimID)
+    if animate:
+        for ion_name in ion_map:
+            if not frames[ion_name]:
+                continue
+            assemble_animation(
+                f'{_VIDEO_DIR}/{ion_name}',
+                f'{_VIDEO_DIR}/iead_{ion_name}.mp4',
+            )
 
 
 if __name__ == '__main__':
     main()
-
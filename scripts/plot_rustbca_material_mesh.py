@@ -1,34 +1,35 @@
+import os
 import sys
 import toml
 import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib.collections import LineCollection
 
-def plot_mesh(geometry_config, particle_params, show = False, outfile = None):
+def plot_mesh(geometry_config, particle_params, show = False, outfile = None, stride = 1):
+        """
+        Plot the triangles of a 2D RustBCA mesh, its boundaries, and the
+        starting position and direction of the particles.
+
+        The whole mesh is drawn as a single LineCollection and all particle
+        directions with a single quiver call, so meshes with many thousands
+        of triangles and full particle sets stay fast to draw.
+
+        :param: stride: only plot every stride-th particle
+        """
         _, ax = plt.subplots(figsize=(12,10))
         ax.tick_params(axis = 'both', which = 'major', labelsize = 20)
         ax.tick_params(axis = 'both', which = 'minor', labelsize = 20)
 
-        # Coordinate Sets
-        triangles = geometry_config['triangles']
-        N = len(triangles) * 3
-        mesh = np.zeros((N,2))
-        for n in range(N):
-            coords = triangles[n // 3]
-            x, y = coords[n % 3], coords[(n % 3) + 3]
-            mesh[n][0] = x
-            mesh[n][1] = y
-
-        for n in range(0,N,3):
-            triangle = np.append(
-                mesh[n:n+3],
-                [list(mesh[n])],
-                axis = 0,
-            )
-            plt.plot(triangle[:,0], triangle[:,1], 'b-')
+        # Each triangle is [x1, x2, x3, y1, y2, y3]. Close each one by
+        # repeating its first vertex.
+        triangles = np.asarray(geometry_config['triangles'], dtype = float).reshape(-1, 6)
+        vertices = np.stack([triangles[:, :3], triangles[:, 3:]], axis = -1)
+        outlines = np.concatenate([vertices, vertices[:, :1]], axis = 1)
+        ax.add_collection(LineCollection(outlines, colors = 'b', linewidths = 0.5))
 
         # Mesh Boundary
         mesh_boundary = np.array(geometry_config['material_boundary_points'])
-        plt.plot(
+        ax.plot(
             mesh_boundary[:,0],
             mesh_boundary[:,1],
             '*',
@@ -38,34 +39,39 @@ def plot_mesh(geometry_config, particle_params, show = False, outfile = None):
 
         # Simulation Boundary
         simulation_boundary = np.array(geometry_config['simulation_boundary_points'])
-        plt.plot(
+        ax.plot(
             simulation_boundary[:,0],
             simulation_boundary[:,1],
             '^',
             label = 'simulation_boundary',
         )
 
-        # Plot All Particle Directions
-        plotted_particle_starts = set()
-        for x, v in list(zip(particle_params['pos'], particle_params['dir']))[::100]:
-            if (x[0], x[1]) not in plotted_particle_starts:
-                plt.plot(x[0], x[1], 'o')
-                plotted_particle_starts.add((x[0], x[1]))
-            v_norm = np.sqrt(np.dot(np.array(v), np.array(v)))
-            arrow_end = x
-            arrow_start = (x[0] + v[0], x[1] + v[1])
-            plt.annotate('',
-                xytext=(arrow_end[0],arrow_end[1]),
-                xy=(arrow_start[0], arrow_start[1]),
-                arrowprops=dict(facecolor='black', width = 0.5),
+        # Plot All Particle Directions. Many particles share a starting
+        # position and direction, so each distinct arrow is drawn once.
+        pos = np.asarray(particle_params['pos'], dtype = float).reshape(-1, 3)[::stride]
+        direction = np.asarray(particle_params['dir'], dtype = float).reshape(-1, 3)[::stride]
+        if len(pos):
+            arrows = np.unique(np.hstack([pos[:, :2], direction[:, :2]]), axis = 0)
+            starts = np.unique(arrows[:, :2], axis = 0)
+            ax.plot(starts[:, 0], starts[:, 1], 'o', label = 'particle starts')
+            ax.quiver(
+                arrows[:, 0],
+                arrows[:, 1],
+                arrows[:, 2],
+                arrows[:, 3],
+                angles = 'xy',
+                scale_units = 'xy',
+                scale = 1,
+                width = 0.002,
             )
 
+        ax.autoscale_view()
 
         length_unit = geometry_config['length_unit'].lower()
-        plt.title('2-D Simulation Mesh', fontsize = 20)
-        plt.ylabel('y (%s)' % length_unit, fontsize = 20)
-        plt.xlabel('x (%s)' % length_unit, fontsize = 20)
-        plt.legend(prop = dict(size=16))
+        ax.set_title('2-D Simulation Mesh', fontsize = 20)
+        ax.set_ylabel('y (%s)' % length_unit, fontsize = 20)
+        ax.set_xlabel('x (%s)' % length_unit, fontsize = 20)
+        ax.legend(prop = dict(size=16))
 
         if outfile is not None:
             plt.savefig(outfile, dpi = 300, bbox_inches = 'tight')
@@ -77,14 +83,38 @@ def plot_mesh(geometry_config, particle_params, show = False, outfile = None):
 
 
 
-if __name__ == '__main__':
+def main():
+    if len(sys.argv) < 2:
+        print('usage: python plot_rustbca_material_mesh.py <RUSTBCA_INPUT_FILE>')
+        sys.exit(1)
     rustbca_input_file = sys.argv[1]
     with open(rustbca_input_file, 'r') as f:
         data = toml.load(f)
 
+    if 'triangles' not in data['geometry_input']:
+        print(f'{rustbca_input_file} was not built for a 2D mesh, nothing to plot')
+        sys.exit(1)
+
+    # Inputs built with "particle_input: hdf5" keep their particles in
+    # particles.h5 next to the input file.
+    particle_params = data['particle_parameters']
+    if particle_params.get('particle_input_filename'):
+        from build_rustbca_input_files import read_hdf5_particle_input
+        particles = read_hdf5_particle_input(
+            os.path.join(os.path.dirname(rustbca_input_file), 'particles.h5')
+        )
+        particle_params = {
+            'pos': np.stack([particles['x'], particles['y'], particles['z']], axis = -1),
+            'dir': np.stack([particles['ux'], particles['uy'], particles['uz']], axis = -1),
+        }
+
     plot_mesh(
         data['geometry_input'],
-        data['particle_parameters'],
+        particle_params,
         outfile = data['options']['name'] + '.png',
         show = True,
     )
+
+
+if __name__ == '__main__':
+    main()
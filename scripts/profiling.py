@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import contextlib
+
+
+"""
+Lightweight instrumentation shared by the pipeline scripts.
+
+Scripts wrap their main() in @profiled and mark the interesting parts of the
+work with spans:
+
+    with profiling.span('IEAD', 'parse'):
+        IEAD = np.genfromtxt(IEADfile)
+
+Span categories are one of CATEGORIES. Nothing is recorded unless profiling
+is turned on, either with the FNSF_PROFILE environment variable or a
+--profile argument, whose value selects what is captured (comma separated):
+
+    spans        timed spans only (the default for FNSF_PROFILE=1 / --profile)
+    cprofile     also a cProfile of the whole run
+    tracemalloc  also peak memory and the top allocation sites
+    all          everything
+
+e.g. FNSF_PROFILE=cprofile python scripts/find_p2c_values.py
+     python scripts/build_rustbca_input_files.py low --profile=all
+
+At exit, the spans are written to profiles/<script>-<time>.trace.json in the
+Chrome trace format (open in chrome://tracing or https://ui.perfetto.dev)
+and summarized in a table. Spans recorded in worker processes of a process
+pool are not collected.
+"""
+
+CATEGORIES = ('load', 'parse', 'compute', 'serialize', 'write')
+
+_ENV_VAR = 'FNSF_PROFILE'
+_FLAG = '--profile'
+_OUTPUT_DIR = 'profiles'
+_MODES = ('spans', 'cprofile', 'tracemalloc')
+_TOP = 15
+
+_enabled = False
+_events = []
+
+
+def is_enabled():
+    return _enabled
+
+
+def parse_modes(value):
+    """
+    '1', 'spans', 'cprofile,tracemalloc', 'all', ... -> set of modes. Empty or
+    '0' means profiling is off.
+    """
+    if value is None or value.strip().lower() in ('', '0', 'false', 'no'):
+        return set()
+    modes = set(['spans'])
+    for mode in value.lower().split(','):
+        mode = mode.strip()
+        if mode == 'all':
+            modes.update(_MODES)
+        elif mode in _MODES:
+            modes.add(mode)
+        elif mode not in ('1', 'true', 'yes'):
+            print(f'unknown profiling mode "{mode}" ({"|".join(_MODES)}|all)')
+            sys.exit(1)
+    return modes
+
+
+def pop_profile_flag(argv):
+    """
+    Remove --profile / --profile=MODES from argv (in place), so scripts can
+    keep parsing sys.argv positionally.
+
+    :returns: the modes value, or None if the flag is absent
+    """
+    value = None
+    for arg in list(argv[1:]):
+        if arg == _FLAG:
+            value = 'spans'
+            argv.remove(arg)
+        elif arg.startswith(_FLAG + '='):
+            value = arg.split('=', 1)[1]
+            argv.remove(arg)
+    return value
+
+
+@contextlib.contextmanager
+def span(name, category):
+    """
+    Time a block of work. A no-op unless profiling is enabled.
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        _events.append((name, category, start, end, threading.get_ident()))
+
+
+def write_trace(filename, t0):
+    pid = os.getpid()
+    trace_events = [
+        {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start - t0) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': pid,
+            'tid': tid,
+        }
+        for name, category, start, end, tid in _events
+    ]
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+
+
+def print_summary(wall_time):
+    """
+    Total time per (category, name), largest first. Nested spans are counted
+    in each of their enclosing spans too.
+    """
+    totals = {}
+    for name, category, start, end, _ in _events:
+        count, total, longest = totals.get((category, name), (0, 0.0, 0.0))
+        totals[(category, name)] = (count + 1, total + end - start, max(longest, end - start))
+
+    print(f'\n{"category":<10} {"span":<32} {"count":>7} {"total (s)":>10} {"mean (ms)":>10} {"max (ms)":>10} {"% wall":>7}')
+    for (category, name), (count, total, longest) in sorted(totals.items(), key = lambda kv: -kv[1][1]):
+        print(
+            f'{category:<10} {name[:32]:<32} {count:>7} {total:>10.3f} '
+            + f'{1e3 * total / count:>10.2f} {1e3 * longest:>10.2f} {100 * total / wall_time:>7.1f}'
+        )
+    print(f'wall time: {wall_time:.3f} s')
+
+
+def profiled(script_name):
+    """
+    Decorator for a script's main(): turns profiling on from FNSF_PROFILE or
+    --profile, and writes the trace, summary and any cProfile/tracemalloc
+    results once main() returns (or exits).
+    """
+    def decorator(main):
+        @functools.wraps(main)
+        def wrapper(*args, **kwargs):
+            global _enabled
+            flag_value = pop_profile_flag(sys.argv)
+            modes = parse_modes(flag_value if flag_value is not None else os.environ.get(_ENV_VAR))
+            if not modes:
+                return main(*args, **kwargs)
+
+            _enabled = True
+            profiler = None
+            if 'cprofile' in modes:
+                import cProfile
+                profiler = cProfile.Profile()
+            if 'tracemalloc' in modes:
+                import tracemalloc
+                tracemalloc.start()
+
+            t0 = time.perf_counter()
+            try:
+                if profiler is not None:
+                    profiler.enable()
+                with span(script_name, 'compute'):
+                    return main(*args, **kwargs)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                wall_time = time.perf_counter() - t0
+                _enabled = False
+                report(script_name, t0, wall_time, profiler, 'tracemalloc' in modes)
+        return wrapper
+    return decorator
+
+
+def report(script_name, t0, wall_time, profiler, trace_memory):
+    if not os.path.exists(_OUTPUT_DIR):
+        os.makedirs(_OUTPUT_DIR)
+    basename = os.path.join(_OUTPUT_DIR, f'{script_name}-{time.strftime("%Y%m%dT%H%M%S")}')
+
+    write_trace(basename + '.trace.json', t0)
+    print_summary(wall_time)
+    print(f'trace written to {basename}.trace.json')
+
+    if profiler is not None:
+        import pstats
+        profiler.dump_stats(basename + '.prof')
+        print(f'\ncProfile (top {_TOP} by cumulative time), full stats in {basename}.prof')
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(_TOP)
+
+    if trace_memory:
+        import tracemalloc
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        print(f'\npeak traced memory: {peak / 1e6:.1f} MB. Top {_TOP} allocation sites still held:')
+        for stat in snapshot.statistics('lineno')[:_TOP]:
+            print(f'    {stat}')
@@ -0,0 +1,278 @@
+import os
+import sys
+import glob
+import numpy as np
+import pandas as pd
+import util
+import common
+import rustbca_output
+import build_rustbca_input_files as builder
+from physical_sputtering_amount import get_strata_weights, get_combined_species
+from concurrent.futures import ProcessPoolExecutor
+
+
+"""
+This script reduces the sputtered, reflected and deposited list outputs of
+every RustBCA simulation to a compact summary.npz in the simulation
+directory:
+
+    <kind>_count:           number of particles (weighted, for
+                            importance-sampled simulations)
+    <kind>_energy_angle:    energy x angle histogram (sputtered, reflected)
+    deposited_depth:        implantation depth histogram of the incident
+                            species (target recoils are left out)
+    energy_edges, angle_edges, depth_edges: the bin edges
+
+Combined multi-species simulations (rustbca.combine_species) also get every
+one of these per species, split by the species tag of each particle:
+<kind>_<ion name>_count, <kind>_<ion name>_energy_angle and
+deposited_<ion name>_depth. Simulations run in batches by
+run_rustbca_batches.py are reduced batch by batch, into each batch_*
+directory.
+
+Each output file is streamed once, in chunks, so even multi-GB outputs never
+have to fit in memory. Simulations whose summary is newer than all of their
+outputs are skipped.
+
+usage: python scripts/reduce_rustbca_outputs.py [NUM_PROCESSES]
+"""
+
+# Implantation depth bins, [min, max, number of bins] in microns. Overridden
+# by rustbca.summary_depth_bins in config.yaml.
+DEPTH_BINS = [0.0, 0.1, 100]
+
+
+SUMMARY_FILENAME = 'summary.npz'
+
+
+def get_edges(low, high, num):
+    return np.linspace(low, high, int(num) + 1)
+
+
+def bin_indices(values, edges):
+    """
+    Index of the bin each value falls in, or -1 outside the edges.
+    """
+    idx = np.floor((values - edges[0]) / (edges[1] - edges[0])).astype(np.int64)
+    idx[(idx < 0) | (idx >= len(edges) - 1)] = -1
+    return idx
+
+
+def histogram2d(x, y, x_edges, y_edges, weights):
+    """
+    2D histogram with np.bincount on the flattened bin index, which is much
+    faster than np.histogram2d for uniform bins.
+    """
+    ix = bin_indices(x, x_edges)
+    iy = bin_indices(y, y_edges)
+    inside = (ix >= 0) & (iy >= 0)
+    ny = len(y_edges) - 1
+    flat = ix[inside] * ny + iy[inside]
+    counts = np.bincount(
+        flat,
+        weights = weights[inside],
+        minlength = (len(x_edges) - 1) * ny,
+    )
+    return counts.reshape(len(x_edges) - 1, ny)
+
+
+def histogram1d(x, edges, weights):
+    ix = bin_indices(x, edges)
+    inside = ix >= 0
+    return np.bincount(ix[inside], weights = weights[inside], minlength = len(edges) - 1)
+
+
+def get_particle_weights(chunk, strata_weights):
+    """
+    Importance-sampled particles are weighted by the IEAD bin they came from
+    (see build_rustbca_input_files.STRATUM_Z_SPACING), others count once.
+    """
+    if strata_weights is None:
+        return np.ones(len(chunk['z']))
+    tags = np.round(chunk['z'] / builder.STRATUM_Z_SPACING).astype(np.int64)
+    valid = (tags >= 0) & (tags < len(strata_weights))
+    weights = np.zeros(len(tags))
+    weights[valid] = strata_weights[tags[valid]]
+    return weights
+
+
+def emission_angle(chunk):
+    """
+    Angle (degrees) between a particle's direction and the outward surface
+    normal (-x).
+    """
+    return np.degrees(np.arccos(np.clip(-chunk['ux'], -1.0, 1.0)))
+
+
+def get_surface_x(rustbca_simdir):
+    """
+    Depth is measured from the surface the incident particles strike, which
+    depends on the geometry mode the simulation was built for.
+    """
+    input_files = glob.glob(os.path.join(rustbca_simdir, '*input.toml'))
+    geometry_mode = builder.get_geometry_mode(input_files[0]) if input_files else '2D'
+    return builder.get_surface_x(geometry_mode)
+
+
+def get_incident_species(rustbca_simdir):
+    """
+    The incident species of a simulation: the one in its directory name
+    (<SimID><ion name>, that of the parent for batch_* directories), or
+    those listed in strata.csv for combined simulations.
+
+    :returns: dictionary of ion name -> array of the species' tags (see
+        build_rustbca_input_files.STRATUM_Z_SPACING), None when every tag is
+        that species'. Empty if the species isn't known.
+    """
+    if get_combined_species(rustbca_simdir) is not None:
+        strata = pd.read_csv(os.path.join(rustbca_simdir, 'strata.csv'), usecols = ['tag', 'ion'])
+        return {ion_name: ion_strata['tag'].to_numpy() for ion_name, ion_strata in strata.groupby('ion')}
+
+    name = os.path.basename(os.path.normpath(rustbca_simdir))
+    if name.startswith('batch_'):
+        name = os.path.basename(os.path.dirname(os.path.normpath(rustbca_simdir)))
+    ion_name = name.split('from_sp')[-1]
+    return {ion_name: None} if ion_name in builder.incident_ions else {}
+
+
+def get_species_rows(chunk, ion_tags):
+    """
+    :returns: which rows of a chunk come from a species' incident particles,
+        by their tags (see get_incident_species)
+    """
+    if ion_tags is None:
+        return np.ones(len(chunk['z']), dtype = bool)
+    tags = np.round(chunk['z'] / builder.STRATUM_Z_SPACING).astype(np.int64)
+    return np.isin(tags, ion_tags)
+
+
+def is_species(chunk, ion_name):
+    """
+    :returns: which rows of a chunk are particles of the species itself, not
+        target recoils
+    """
+    particle = builder.incident_ions[ion_name]
+    return (chunk['Z'] == particle['Z']) & (np.abs(chunk['m'] - particle['mass']) < 0.5)
+
+
+def reduce_simulation(rustbca_simdir, energy_edges, angle_edges, depth_edges):
+    """
+    Stream every list output of one simulation directory once and write its
+    summary.npz.
+    """
+    strata_weights = get_strata_weights(rustbca_simdir)
+    surface_x = get_surface_x(rustbca_simdir)
+    species = get_incident_species(rustbca_simdir)
+    # Combined simulations get per-species summaries on top of the totals
+    labels = [''] + ([f'{ion_name}_' for ion_name in species] if len(species) > 1 else [])
+    summary = {
+        'energy_edges': energy_edges,
+        'angle_edges': angle_edges,
+        'depth_edges': depth_edges,
+    }
+
+    for kind in ('sputtered', 'reflected'):
+        count = dict.fromkeys(labels, 0.0)
+        energy_angle = {label: np.zeros((len(energy_edges) - 1, len(angle_edges) - 1)) for label in labels}
+        filename = rustbca_output.output_filename(rustbca_simdir, kind)
+        for chunk in rustbca_output.iter_output_chunks(filename, kind):
+            weights = get_particle_weights(chunk, strata_weights)
+            angles = emission_angle(chunk)
+            rows = {'': np.ones(len(weights), dtype = bool)}
+            if len(labels) > 1:
+                rows.update({f'{ion_name}_': get_species_rows(chunk, tags) for ion_name, tags in species.items()})
+            for label, label_rows in rows.items():
+                count[label] += np.sum(weights[label_rows])
+                energy_angle[label] += histogram2d(
+                    chunk['E'][label_rows],
+                    angles[label_rows],
+                    energy_edges,
+                    angle_edges,
+                    weights[label_rows],
+                )
+        for label in labels:
+            summary[f'{kind}_{label}count'] = count[label]
+            summary[f'{kind}_{label}energy_angle'] = energy_angle[label]
+
+    count = dict.fromkeys(labels, 0.0)
+    depth = {label: np.zeros(len(depth_edges) - 1) for label in labels}
+    filename = rustbca_output.output_filename(rustbca_simdir, 'deposited')
+    for chunk in rustbca_output.iter_output_chunks(filename, 'deposited'):
+        weights = get_particle_weights(chunk, strata_weights)
+        if not species:
+            rows = {'': np.ones(len(weights), dtype = bool)}
+        else:
+            rows = {
+                f'{ion_name}_': get_species_rows(chunk, tags) & is_species(chunk, ion_name)
+                for ion_name, tags in species.items()
+            }
+            rows[''] = np.logical_or.reduce(list(rows.values()))
+        for label in labels:
+            count[label] += np.sum(weights[rows[label]])
+            depth[label] += histogram1d(chunk['x'][rows[label]] - surface_x, depth_edges, weights[rows[label]])
+    for label in labels:
+        summary[f'deposited_{label}count'] = count[label]
+        summary[f'deposited_{label}depth'] = depth[label]
+
+    np.savez_compressed(os.path.join(rustbca_simdir, SUMMARY_FILENAME), **summary)
+    return rustbca_simdir
+
+
+def needs_reduction(rustbca_simdir):
+    """
+    A summary is stale if any list output is newer than it.
+    """
+    summary_file = os.path.join(rustbca_simdir, SUMMARY_FILENAME)
+    if not os.path.exists(summary_file):
+        return True
+    summary_mtime = os.path.getmtime(summary_file)
+    for kind in rustbca_output.OUTPUT_COLUMNS:
+        filename = rustbca_output.output_filename(rustbca_simdir, kind)
+        for path in (filename, rustbca_output.columnar_dirname(filename)):
+            if os.path.exists(path) and os.path.getmtime(path) > summary_mtime:
+                return True
+    return False
+
+
+def get_simulation_dirs():
+    """
+    Every RustBCA simulation directory, with the batch_* directories of
+    batched simulations (run_rustbca_batches.py) in place of their parent
+    """
+    simdirs = []
+    for simdir in sorted(glob.glob('rustbca_simulations/SBE*/*')):
+        if not os.path.isdir(simdir):
+            continue
+        batchdirs = sorted(glob.glob(os.path.join(simdir, 'batch_*')))
+        simdirs.extend(batchdirs or [simdir])
+    return simdirs
+
+
+def _reduce(args):
+    return reduce_simulation(*args)
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+
+    config = util.load_yaml(common._CONFIG_FILENAME)
+    rustbca_config = config.get('rustbca', {})
+    distribution_bins = dict(builder.DISTRIBUTION_BINS)
+    distribution_bins.update(rustbca_config.get('distributions', {}))
+    energy_edges = get_edges(*distribution_bins['energy'])
+    angle_edges = get_edges(*distribution_bins['angle'])
+    depth_edges = get_edges(*rustbca_config.get('summary_depth_bins', DEPTH_BINS))
+
+    simdirs = [
+        simdir for simdir in get_simulation_dirs()
+        if needs_reduction(simdir)
+    ]
+    print(f'reducing {len(simdirs)} simulations...')
+    jobs = [(simdir, energy_edges, angle_edges, depth_edges) for simdir in simdirs]
+    with ProcessPoolExecutor(max_workers = processes) as pool:
+        for simdir in pool.map(_reduce, jobs):
+            print(f'reduced {simdir}')
+
+
+if __name__ == '__main__':
+    main()
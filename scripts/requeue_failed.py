@@ -0,0 +1,237 @@
+import os
+import re
+import sys
+import json
+import glob
+import yaml
+import util
+import profiling
+import host_capabilities
+import rustbca_tuning
+from common import _MACHINE_ASSIGNMENTS_FILE
+from assign_workloads import MACHINE_BANDWIDTHS
+
+
+"""
+Move the simulations run_job.py gave up on to another host.
+
+Reads the output of the status scripts from STATUS_FILEs (or stdin), e.g.
+
+    cd remote_scripts
+    ./run_cmd_on_all_hosts.sh cd my-hpic-sims\\; ./check_status.sh > status.txt
+    ./run_cmd_on_all_hosts.sh cd my-rustbca-sims\\; \\
+        find . -name simulation-failed -exec dirname {} '\\;' >> status.txt
+    cd ..
+    python scripts/requeue_failed.py remote_scripts/status.txt
+
+and understands two kinds of lines:
+
+    <host>: <SimID>   FAILED (...)    a failed hPIC simulation (check_status.sh)
+    ./SBE_1eV/<RustBCA SimID>         the directory of a failed RustBCA
+                                      simulation
+
+A failed hPIC simulation is moved in machine_assignments.yaml to the host
+with the most bandwidth (host_capabilities.get_hpic_bandwidths) per
+assigned simulation. A failed RustBCA simulation's input in rustbca_simulations/ is
+renamed for, and given the threads (and tuned run parameters, see
+rustbca_tuning.py) of, the host with the most RustBCA throughput
+(host_capabilities.get_rustbca_capacities) per input. Hosts a
+simulation already failed on are never picked again; they are recorded in
+requeue_history.yaml. Simulations that failed on every host are reported
+and left where they are.
+
+Then regenerate and send the scripts (Steps 5-6 of the README) or the
+RustBCA inputs, and start the hosts' scripts again: run_job.py skips
+simulations that are complete or still running.
+
+usage: python scripts/requeue_failed.py [STATUS_FILE...]
+"""
+
+REQUEUE_HISTORY_FILE = 'requeue_history.yaml'
+
+_HPIC_FAILED_LINE = re.compile(r'^\S+:\s+(\S+)\s+FAILED\b')
+_RUSTBCA_DIR_LINE = re.compile(r'^(?:\./)?(SBE_[^/\s]+/[^/\s]+)/?$')
+
+
+def parse_status_lines(lines):
+    """
+    :returns: (failed hPIC SimIDs, failed RustBCA simulation directories
+        relative to rustbca_simulations/), without duplicates, in order
+    """
+    hpic_failed = []
+    rustbca_failed = []
+    for line in lines:
+        line = line.strip()
+        match = _HPIC_FAILED_LINE.match(line)
+        if match and match.group(1) not in hpic_failed:
+            hpic_failed.append(match.group(1))
+            continue
+        match = _RUSTBCA_DIR_LINE.match(line)
+        if match and match.group(1) not in rustbca_failed:
+            rustbca_failed.append(match.group(1))
+    return hpic_failed, rustbca_failed
+
+
+def pick_machine(capacities, loads, excluded):
+    """
+    :param capacities: dictionary of machine -> bandwidth or cores
+    :param loads: dictionary of machine -> number of assigned simulations
+    :returns: the machine outside excluded with the most capacity per
+        assigned simulation, or None
+    """
+    candidates = [m for m in capacities if m not in excluded]
+    if not candidates:
+        return None
+    return max(candidates, key = lambda m: capacities[m] / (1 + loads.get(m, 0)))
+
+
+def requeue_hpic(SimIDs, machine_assignments, history):
+    """
+    Move each SimID to another machine in machine_assignments (in place)
+
+    :returns: dictionary of machine -> SimIDs moved to it
+    """
+    bandwidths = host_capabilities.get_hpic_bandwidths(MACHINE_BANDWIDTHS)
+    requeued = {}
+    for SimID in SimIDs:
+        current = [m for m, assigned in machine_assignments.items() if SimID in assigned]
+        if not current:
+            print(f'{SimID} is not in {_MACHINE_ASSIGNMENTS_FILE}, skipping')
+            continue
+        failed_on = history.setdefault(SimID, [])
+        for machine in current:
+            if machine not in failed_on:
+                failed_on.append(machine)
+
+        loads = {m: len(assigned) for m, assigned in machine_assignments.items()}
+        machine = pick_machine(bandwidths, loads, failed_on)
+        if machine is None:
+            print(f'{SimID} failed on every host ({", ".join(failed_on)}), not requeued')
+            continue
+        for m in current:
+            machine_assignments[m].remove(SimID)
+        machine_assignments.setdefault(machine, []).append(SimID)
+        requeued.setdefault(machine, []).append(SimID)
+        print(f'{SimID}: {", ".join(current)} -> {machine}')
+    return requeued
+
+
+def move_rustbca_input(simdir, machine, nthreads, run_parameters = None):
+    """
+    Rename a RustBCA input for another machine, with that machine's number
+    of threads and run parameters (num_chunks, write_buffer_size), and
+    update its manifest
+    """
+    import build_rustbca_input_files as builder
+
+    manifest_filename = os.path.join(simdir, builder.MANIFEST_FILENAME)
+    with open(manifest_filename, 'r') as f:
+        manifest = json.load(f)
+    old_input = os.path.join(simdir, manifest['input_file'])
+    new_input = os.path.join(simdir, f'{machine}-input.toml')
+
+    with open(old_input, 'r') as f:
+        text = f.read()
+    options = dict(run_parameters or {}, num_threads = nthreads)
+    for key, value in options.items():
+        text = re.sub(rf'(?m)^({key}\s*=\s*)\d+', lambda m: f'{m.group(1)}{value}', text)
+    with open(new_input, 'w') as f:
+        f.write(text)
+    if old_input != new_input:
+        os.remove(old_input)
+
+    manifest['input_file'] = os.path.basename(new_input)
+    manifest['input_sha256'] = builder.get_file_hash(new_input)
+    manifest['machine'] = machine
+    with open(manifest_filename, 'w') as f:
+        json.dump(manifest, f, indent = 4)
+
+
+def requeue_rustbca(simdirs, history):
+    """
+    :param simdirs: directories relative to rustbca_simulations/
+    :returns: dictionary of machine -> directories moved to it
+    """
+    import build_rustbca_input_files as builder
+
+    threads, capacities = host_capabilities.get_rustbca_capacities(builder.machine_core_counts)
+    run_parameters = rustbca_tuning.get_run_parameters()
+    loads = {}
+    for input_filename in glob.glob('rustbca_simulations/SBE*/*/*-input.toml'):
+        machine = os.path.basename(input_filename)[:-len('-input.toml')]
+        loads[machine] = loads.get(machine, 0) + 1
+
+    requeued = {}
+    for simdir in simdirs:
+        inputs = glob.glob(os.path.join('rustbca_simulations', simdir, '*-input.toml'))
+        if not inputs:
+            print(f'no input file in rustbca_simulations/{simdir}, skipping')
+            continue
+        current = os.path.basename(inputs[0])[:-len('-input.toml')]
+        failed_on = history.setdefault(simdir, [])
+        if current not in failed_on:
+            failed_on.append(current)
+
+        machine = pick_machine(capacities, loads, failed_on)
+        if machine is None:
+            print(f'{simdir} failed on every host ({", ".join(failed_on)}), not requeued')
+            continue
+        move_rustbca_input(
+            os.path.join('rustbca_simulations', simdir), machine, threads[machine],
+            run_parameters.get(machine),
+        )
+        loads[current] = loads.get(current, 1) - 1
+        loads[machine] = loads.get(machine, 0) + 1
+        requeued.setdefault(machine, []).append(simdir)
+        print(f'{simdir}: {current} -> {machine}')
+    return requeued
+
+
+@profiling.profiled('requeue_failed')
+def main():
+    with profiling.span('status', 'parse'):
+        lines = []
+        if len(sys.argv) > 1:
+            for filename in sys.argv[1:]:
+                with open(filename, 'r') as f:
+                    lines.extend(f.readlines())
+        else:
+            lines = sys.stdin.readlines()
+        hpic_failed, rustbca_failed = parse_status_lines(lines)
+
+    if not hpic_failed and not rustbca_failed:
+        print('no failed simulations')
+        return
+
+    history = {}
+    if os.path.exists(REQUEUE_HISTORY_FILE):
+        history = util.load_yaml(REQUEUE_HISTORY_FILE) or {}
+
+    if hpic_failed:
+        with profiling.span('hPIC', 'compute'):
+            machine_assignments = util.load_yaml(_MACHINE_ASSIGNMENTS_FILE)
+            requeued = requeue_hpic(hpic_failed, machine_assignments, history)
+        if requeued:
+            with open(_MACHINE_ASSIGNMENTS_FILE, 'w') as f:
+                yaml.dump(machine_assignments, f)
+            print(
+                f'{sum(len(v) for v in requeued.values())} hPIC simulations requeued. Run '
+                + 'configure_simulations.py, send the scripts and start them again on: '
+                + ', '.join(sorted(requeued))
+            )
+
+    if rustbca_failed:
+        with profiling.span('RustBCA', 'compute'):
+            requeued = requeue_rustbca(rustbca_failed, history)
+        if requeued:
+            print(
+                f'{sum(len(v) for v in requeued.values())} RustBCA simulations requeued. Send '
+                + 'the inputs and start launcher.sh again on: ' + ', '.join(sorted(requeued))
+            )
+
+    with open(REQUEUE_HISTORY_FILE, 'w') as f:
+        yaml.dump(history, f)
+
+
+if __name__ == '__main__':
+    main()
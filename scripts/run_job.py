@@ -0,0 +1,345 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import signal
+import socket
+import subprocess
+
+
+"""
+Run one hPIC or RustBCA job, retrying it when it fails.
+
+The job directory holds the job's status files. Each attempt writes
+"simulation-start" and runs COMMAND with its output going to LOG (in the job
+directory). On exit 0, "simulation-complete" is written and the runner exits
+0. Otherwise the failure is classified as one of:
+
+    exit      non-zero exit status
+    signal    killed by a signal
+    oom       killed by SIGKILL (likely the kernel's OOM killer, although
+              a kill -9 looks the same), or the log ends with an out of
+              memory error
+    stalled   neither the log nor any other file in the job directory
+              changed for --stall-timeout seconds (RustBCA prints nothing
+              to a log, but writes its outputs as it goes); the job is
+              killed
+
+and, if the class is one of --retry-on, the job is run again after a backoff
+of --backoff x --backoff-factor^(attempt - 1) seconds. Once --max-attempts
+attempts have failed, "simulation-failed" is written (date, class and number
+of attempts), for check_status / fnsf status to report and requeue_failed.py
+to move the job to another host.
+
+Every attempt is appended to attempts.jsonl in the job directory (host,
+start, duration, exit status, class and the tail of the log).
+
+Jobs are idempotent: a job that is already complete is skipped, and so is
+one that another runner is working on (a lock on .run_job.lock in the job
+directory, which goes away with the process that holds it), so a host's
+scripts can be started again at any time, e.g. after a requeue.
+
+Only the standard library is imported: this runs on the LCPP boxes, next to
+the generated hPIC scripts and launcher.sh.
+
+usage: python3 run_job.py [--dir=DIR] [--log=LOG] [--max-attempts=N]
+           [--backoff=SECONDS] [--backoff-factor=F] [--stall-timeout=SECONDS]
+           [--retry-on=CLASS,...] -- COMMAND...
+"""
+
+FAILURE_CLASSES = ('exit', 'signal', 'oom', 'stalled')
+
+ATTEMPTS_FILENAME = 'attempts.jsonl'
+FAILED_FILENAME = 'simulation-failed'
+_LOCK_FILENAME = '.run_job.lock'
+
+# Exit status when another runner holds the job's lock, so that scripts don't
+# mistake a skipped job for a completed one
+BUSY_EXIT_STATUS = 75
+
+_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S-%Z'
+
+DEFAULTS = {
+    'dir': '.',
+    'log': 'job.log',
+    'max_attempts': 3,
+    'backoff': 60.0,
+    'backoff_factor': 2.0,
+    'stall_timeout': 3600.0,
+    'retry_on': FAILURE_CLASSES,
+}
+
+# Seconds between checks on the job directory, at most, and between SIGTERM and
+# SIGKILL when a stalled job is killed
+_POLL_SECONDS = 30.0
+_KILL_GRACE_SECONDS = 30.0
+
+# Lines of the log kept in attempts.jsonl, and searched for OOM errors
+_LOG_TAIL_LINES = 20
+_OOM_MARKERS = (
+    'out of memory',
+    'memory allocation of',     # Rust's allocation failure
+    'std::bad_alloc',
+    'cannot allocate memory',
+)
+
+
+# retry section of config.yaml -> option
+_CONFIG_OPTIONS = {
+    'max_attempts': 'max_attempts',
+    'backoff_seconds': 'backoff',
+    'backoff_factor': 'backoff_factor',
+    'stall_timeout_seconds': 'stall_timeout',
+    'retry_on': 'retry_on',
+}
+
+
+def format_options(retry_config):
+    """
+    The retry section of config.yaml -> command line options of this script,
+    for the scripts that call it (see configure_simulations.py)
+    """
+    unknown = set(retry_config) - set(_CONFIG_OPTIONS)
+    if unknown:
+        print(f'unknown retry options: {", ".join(sorted(unknown))} ({", ".join(_CONFIG_OPTIONS)})')
+        sys.exit(1)
+    options = []
+    for name, option in _CONFIG_OPTIONS.items():
+        if name not in retry_config:
+            continue
+        value = retry_config[name]
+        if option == 'retry_on':
+            value = ','.join(value)
+        options.append(f'--{option.replace("_", "-")}={value}')
+    return ' '.join(options)
+
+
+def parse_args(argv):
+    """
+    :returns: (options dictionary, command list)
+    """
+    usage = (
+        'usage: python3 run_job.py [--dir=DIR] [--log=LOG] [--max-attempts=N] '
+        + '[--backoff=SECONDS] [--backoff-factor=F] [--stall-timeout=SECONDS] '
+        + '[--retry-on=CLASS,...] -- COMMAND...'
+    )
+    if '--' not in argv or argv.index('--') == len(argv) - 1:
+        print(usage)
+        sys.exit(1)
+    split = argv.index('--')
+    options = dict(DEFAULTS)
+    for arg in argv[:split]:
+        name, _, value = arg.lstrip('-').partition('=')
+        name = name.replace('-', '_')
+        if name not in options or not value:
+            print(usage)
+            sys.exit(1)
+        if name in ('dir', 'log'):
+            options[name] = value
+        elif name == 'retry_on':
+            options[name] = tuple(x for x in value.split(',') if x)
+            unknown = set(options[name]) - set(FAILURE_CLASSES)
+            if unknown:
+                print(f'unknown failure classes {", ".join(sorted(unknown))} ({"|".join(FAILURE_CLASSES)})')
+                sys.exit(1)
+        elif name == 'max_attempts':
+            options[name] = int(value)
+            if options[name] < 1:
+                print('--max-attempts must be at least 1')
+                sys.exit(1)
+        else:
+            options[name] = float(value)
+    return options, argv[split + 1:]
+
+
+def timestamp():
+    return time.strftime(_DATE_FORMAT)
+
+
+def write_timestamp(filename):
+    with open(filename, 'w') as f:
+        f.write(timestamp() + '\n')
+
+
+def is_complete(job_dir):
+    """
+    Same check as hpic_status.get_simulation_status: complete if
+    simulation-complete is newer than simulation-start.
+    """
+    start = os.path.join(job_dir, 'simulation-start')
+    complete = os.path.join(job_dir, 'simulation-complete')
+    if not os.path.exists(complete):
+        return False
+    return not os.path.exists(start) or os.path.getmtime(complete) >= os.path.getmtime(start)
+
+
+def read_log_tail(log_filename, lines = _LOG_TAIL_LINES):
+    if not os.path.exists(log_filename):
+        return []
+    with open(log_filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 8192, 0))
+        return f.read().decode(errors = 'replace').splitlines()[-lines:]
+
+
+def classify_failure(returncode, log_tail, stalled):
+    """
+    SIGKILL is taken to be the OOM killer. The kernel log isn't readable
+    on every host to confirm it, and an operator's kill -9 is counted as
+    'oom' as well. The runner's own SIGKILL only ever follows a stall.
+
+    :param returncode: exit status, negative for a signal (subprocess), None
+        if it couldn't be collected
+    :returns: one of FAILURE_CLASSES
+    """
+    if stalled:
+        return 'stalled'
+    text = '\n'.join(log_tail).lower()
+    if returncode == -signal.SIGKILL or any(marker in text for marker in _OOM_MARKERS):
+        return 'oom'
+    if returncode is not None and returncode < 0:
+        return 'signal'
+    return 'exit'
+
+
+def kill(process):
+    """
+    SIGTERM the job's whole process group (e.g. cargo and RustBCA), then
+    SIGKILL it if it's still there after a grace period.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout = _KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+    except ProcessLookupError:
+        # The group has already exited, but the job still has to be reaped
+        # for its exit status
+        process.wait()
+
+
+def get_progress(job_dir):
+    """
+    :returns: the sizes and modification times of every file under job_dir,
+        which change as long as the job writes anything
+    """
+    progress = {}
+    for dirpath, _, filenames in os.walk(job_dir):
+        for filename in filenames:
+            try:
+                stat = os.stat(os.path.join(dirpath, filename))
+            except FileNotFoundError:
+                continue
+            progress[os.path.join(dirpath, filename)] = (stat.st_size, stat.st_mtime_ns)
+    return progress
+
+
+def run_attempt(command, log_filename, stall_timeout, job_dir = '.'):
+    """
+    Run command once, killing it if neither its log nor any other file in
+    job_dir changes for stall_timeout seconds.
+
+    :returns: (returncode, stalled)
+    """
+    poll = min(_POLL_SECONDS, stall_timeout / 4)
+    with open(log_filename, 'w') as log:
+        process = subprocess.Popen(
+            command, stdout = log, stderr = subprocess.STDOUT, start_new_session = True,
+        )
+        progress = get_progress(job_dir)
+        last_progress = time.monotonic()
+        while True:
+            try:
+                return process.wait(timeout = poll), False
+            except subprocess.TimeoutExpired:
+                pass
+            new_progress = get_progress(job_dir)
+            if new_progress != progress:
+                progress = new_progress
+                last_progress = time.monotonic()
+            elif time.monotonic() - last_progress > stall_timeout:
+                log.write(f'\nrun_job.py: nothing written for {stall_timeout:.0f} s, killing the job\n')
+                log.flush()
+                kill(process)
+                return process.returncode, True
+
+
+def append_attempt(job_dir, record):
+    with open(os.path.join(job_dir, ATTEMPTS_FILENAME), 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def run_job(command, options):
+    """
+    :returns: exit status of the runner: 0 once an attempt succeeds, else
+        that of the last attempt (1 if it was killed or has none)
+    """
+    job_dir = options['dir']
+    log_filename = os.path.join(job_dir, options['log'])
+    hostname = socket.gethostname()
+
+    for attempt in range(1, options['max_attempts'] + 1):
+        write_timestamp(os.path.join(job_dir, 'simulation-start'))
+        start = time.time()
+        returncode, stalled = run_attempt(command, log_filename, options['stall_timeout'], job_dir)
+        record = {
+            'attempt': attempt,
+            'host': hostname,
+            'start': time.strftime(_DATE_FORMAT, time.localtime(start)),
+            'seconds': round(time.time() - start, 1),
+            'returncode': returncode,
+        }
+
+        if returncode == 0 and not stalled:
+            append_attempt(job_dir, {**record, 'class': None})
+            write_timestamp(os.path.join(job_dir, 'simulation-complete'))
+            failed_filename = os.path.join(job_dir, FAILED_FILENAME)
+            if os.path.exists(failed_filename):
+                os.remove(failed_filename)
+            return 0
+
+        log_tail = read_log_tail(log_filename)
+        failure = classify_failure(returncode, log_tail, stalled)
+        append_attempt(job_dir, {**record, 'class': failure, 'log_tail': log_tail})
+        print(f'{hostname}: {os.path.abspath(job_dir)} attempt {attempt} failed ({failure}, exit status {returncode})')
+
+        if failure not in options['retry_on'] or attempt == options['max_attempts']:
+            break
+        time.sleep(options['backoff'] * options['backoff_factor'] ** (attempt - 1))
+
+    with open(os.path.join(job_dir, FAILED_FILENAME), 'w') as f:
+        f.write(f'{timestamp()} {failure} {attempt}\n')
+    return returncode if returncode is not None and returncode > 0 else 1
+
+
+def main():
+    options, command = parse_args(sys.argv[1:])
+    job_dir = options['dir']
+    if not os.path.isdir(job_dir):
+        print(f'{job_dir} is not a directory')
+        sys.exit(1)
+    if is_complete(job_dir):
+        print(f'{job_dir} is already complete, skipping')
+        return
+
+    with open(os.path.join(job_dir, _LOCK_FILENAME), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f'{job_dir} is already being run, skipping')
+            sys.exit(BUSY_EXIT_STATUS)
+        # Another runner may have finished the job between the check above
+        # and taking the lock
+        if is_complete(job_dir):
+            print(f'{job_dir} is already complete, skipping')
+            return
+        sys.exit(run_job(command, options))
+
+
+if __name__ == '__main__':
+    main()
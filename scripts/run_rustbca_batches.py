@@ -0,0 +1,287 @@
+import os
+import sys
+import subprocess
+import numpy as np
+import util
+import common
+import iead
+import build_rustbca_input_files as builder
+from physical_sputtering_amount import get_strata_weights, get_sputtered_weight_sums
+
+
+"""
+This script runs a single RustBCA job, i.e. one (SimID, ion, SBE), as a
+series of smaller RustBCA batches instead of one big simulation.
+
+After each batch the running estimate of the sputtering yield and its
+confidence interval are updated. Batches stop as soon as the relative error
+of the yield drops below a target, or once it is clear that the yield is too
+small to matter. Each batch is an independent estimate of the same yield:
+with uniform allocation, a batch simulates batch_N particles drawn from the
+IEAD (see sample_IEAD), or the whole IEAD multiplied up to batch_N if the IEAD
+holds fewer ions than that. With importance allocation, batch_N is the
+particle budget of every batch.
+
+The per-batch counts are saved to batches.csv in the RustBCA simulation
+directory, which physical_sputtering_amount.py picks up instead of
+sputtered.output.
+
+usage: python scripts/run_rustbca_batches.py <SimID> <ION_NAME> (low|high|<SBE_eV>)
+"""
+
+# Defaults, overridden by rustbca.batches in config.yaml
+_BATCH_N = 2e4                   # simulation particles per batch
+_TARGET_RELATIVE_ERROR = 0.05    # half-width of the CI / yield
+_MIN_BATCHES = 3
+_MAX_BATCHES = 50
+_MIN_YIELD = 1e-5                # yields below this are not worth resolving
+
+# How RustBCA is launched on the LCPP boxes (see remote_scripts/rustbca/launcher.sh).
+# Run from the RustBCA output directory, which contains Cargo.toml.
+_RUSTBCA_COMMAND = ['cargo', 'run', '--release']
+
+# Two-sided 95% confidence interval
+_Z_95 = 1.96
+_BOOTSTRAP_SAMPLES = 2000
+
+# Batches below which the bootstrap understates the interval, and the
+# Student-t quantile (0.975) used instead, by degrees of freedom (batches - 1)
+_MIN_BOOTSTRAP_BATCHES = 10
+_T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262}
+
+
+def relative_error(batch_yields, batch_weight_sums):
+    """
+    Relative half-width of the 95% confidence interval of the yield.
+
+    With a single batch, the sputtered counts are treated as Poisson: the
+    variance of a weighted count sum(w) is sum(w^2). With fewer than
+    _MIN_BOOTSTRAP_BATCHES batches, the interval is the wider of a Student-t
+    interval on the batch yields and the Poisson one of all batches pooled.
+    With more, the batch yields are bootstrapped, which also captures
+    whatever the Poisson assumption misses.
+
+    :param: batch_yields: sputtering yield of each batch
+    :param: batch_weight_sums: for each batch, the sum of the weights of its
+        sputtered particles and the sum of their squares
+    """
+    mean_yield = np.mean(batch_yields)
+    if mean_yield == 0:
+        return np.inf
+
+    weight_sum, squared_weight_sum = np.sum(batch_weight_sums, axis = 0)
+    poisson_error = _Z_95 * np.sqrt(squared_weight_sum) / weight_sum
+    if len(batch_yields) == 1:
+        return poisson_error
+
+    if len(batch_yields) < _MIN_BOOTSTRAP_BATCHES:
+        standard_error = np.std(batch_yields, ddof = 1) / np.sqrt(len(batch_yields))
+        t_error = _T_95[len(batch_yields) - 1] * standard_error / mean_yield
+        return max(t_error, poisson_error)
+
+    rng = np.random.default_rng(0)
+    samples = rng.choice(
+        batch_yields,
+        size = (_BOOTSTRAP_SAMPLES, len(batch_yields)),
+    ).mean(axis = 1)
+    low, high = np.percentile(samples, [2.5, 97.5])
+    return (high - low) / 2 / mean_yield
+
+
+def yield_upper_bound(N_simulated):
+    """
+    95% upper bound of the sputtering yield when NOTHING has been sputtered
+    yet ("rule of three"): fewer than 3 sputtered particles are expected
+    from N_simulated incident particles.
+    """
+    return 3.0 / N_simulated
+
+
+def sample_IEAD(IEAD, N, rng):
+    """
+    Draw N simulation particles from the IEAD, i.e. multinomial counts per
+    bin with probabilities proportional to the IEAD. Every simulation particle
+    then stands for sum(IEAD) / N real incident ions.
+    """
+    p = IEAD.flatten() / np.sum(IEAD)
+    return rng.multinomial(int(N), p).reshape(IEAD.shape)
+
+
+def run_rustbca(input_filename, output_dir, features = ()):
+    """
+    Run RustBCA on an input file. The input file name is relative to
+    output_dir, where RustBCA is run from.
+
+    :param: features: cargo features to build RustBCA with
+    """
+    command = list(_RUSTBCA_COMMAND)
+    if features:
+        command += ['--features', ','.join(features)]
+    command += [
+        builder.get_geometry_mode(input_filename),
+        os.path.relpath(input_filename, output_dir),
+    ]
+    print(' '.join(command))
+    subprocess.run(command, cwd = output_dir, check = True)
+
+
+def run_batches(
+        SimID,
+        ion_name,
+        lithium_surface_binding_energy,
+        batch_config,
+        rustbca_config,
+        output_dir = 'rustbca_simulations',
+        nthreads = None):
+    """
+    Run RustBCA batches for one (SimID, ion, SBE) until the sputtering yield
+    converges. Returns the rows written to batches.csv.
+    """
+    batch_N = batch_config.get('batch_N', _BATCH_N)
+    target = batch_config.get('target_relative_error', _TARGET_RELATIVE_ERROR)
+    min_batches = batch_config.get('min_batches', _MIN_BATCHES)
+    max_batches = batch_config.get('max_batches', _MAX_BATCHES)
+    min_yield = batch_config.get('min_yield', _MIN_YIELD)
+    particle_allocation = rustbca_config.get('particle_allocation', 'uniform')
+    particle_input = builder.get_particle_input_format(rustbca_config)
+    distribution_bins = builder.get_output_format(rustbca_config)
+    features = builder.get_rustbca_features(rustbca_config)
+    geometry = builder.get_geometry(rustbca_config)
+
+    config = util.load_yaml(common._CONFIG_FILENAME)
+    ion_map = common.ion_map(config['ions'])
+    IEADfile = f'hpic_results/{SimID}/{SimID}_IEAD_{ion_map[ion_name]}.dat'
+    IEAD, grid = iead.load_IEAD(IEADfile, config)
+    Nincident = np.sum(IEAD)
+    if Nincident == 0:
+        print(f'Warning Iead file: "{IEADfile}" empty, no Rustbca simulation will be run.')
+        return []
+
+    dataset_for_sim = common.get_dataset_from_SimID(SimID)
+    solps_data = util.load_solps_data(common.DATAFILES[dataset_for_sim])
+    Te = builder.get_Te_for_Lsep(common.get_Lsep_from_SimID(SimID), solps_data)
+
+    SBE_label = builder.get_SBE_label(lithium_surface_binding_energy)
+    simdir = f'{output_dir}/{SBE_label}/{SimID}{ion_name}/'
+    util.mkdir(simdir)
+    nthreads = nthreads or os.cpu_count()
+    rng = np.random.default_rng()
+
+    rows = []
+    batch_yields = []
+    batch_weight_sums = []
+    for batch in range(max_batches):
+        RustBCA_SimID = f'{SBE_label}/{SimID}{ion_name}/batch_{batch:03}/'
+        util.mkdir(f'{output_dir}/{RustBCA_SimID}')
+        input_filename = f'{output_dir}/{RustBCA_SimID}input.toml'
+
+        # A uniform batch of the whole IEAD would be far bigger than batch_N
+        sampled_counts = None
+        if particle_allocation == 'uniform' and Nincident > batch_N:
+            sampled_counts = sample_IEAD(IEAD, batch_N, rng)
+
+        factor = builder.build_simulation_input(
+            IEAD,
+            Te,
+            ion_name,
+            lithium_surface_binding_energy,
+            RustBCA_SimID,
+            output_dir,
+            input_filename,
+            nthreads,
+            particle_allocation = particle_allocation,
+            N_total = batch_N,
+            particle_input = particle_input,
+            distribution_bins = distribution_bins,
+            geometry = geometry,
+            IEAD_filename = IEADfile,
+            grid = grid,
+            sampled_counts = sampled_counts,
+        )
+        run_rustbca(input_filename, output_dir, features)
+
+        batchdir = f'{output_dir}/{RustBCA_SimID}'
+        strata_weights = get_strata_weights(batchdir)
+        Nsput, weight_sum, squared_weight_sum = get_sputtered_weight_sums(
+            batchdir + 'sputtered.output',
+            strata_weights,
+        )
+        if strata_weights is None:
+            weight_sum /= factor
+            squared_weight_sum /= factor**2
+
+        Nsput_real = weight_sum
+        batch_yields.append(Nsput_real / Nincident)
+        batch_weight_sums.append((weight_sum, squared_weight_sum))
+
+        rows.append({
+            'batch': batch,
+            'N': int(round(factor * Nincident)),
+            'Nsput': Nsput,
+            'Nsput_real': Nsput_real,
+            'yield': batch_yields[-1],
+        })
+        write_batches_file(simdir + 'batches.csv', rows)
+
+        N_simulated = sum(row['N'] for row in rows)
+        err = relative_error(batch_yields, batch_weight_sums)
+        print(
+            f'{SimID}{ion_name} batch {batch}: '
+            + f'Y = {np.mean(batch_yields):.4e} +/- {100 * err:.1f}%'
+        )
+
+        if batch + 1 < min_batches:
+            continue
+
+        if err <= target:
+            print(f'{SimID}{ion_name}: converged after {batch + 1} batches')
+            break
+
+        # Low-yield cases: stop as soon as the yield is known to be too
+        # small to matter.
+        if sum(row['Nsput'] for row in rows) == 0:
+            upper = yield_upper_bound(N_simulated)
+        else:
+            upper = np.mean(batch_yields) * (1 + err)
+        if upper < min_yield:
+            print(f'{SimID}{ion_name}: yield below {min_yield:.1e}, stopping')
+            break
+
+    return rows
+
+
+def write_batches_file(filename, rows):
+    with open(filename, 'w') as f:
+        f.write('batch,N,Nsput,Nsput_real,yield\n')
+        for row in rows:
+            f.write(
+                f'{row["batch"]},{row["N"]},{row["Nsput"]},'
+                + f'{row["Nsput_real"]:.8e},{row["yield"]:.8e}\n'
+            )
+
+
+def main():
+    usage = 'usage: python run_rustbca_batches.py <SimID> <ION_NAME> (low|high|<SBE_eV>)'
+    if len(sys.argv) < 4:
+        print(usage)
+        sys.exit(1)
+    SimID, ion_name = sys.argv[1], sys.argv[2]
+    lithium_surface_binding_energy = builder.parse_surface_binding_energy(sys.argv[3])
+    if lithium_surface_binding_energy is None:
+        print(usage)
+        sys.exit(1)
+
+    config = util.load_yaml(common._CONFIG_FILENAME)
+    rustbca_config = config.get('rustbca', {})
+    batch_config = rustbca_config.get('batches', {})
+    run_batches(
+        SimID,
+        ion_name,
+        lithium_surface_binding_energy,
+        batch_config,
+        rustbca_config,
+    )
+
+
+if __name__ == '__main__':
+    main()
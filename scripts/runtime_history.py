@@ -0,0 +1,359 @@
+import os
+import sys
+import csv
+import glob
+import json
+from datetime import datetime
+import yaml
+import util
+import common
+import profiling
+import benchmark_host
+
+
+"""
+Collect how long every hPIC and RustBCA job actually took, and learn from it
+how fast each host gets through work, for the next campaign's assignments.
+
+    ingest [CAMPAIGN]   append the wall times of this campaign's completed
+                        jobs to HISTORY_FILE (CAMPAIGN defaults to the name
+                        of the current directory). Jobs already in the
+                        history are skipped, so ingesting again is safe.
+    fit                 fit a model per host and stage from the whole
+                        history, and write MODEL_FILE
+    show                print the fitted models
+
+A job's wall time comes from its successful attempt in attempts.jsonl
+(run_job.py), or else its simulation-start/-complete timestamps. Its host
+is the one in attempts.jsonl, or else machine_assignments.yaml (hPIC) or
+its manifest.json (RustBCA). Its work is its number of particle pushes
+(total_pushes.csv, else configure_simulations' estimate) for hPIC, and its
+number of simulation particles (manifest.json) for RustBCA.
+
+The concurrency of a job is the number of jobs of the same stage running on
+its host at its midpoint. Per host and stage, the wall time is fitted as
+
+    log(seconds) = k0 + k1 log(work) + k2 log(concurrency)
+
+(k1 = 1 and k2 = 0 when there are too few distinct jobs to fit them), and
+the host's throughput is predicted at its median concurrency and job size,
+as work per second. host_capabilities.py shares out the next campaign's
+work by these throughputs, ahead of the calibration benchmark and the
+hand-set values.
+
+HISTORY_FILE is meant to outlive campaigns: keep it (or copy it) where the
+next campaign runs.
+
+usage: python scripts/runtime_history.py (ingest [CAMPAIGN]|fit|show)
+"""
+
+HISTORY_FILE = 'runtime_history.csv'
+MODEL_FILE = 'runtime_model.yaml'
+
+STAGES = ('hpic', 'rustbca')
+
+_COLUMNS = ['campaign', 'stage', 'job_id', 'machine', 'start', 'seconds', 'work']
+
+# Kept in sync with run_job._DATE_FORMAT
+_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S-%Z'
+
+
+def parse_timestamp(value):
+    return datetime.strptime(value.strip(), _DATE_FORMAT).timestamp()
+
+
+def read_wall_time(job_dir):
+    """
+    :returns: (hostname or None, start as seconds since the epoch, wall
+        seconds) of the job's successful run, or None if it didn't complete
+    """
+    attempts_filename = os.path.join(job_dir, 'attempts.jsonl')
+    if os.path.exists(attempts_filename):
+        with open(attempts_filename, 'r') as f:
+            attempts = [json.loads(line) for line in f if line.strip()]
+        succeeded = [attempt for attempt in attempts if attempt['class'] is None]
+        if succeeded:
+            attempt = succeeded[-1]
+            return attempt['host'], parse_timestamp(attempt['start']), attempt['seconds']
+
+    start_filename = os.path.join(job_dir, 'simulation-start')
+    complete_filename = os.path.join(job_dir, 'simulation-complete')
+    if not (os.path.exists(start_filename) and os.path.exists(complete_filename)):
+        return None
+    with open(start_filename, 'r') as f:
+        start = parse_timestamp(f.read())
+    with open(complete_filename, 'r') as f:
+        end = parse_timestamp(f.read())
+    if end < start:
+        return None
+    return None, start, end - start
+
+
+def read_hpic_pushes(config):
+    """
+    :returns: dictionary of SimID -> particle pushes, from total_pushes.csv,
+        or else estimated like plan_sweep.py does
+    """
+    if os.path.exists('total_pushes.csv'):
+        pushes = {}
+        with open('total_pushes.csv', 'r') as f:
+            for line in f:
+                if line.strip():
+                    SimID, total_pushes = line.strip().split(',')
+                    pushes[SimID] = float(total_pushes)
+        return pushes
+
+    import plan_sweep
+    import configure_simulations as configure
+    _, hpic_sets = plan_sweep.expand_hpic_parameters({}, config)
+    parameters = next(iter(hpic_sets.values()))
+    pushes = {}
+    for data_set_label, datafile in common.DATAFILES.items():
+        df = util.load_solps_data(datafile)
+        for _, row in df.iterrows():
+            SimID = configure.get_simulation_id(data_set_label, row)
+            pushes[SimID] = plan_sweep.estimate_hpic_pushes(row, parameters)
+    return pushes
+
+
+def get_machine(hostname, default, machine_names):
+    if hostname is None:
+        return default
+    return benchmark_host.match_machine_name(hostname, machine_names) or default or hostname
+
+
+def collect_hpic_jobs(config, machine_names):
+    assignments = {}
+    if os.path.exists(common._MACHINE_ASSIGNMENTS_FILE):
+        for machine, SimIDs in (util.load_yaml(common._MACHINE_ASSIGNMENTS_FILE) or {}).items():
+            for SimID in SimIDs:
+                assignments[SimID] = machine
+
+    pushes = None
+    jobs = []
+    for job_dir in sorted(glob.glob('hpic_results/*/')):
+        SimID = os.path.basename(os.path.dirname(job_dir))
+        wall_time = read_wall_time(job_dir)
+        if wall_time is None:
+            continue
+        if pushes is None:
+            pushes = read_hpic_pushes(config)
+        if SimID not in pushes:
+            print(f'no particle push count for {SimID}, skipping')
+            continue
+        hostname, start, seconds = wall_time
+        jobs.append({
+            'stage': 'hpic',
+            'job_id': SimID,
+            'machine': get_machine(hostname, assignments.get(SimID), machine_names),
+            'start': start,
+            'seconds': seconds,
+            'work': pushes[SimID],
+        })
+    return jobs
+
+
+def collect_rustbca_jobs(machine_names):
+    import build_rustbca_input_files as builder
+
+    jobs = []
+    for manifest_filename in sorted(glob.glob(f'rustbca_simulations/SBE*/*/{builder.MANIFEST_FILENAME}')):
+        job_dir = os.path.dirname(manifest_filename)
+        wall_time = read_wall_time(job_dir)
+        if wall_time is None:
+            continue
+        with open(manifest_filename, 'r') as f:
+            manifest = json.load(f)
+        hostname, start, seconds = wall_time
+        jobs.append({
+            'stage': 'rustbca',
+            'job_id': os.path.relpath(job_dir, 'rustbca_simulations'),
+            'machine': get_machine(hostname, manifest.get('machine'), machine_names),
+            'start': start,
+            'seconds': seconds,
+            'work': manifest['N'],
+        })
+    return jobs
+
+
+def load_history(filename = HISTORY_FILE):
+    if not os.path.exists(filename):
+        return []
+    with open(filename, 'r', newline = '') as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        for column in ('start', 'seconds', 'work'):
+            row[column] = float(row[column])
+    return rows
+
+
+def ingest(campaign):
+    from assign_workloads import MACHINE_BANDWIDTHS
+    from build_rustbca_input_files import machine_core_counts
+
+    config = util.load_yaml(common._CONFIG_FILENAME)
+    machine_names = set(MACHINE_BANDWIDTHS) | set(machine_core_counts)
+    with profiling.span('jobs', 'parse'):
+        jobs = collect_hpic_jobs(config, machine_names) + collect_rustbca_jobs(machine_names)
+
+    history = load_history()
+    seen = set((row['stage'], row['job_id'], row['machine'], round(row['start'])) for row in history)
+    new = [
+        job for job in jobs
+        if (job['stage'], job['job_id'], job['machine'], round(job['start'])) not in seen
+    ]
+    write_header = not os.path.exists(HISTORY_FILE)
+    with open(HISTORY_FILE, 'a', newline = '') as f:
+        writer = csv.DictWriter(f, fieldnames = _COLUMNS)
+        if write_header:
+            writer.writeheader()
+        for job in new:
+            writer.writerow({'campaign': campaign, **job})
+    print(f'{len(new)} new jobs ({len(jobs) - len(new)} already in the history) added to {HISTORY_FILE}')
+
+
+def get_concurrency(rows):
+    """
+    :param rows: jobs of one stage on one host
+    :returns: list of the number of those jobs running at each one's midpoint
+    """
+    intervals = [(row['start'], row['start'] + row['seconds']) for row in rows]
+    concurrency = []
+    for start, end in intervals:
+        midpoint = (start + end) / 2
+        concurrency.append(sum(s <= midpoint <= e for s, e in intervals))
+    return concurrency
+
+
+def fit_wall_time(work, concurrency, seconds):
+    """
+    Least squares fit of log(seconds) = k0 + k1 log(work) + k2 log(concurrency).
+    Terms whose feature doesn't vary are fixed (k1 = 1, k2 = 0).
+
+    :returns: dictionary of k0, k1, k2 and the RMS error of log(seconds)
+    """
+    import numpy as np
+
+    log_work = np.log(work)
+    log_concurrency = np.log(concurrency)
+    log_seconds = np.log(seconds)
+
+    fit_work = len(set(np.round(log_work, 6))) >= 3
+    fit_concurrency = len(set(concurrency)) >= 2
+    target = log_seconds - (0 if fit_work else log_work)
+    columns = [np.ones_like(log_work)]
+    if fit_work:
+        columns.append(log_work)
+    if fit_concurrency:
+        columns.append(log_concurrency)
+    coefficients = np.linalg.lstsq(np.column_stack(columns), target, rcond = None)[0]
+
+    coefficients = list(coefficients)
+    k0 = coefficients.pop(0)
+    k1 = coefficients.pop(0) if fit_work else 1.0
+    k2 = coefficients.pop(0) if fit_concurrency else 0.0
+    residuals = log_seconds - (k0 + k1 * log_work + k2 * log_concurrency)
+    return {
+        'k0': float(k0),
+        'k1': float(k1),
+        'k2': float(k2),
+        'rms_log_error': float(np.sqrt(np.mean(residuals ** 2))),
+    }
+
+
+def predict_seconds(model, work, concurrency):
+    import math
+    return math.exp(model['k0'] + model['k1'] * math.log(work) + model['k2'] * math.log(concurrency))
+
+
+def fit():
+    import numpy as np
+
+    history = load_history()
+    if not history:
+        print(f'no {HISTORY_FILE}, run "runtime_history.py ingest" first')
+        sys.exit(1)
+
+    groups = {}
+    for row in history:
+        if row['seconds'] > 0 and row['work'] > 0:
+            groups.setdefault((row['machine'], row['stage']), []).append(row)
+
+    models = {}
+    for (machine, stage), rows in sorted(groups.items()):
+        concurrency = get_concurrency(rows)
+        model = fit_wall_time(
+            [row['work'] for row in rows], concurrency, [row['seconds'] for row in rows],
+        )
+        typical_concurrency = float(np.median(concurrency))
+        typical_work = float(np.median([row['work'] for row in rows]))
+        seconds = predict_seconds(model, typical_work, typical_concurrency)
+        model.update({
+            'jobs': len(rows),
+            'campaigns': len(set(row['campaign'] for row in rows)),
+            'concurrency': typical_concurrency,
+            'work': typical_work,
+            'work_per_second': typical_concurrency * typical_work / seconds,
+        })
+        models.setdefault(machine, {})[stage] = model
+
+    with open(MODEL_FILE, 'w') as f:
+        yaml.dump(models, f, sort_keys = True)
+    print(f'fitted {sum(len(m) for m in models.values())} models from {len(history)} jobs, written to {MODEL_FILE}')
+    show(models)
+
+
+def load_learned_throughputs(stage, filename = MODEL_FILE):
+    """
+    :returns: dictionary of machine -> predicted work per second for stage
+        ('hpic' or 'rustbca'), empty if nothing was fitted
+    """
+    if not os.path.exists(filename):
+        return {}
+    models = util.load_yaml(filename) or {}
+    return {
+        machine: stages[stage]['work_per_second']
+        for machine, stages in models.items() if stage in stages
+    }
+
+
+def show(models = None):
+    if models is None:
+        if not os.path.exists(MODEL_FILE):
+            print(f'no {MODEL_FILE}, run "runtime_history.py fit" first')
+            sys.exit(1)
+        models = util.load_yaml(MODEL_FILE) or {}
+
+    print(f'\n{"machine":<12} {"stage":<8} {"jobs":>6} {"k1 (work)":>10} {"k2 (conc.)":>10} '
+        + f'{"rms err":>8} {"concurrency":>11} {"work/s":>12}')
+    for machine, stages in sorted(models.items()):
+        for stage, model in sorted(stages.items()):
+            print(
+                f'{machine:<12} {stage:<8} {model["jobs"]:>6} {model["k1"]:>10.2f} {model["k2"]:>10.2f} '
+                + f'{model["rms_log_error"]:>8.2f} {model["concurrency"]:>11.1f} {model["work_per_second"]:>12.4g}'
+            )
+
+
+@profiling.profiled('runtime_history')
+def main():
+    usage = 'usage: python scripts/runtime_history.py (ingest [CAMPAIGN]|fit|show)'
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == 'ingest':
+        campaign = sys.argv[2] if len(sys.argv) > 2 else os.path.basename(os.getcwd())
+        ingest(campaign)
+    elif command == 'fit':
+        with profiling.span('models', 'compute'):
+            fit()
+    elif command == 'show':
+        show()
+    else:
+        print(usage)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+"""
+Helpers for reading RustBCA's per-particle list outputs without loading a
+whole (possibly multi-GB) file into memory at once.
+
+Outputs may have been converted to binary columnar files by
+finalize_rustbca_outputs.py, in which case they are memory-mapped instead of
+parsed.
+"""
+
+# Columns of RustBCA's list outputs, in order. Only the leading columns we
+# use are named; any trailing columns are ignored.
+OUTPUT_COLUMNS = {
+    'sputtered': ['m', 'Z', 'E', 'x', 'y', 'z', 'ux', 'uy', 'uz'],
+    'reflected': ['m', 'Z', 'E', 'x', 'y', 'z', 'ux', 'uy', 'uz'],
+    'deposited': ['m', 'Z', 'x', 'y', 'z'],
+}
+
+# Rows per chunk when streaming a list output
+CHUNK_ROWS = 1000000
+
+
+def output_filename(rustbca_simdir, kind):
+    """
+    e.g. output_filename('rustbca_simulations/SBE_1eV/<SimID>nD+1', 'sputtered')
+    """
+    return os.path.join(rustbca_simdir, f'{kind}.output')
+
+
+def columnar_dirname(filename):
+    """
+    Directory holding the binary columnar version of a list output, one
+    <column>.npy per column: sputtered.output -> sputtered.columns
+    """
+    return os.path.splitext(filename)[0] + '.columns'
+
+
+def load_columns(filename, kind):
+    """
+    Memory-map the binary columnar version of a list output.
+
+    :returns: dictionary of column name -> np.memmap, or None if the output
+        has not been converted.
+    """
+    dirname = columnar_dirname(filename)
+    if not os.path.isdir(dirname):
+        return None
+    return {
+        column: np.load(os.path.join(dirname, f'{column}.npy'), mmap_mode = 'r')
+        for column in OUTPUT_COLUMNS[kind]
+    }
+
+
+def iter_output_chunks(filename, kind, chunk_rows = CHUNK_ROWS):
+    """
+    Yield a RustBCA list output in chunks, as dictionaries of column name ->
+    np.array (see OUTPUT_COLUMNS). Missing or empty files yield nothing.
+    """
+    columns = load_columns(filename, kind)
+    if columns is not None:
+        nrows = len(next(iter(columns.values())))
+        for start in range(0, nrows, chunk_rows):
+            yield {
+                column: np.asarray(values[start:start + chunk_rows], dtype = np.float64)
+                for column, values in columns.items()
+            }
+        return
+
+    if not os.path.exists(filename) or not os.path.getsize(filename):
+        return
+
+    columns = OUTPUT_COLUMNS[kind]
+    reader = pd.read_csv(
+        filename,
+        header = None,
+        usecols = range(len(columns)),
+        names = columns,
+        dtype = np.float64,
+        chunksize = chunk_rows,
+    )
+    for chunk in reader:
+        yield {column: chunk[column].to_numpy() for column in columns}
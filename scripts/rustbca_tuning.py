@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import glob
+import shutil
+import yaml
+import util
+import common
+import profiling
+import benchmark_host
+import tune_rustbca
+
+
+"""
+Tuned RustBCA run parameters of the LCPP boxes: threads per simulation,
+simulations at once, num_chunks and write_buffer_size. They replace the
+one-size-fits-all values (every core for one simulation, 100 chunks, a
+buffer of 8000) once they exist.
+
+    prepare     write remote_scripts/generated/tuning/: a representative
+                RustBCA input (a real IEAD from hpic_results/, else the He
+                calibration input, with rustbca.tuning.N particles), the grid
+                to search (rustbca.tuning in config.yaml) and tune_rustbca.py
+    collect     read the TUNING lines printed by tune_rustbca.py from FILEs
+                (or stdin) into TUNING_FILE
+    show        print the tuned parameters and throughputs
+
+On every host, from the RustBCA run directory (see tune_rustbca.py):
+
+    cd remote_scripts
+    for host in $(grep -Ev '^$|#.*' lcpp_hosts.txt); do
+        scp -r generated/tuning $host:my-rustbca-sims/
+    done
+    ./run_cmd_on_all_hosts.sh cd my-rustbca-sims\\; python3 tuning/tune_rustbca.py \\
+        | python ../scripts/rustbca_tuning.py collect
+
+build_rustbca_input_files.py then writes each machine's num_threads,
+num_chunks and write_buffer_size into its inputs, and shares out the
+simulations by the tuned throughputs (see host_capabilities.py). The
+concurrency is left on each host in tune_rustbca.JOBS_FILENAME, where
+launcher.sh picks it up; show lists it too, for JOBS=N ./launcher.sh.
+
+usage: python scripts/rustbca_tuning.py (prepare|collect [FILE...]|show)
+"""
+
+TUNING_FILE = 'rustbca_tuning.yaml'
+
+_TUNING_DIR = 'remote_scripts/generated/tuning'
+
+# Defaults of rustbca.tuning in config.yaml. Thread counts (and numbers of
+# simulations at once) default to 1, 2, 4, ... up to the host's CPUs.
+_DEFAULT_TUNING = {
+    'N': 20000,
+    'threads': None,
+    'chunks': [10, 50, 100, 200, 500],
+    'buffer_sizes': [1000, 8000, 32000],
+}
+
+
+def load_tuning(filename = TUNING_FILE):
+    """
+    :returns: dictionary of machine -> tuned parameters, empty if there's no
+        tuning file
+    """
+    if not os.path.exists(filename):
+        return {}
+    return util.load_yaml(filename) or {}
+
+
+def get_run_parameters(tuning = None):
+    """
+    :returns: dictionary of machine -> {'num_chunks', 'write_buffer_size'},
+        for build_rustbca_input_files.build_simulation_input, for the tuned
+        machines
+    """
+    if tuning is None:
+        tuning = load_tuning()
+    return {
+        m: {'num_chunks': t['num_chunks'], 'write_buffer_size': t['write_buffer_size']}
+        for m, t in tuning.items()
+    }
+
+
+def get_tuning_config(config):
+    tuning_config = dict(_DEFAULT_TUNING)
+    tuning_config.update(config.get('rustbca', {}).get('tuning') or {})
+    unknown = set(tuning_config) - set(_DEFAULT_TUNING)
+    if unknown:
+        print(f'unknown rustbca.tuning options: {", ".join(sorted(unknown))} ({", ".join(_DEFAULT_TUNING)})')
+        sys.exit(1)
+    return tuning_config
+
+
+def find_representative_IEAD(config):
+    """
+    The first non-empty IEAD of the hPIC simulation with the median Te
+
+    :returns: (IEAD, Te, ion name, grid, IEAD filename), or None if there
+        are no hPIC results yet
+    """
+    import iead
+    import build_rustbca_input_files as builder
+
+    ion_names = common.invert_ion_map(config['ions'])
+    solps_data = {label: util.load_solps_data(datafile) for label, datafile in common.DATAFILES.items()}
+    simulations = []
+    for simdir in glob.glob('hpic_results/*'):
+        if not os.path.isdir(simdir):
+            continue
+        Te = builder.get_Te_for_Lsep(
+            common.get_Lsep_from_SimID(simdir),
+            solps_data[common.get_dataset_from_SimID(simdir)],
+        )
+        simulations.append((Te, simdir))
+    simulations.sort()
+
+    for Te, simdir in simulations[len(simulations) // 2:] + simulations[:len(simulations) // 2]:
+        for IEADfile in sorted(glob.glob(simdir + '/*_IEAD_*.dat')):
+            ion_name = ion_names.get(IEADfile.rsplit('_', 1)[1][:-len('.dat')])
+            if ion_name not in builder.incident_ions:
+                continue
+            IEAD, grid = iead.load_IEAD(IEADfile, config)
+            if IEAD.sum() > 0:
+                return IEAD, Te, ion_name, grid, IEADfile
+    return None
+
+
+def prepare():
+    import build_rustbca_input_files as builder
+
+    config = util.load_yaml(common._CONFIG_FILENAME)
+    tuning_config = get_tuning_config(config)
+    geometry = builder.get_geometry(config.get('rustbca', {}))
+
+    util.mkdir('remote_scripts/generated')
+    util.mkdir(_TUNING_DIR)
+    input_filename = os.path.join(_TUNING_DIR, 'rustbca_input.toml')
+    representative = find_representative_IEAD(config)
+    if representative is None:
+        N = tuning_config['N']
+        builder.build_host_benchmark_input(input_filename, N, geometry)
+        source = 'no hPIC results yet, He calibration input'
+    else:
+        IEAD, Te, ion_name, grid, IEADfile = representative
+        N = builder.build_tuning_input(input_filename, IEAD, Te, ion_name, tuning_config['N'], grid, geometry)
+        source = IEADfile
+
+    tuning = {
+        'machines': list(builder.machine_core_counts),
+        'rustbca': {'command': 'cargo run --release', 'mode': geometry['mode'], 'N': N},
+        'threads': tuning_config['threads'],
+        'chunks': tuning_config['chunks'],
+        'buffer_sizes': tuning_config['buffer_sizes'],
+    }
+    with open(os.path.join(_TUNING_DIR, 'tuning.json'), 'w') as f:
+        json.dump(tuning, f, indent = 4)
+    shutil.copy(tune_rustbca.__file__, _TUNING_DIR)
+    shutil.copy(benchmark_host.__file__, _TUNING_DIR)
+    print(f'wrote {_TUNING_DIR} ({N} particles, from {source})')
+
+
+def collect(lines):
+    tuning = load_tuning()
+    collected = 0
+    for line in lines:
+        if not line.startswith(tune_rustbca.TUNING_PREFIX):
+            continue
+        result = json.loads(line[len(tune_rustbca.TUNING_PREFIX):])
+        tuning[result.pop('machine')] = result
+        collected += 1
+
+    if not collected:
+        print('no TUNING lines found (see tune_rustbca.py)')
+        sys.exit(1)
+    with open(TUNING_FILE, 'w') as f:
+        yaml.dump(tuning, f, sort_keys = True)
+    print(f'{collected} machines written to {TUNING_FILE}')
+
+
+def show():
+    from build_rustbca_input_files import machine_core_counts, NUM_CHUNKS, WRITE_BUFFER_SIZE
+
+    tuning = load_tuning()
+    if not tuning:
+        print(f'no {TUNING_FILE}, every input gets all of its machine\'s cores')
+    print(f'{"machine":<12} {"tuned":<20} {"threads":>7} {"jobs (JOBS)":>11} {"chunks":>6} '
+        + f'{"buffer":>6} {"particles/s":>11}')
+    for m in sorted(set(machine_core_counts) | set(tuning)):
+        t = tuning.get(m)
+        if t is None:
+            print(f'{m:<12} {"-":<20} {machine_core_counts[m]:>7} {1:>11} {NUM_CHUNKS:>6} {WRITE_BUFFER_SIZE:>6} {"-":>11}')
+            continue
+        print(
+            f'{m:<12} {t["tuned"]:<20} {t["num_threads"]:>7} {t["concurrency"]:>11} {t["num_chunks"]:>6} '
+            + f'{t["write_buffer_size"]:>6} {t["particles_per_second"]:>11.4g}'
+        )
+
+
+@profiling.profiled('rustbca_tuning')
+def main():
+    usage = 'usage: python scripts/rustbca_tuning.py (prepare|collect [FILE...]|show)'
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == 'prepare':
+        with profiling.span('tuning', 'write'):
+            prepare()
+    elif command == 'collect':
+        lines = []
+        if len(sys.argv) > 2:
+            for filename in sys.argv[2:]:
+                with open(filename, 'r') as f:
+                    lines.extend(f.readlines())
+        else:
+            lines = sys.stdin.readlines()
+        with profiling.span('tuning', 'write'):
+            collect(lines)
+    elif command == 'show':
+        show()
+    else:
+        print(usage)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,47 +4,43 @@ The purpose of this is so that I don't have to keep re-typing
 constants for every new simulation I run.
 """
 
-class ScientificConstant:
+class ScientificConstant(float):
     """
-    ScientificConstant overloads operators associated with Python3 numberic
-    types, for example __truediv__ and __floordiv__ instead of __div__
-    (Python2).
+    A float that also carries a name and units.
 
-    Reference: https://docs.python.org/3.3/reference/datamodel.html#emulating-numeric-types
-    """
+    Since it IS a float, arithmetic uses float's own (C-level) operators and
+    returns plain floats, and NumPy treats it like any other Python scalar,
+    so constants can be used directly in vectorized array expressions at
+    full NumPy speed:
 
-    def __init__(self, name, value, units):
-        self.name = name
-        self.value = value
-        self.units = units
+        v = np.sqrt(2 * qe * T / m)    # T, m arrays
 
-    def __mul__(self, other):
-        if isinstance(other, ScientificConstant):
-            return self.value * other.value
-        return self.value * other
+    Reference: https://docs.python.org/3/reference/datamodel.html#object.__new__
+    """
 
-    def __truediv__(self, other):
-        if isinstance(other, ScientificConstant):
-            return self.value / other.value
-        return self.value / other
+    def __new__(cls, name, value, units):
+        constant = super().__new__(cls, value)
+        constant.name = name
+        constant.units = units
+        return constant
+
+    @property
+    def value(self):
+        return float(self)
 
-    def __pow__(self, other):
+    def __pow__(self, other, modulo = None):
         if isinstance(other, ScientificConstant):
             raise TypeError(
                 'why are you raising something to the power of a '
                 + 'scientific constant?',
             )
-        return self.value ** other
+        return super().__pow__(other, modulo)
 
-    def __rmul__(self, other):
-        if isinstance(other, ScientificConstant):
-            return other.value * self.value
-        return other * self.value
-
-    def __rtruediv__(self, other):
-        if isinstance(other, ScientificConstant):
-            return other.value / self.value
-        return other / self.value
+    def __rpow__(self, other):
+        raise TypeError(
+            'why are you raising something to the power of a '
+            + 'scientific constant?',
+        )
 
     def __repr__(self):
         return ('{'
@@ -53,6 +49,11 @@ class ScientificConstant:
             + f'"units": "{self.units}"'
             + '}')
 
+    def __reduce__(self):
+        # float subclasses with extra attributes don't pickle on their own,
+        # and constants get sent to process pool workers
+        return (ScientificConstant, (self.name, self.value, self.units))
+
 
 
 eps0 = ScientificConstant('Vacuum Permittivity', 8.8541878128e-12, 'F/m')
@@ -61,10 +62,11 @@ kB = ScientificConstant('Boltzmann Constant', 1.380649e-23, 'J/K')
 amu2kg = ScientificConstant('A.M.U', 1.66053906660e-27, 'kg')
 
 __all__ = [
-    eps0,
-    qe,
-    kB,
-    amu2kg,
+    'ScientificConstant',
+    'eps0',
+    'qe',
+    'kB',
+    'amu2kg',
 ]
 
 
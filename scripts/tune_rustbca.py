@@ -0,0 +1,183 @@
+import os
+import re
+import sys
+import json
+import time
+import socket
+import shutil
+import itertools
+import benchmark_host
+
+
+"""
+Find the RustBCA run parameters that get the most particles per second
+through this host, for rustbca_tuning.py.
+
+Runs on an LCPP box, from the RustBCA run directory (the one with
+Cargo.toml), out of the tuning directory written by
+"python scripts/rustbca_tuning.py prepare":
+
+    tuning/tune_rustbca.py
+    tuning/benchmark_host.py
+    tuning/tuning.json          the grid and RustBCA input metadata
+    tuning/rustbca_input.toml   a representative RustBCA input (a real IEAD,
+                                fewer particles)
+
+Each trial runs CONCURRENCY copies of the input at once, each with
+num_threads THREADS, num_chunks CHUNKS and write_buffer_size BUFFER, and
+its rate is copies x particles / wall time of the slowest copy. Trials that
+would run more threads than the host has CPUs are skipped. By default the
+search goes one parameter at a time: every (THREADS, CONCURRENCY) pair at
+the default CHUNKS and BUFFER first, then every CHUNKS and then every BUFFER
+at the best pair so far. --full tries every combination instead.
+
+The best trial is written to tuning/<MACHINE>-tuning.json and printed on
+one line starting with TUNING, which "rustbca_tuning.py collect" picks out
+of the output of remote_scripts/run_cmd_on_all_hosts.sh. Its concurrency
+is also written to JOBS_FILENAME in the run directory, where launcher.sh
+reads how many simulations to run at once.
+
+Only the standard library is imported.
+
+usage: python3 tuning/tune_rustbca.py [--name=MACHINE] [--max-cpus=N] [--full]
+"""
+
+TUNING_PREFIX = 'TUNING '
+
+JOBS_FILENAME = 'rustbca-jobs'
+
+_TUNING_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The input's values before any tuning (build_rustbca_input_files)
+DEFAULT_CHUNKS = 100
+DEFAULT_BUFFER = 8000
+
+_TRIAL_KEYS = ('num_threads', 'concurrency', 'num_chunks', 'write_buffer_size')
+
+
+def set_option(text, key, value):
+    """
+    Set an option of a RustBCA input (TOML text)
+    """
+    return re.sub(rf'(?m)^{key}\s*=.*$', lambda m: f'{key} = {value}', text, count = 1)
+
+
+def get_trials(stage, levels, chunks, buffers, max_cpus, best = None):
+    """
+    :param stage: 'pairs', 'chunks', 'buffers' (one parameter at a time) or
+        'full'
+    :param levels: thread counts, which are also the concurrency levels
+    :param best: the best (threads, concurrency, chunks, buffer) so far, for
+        the chunks and buffers stages
+    :returns: list of (threads, concurrency, chunks, buffer) that fit in
+        max_cpus
+    """
+    def fits(trial):
+        return trial[0] * trial[1] <= max_cpus
+
+    if stage == 'full':
+        return [t for t in itertools.product(levels, levels, chunks, buffers) if fits(t)]
+    if stage == 'pairs':
+        return [(t, c, DEFAULT_CHUNKS, DEFAULT_BUFFER) for t, c in itertools.product(levels, levels) if fits((t, c))]
+    threads, concurrency, best_chunks, best_buffer = best
+    if stage == 'chunks':
+        return [(threads, concurrency, n, best_buffer) for n in chunks if n != best_chunks]
+    return [(threads, concurrency, best_chunks, b) for b in buffers if b != best_buffer]
+
+
+def run_trial(template, rustbca_command, mode, N, trial):
+    """
+    :returns: particles per second
+    """
+    threads, concurrency, chunks, buffer_size = trial
+    text = template
+    for key, value in (('num_threads', threads), ('num_chunks', chunks), ('write_buffer_size', buffer_size)):
+        text = set_option(text, key, value)
+
+    label = f'rustbca_t{threads}_n{chunks}_b{buffer_size}'
+    copy_dirs = benchmark_host.make_copy_dirs(label, concurrency)
+    commands = []
+    for copy_dir in copy_dirs:
+        input_filename = os.path.join(copy_dir, 'input.toml')
+        with open(input_filename, 'w') as f:
+            f.write(set_option(text, 'name', f'"{os.path.relpath(copy_dir)}/"'))
+        commands.append(f'cd {os.getcwd()} && {rustbca_command} {mode} {os.path.relpath(input_filename)}')
+    wall = benchmark_host.run_copies(commands, copy_dirs)
+    rate = concurrency * N / wall
+    print(f'threads {threads:>3} x{concurrency:<3} chunks {chunks:>5} buffer {buffer_size:>6}: {wall:.1f} s, {rate:.4g} particles/s')
+    return rate
+
+
+def tune(tuning, max_cpus, full):
+    """
+    :returns: list of trial records, and the best of them
+    """
+    with open(os.path.join(_TUNING_DIR, 'rustbca_input.toml'), 'r') as f:
+        template = f.read()
+    rustbca = tuning['rustbca']
+    levels = tuning.get('threads') or benchmark_host.get_concurrency_levels(max_cpus)
+
+    print('RustBCA warm-up run (builds RustBCA if needed)...')
+    run_trial(template, rustbca['command'], rustbca['mode'], rustbca['N'], (1, 1, DEFAULT_CHUNKS, DEFAULT_BUFFER))
+
+    records = []
+    best = None
+    for stage in (('full',) if full else ('pairs', 'chunks', 'buffers')):
+        trials = get_trials(
+            stage, levels, tuning['chunks'], tuning['buffer_sizes'], max_cpus,
+            best and tuple(best[k] for k in _TRIAL_KEYS),
+        )
+        for trial in trials:
+            record = dict(zip(_TRIAL_KEYS, trial))
+            record['particles_per_second'] = run_trial(
+                template, rustbca['command'], rustbca['mode'], rustbca['N'], trial,
+            )
+            records.append(record)
+        best = max(records, key = lambda r: r['particles_per_second'])
+    return records, best
+
+
+def main():
+    name = None
+    max_cpus = os.cpu_count() or 1
+    full = False
+    for arg in sys.argv[1:]:
+        option, _, value = arg.partition('=')
+        if option == '--name' and value:
+            name = value
+        elif option == '--max-cpus' and value.isdigit() and int(value) > 0:
+            max_cpus = int(value)
+        elif arg == '--full':
+            full = True
+        else:
+            print('usage: python3 tuning/tune_rustbca.py [--name=MACHINE] [--max-cpus=N] [--full]')
+            sys.exit(1)
+
+    with open(os.path.join(_TUNING_DIR, 'tuning.json'), 'r') as f:
+        tuning = json.load(f)
+    hostname = socket.gethostname()
+    name = name or benchmark_host.match_machine_name(hostname, tuning['machines'])
+    if name is None:
+        print(f'{hostname} is none of {", ".join(tuning["machines"])}, pass --name=MACHINE')
+        sys.exit(1)
+
+    records, best = tune(tuning, max_cpus, full)
+    shutil.rmtree(benchmark_host._RUNS_DIR, ignore_errors = True)
+
+    result = {
+        'machine': name,
+        'hostname': hostname,
+        'cpu_count': os.cpu_count(),
+        'tuned': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        **best,
+        'trials': records,
+    }
+    with open(os.path.join(_TUNING_DIR, f'{name}-tuning.json'), 'w') as f:
+        json.dump(result, f, indent = 4)
+    with open(JOBS_FILENAME, 'w') as f:
+        f.write(f'{best["concurrency"]}\n')
+    print(TUNING_PREFIX + json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,3 @@
-import pandas as pd
 import os
 import stat
 import yaml
@@ -22,6 +21,8 @@ def load_yaml(filename):
 
 
 def load_solps_data(filename, columns_subset = None):
+    # pandas is slow to import; only load it for the commands that read SOLPS data
+    import pandas as pd
     df = pd.read_csv(
         filename,
         delimiter = ',',
@@ -1,74 +1,122 @@
+import os
+import sys
 import glob
+import json
 import numpy as np
-import util
-import common
-import re
 import toml
+import build_rustbca_input_files as builder
+from concurrent.futures import ProcessPoolExecutor
 
 """
-This is a sanity check script. Each RustBCA simulation is created from an IEAD data file.
-Sometimes we multiply each number in that file in order to get to a minimum threshold
-to be considered a "high resolution" simulation. This script verifies that the total
-number of particles in a RustBCA input file equals the total number in the associated
-IEAD file times the corresponding conversion factor found in conversion_factors.csv.
+This is a sanity check script. Each RustBCA simulation is created from an IEAD data file,
+and every input file has a manifest.json next to it (see
+build_rustbca_input_files.write_manifest), which records the IEAD total, the
+conversion factor, the number of simulation particles and hashes of the input
+and its particles.h5. This script verifies, for every input, that
+
+    - the IEAD files still add up to the manifest's IEAD total, and
+    - the input is the one the manifest was written for. If its hashes still
+      match, the manifest's number of particles is trusted. Otherwise the
+      particles in the input (or its particles.h5) are counted, and the input
+      fails whether or not the count matches, since it changed after it was
+      built (truncated or edited by hand).
+
+Only inputs whose hashes changed are parsed, so verifying unchanged inputs
+takes seconds.
+
+usage: python scripts/verify_total_counts.py [NUM_PROCESSES]
 """
 
-def get_conversion_factors():
-    factors = {}
-    with open(common._PARTICLE_CONVERSION_FACTORS_FILE, 'r') as f:
-        for line in f.readlines():
-            rustbca_simdir, factor = line.strip().split(',')
-            factors[rustbca_simdir] = float(factor)
-    return factors
-
-
-def get_rustbca_simulation_counts():
-    counts = {}
-    for rustbca_simdir in glob.glob('rustbca_simulations/*'):
-        rustbca_input_file = rustbca_simdir + '/input.toml'
-        print(f'reading {rustbca_input_file}...')
-        with open(rustbca_input_file, 'r') as f:
-            rustbca_config = toml.load(f)
-        counts[rustbca_simdir + '/'] = sum(rustbca_config['particle_parameters']['N'])
-    return counts
-
-
-def verify_particle_counts():
-    IEAD_counts = get_IEAD_counts()
-    conversion_factors = get_conversion_factors()
-    rustbca_counts = get_rustbca_simulation_counts()
-
-    for rustbca_simdir, rustbca_count in rustbca_counts.items():
-        IEAD_count = IEAD_counts[rustbca_simdir]
-        conversion_factor = conversion_factors[rustbca_simdir]
-        assert rustbca_count == IEAD_count * conversion_factor
+# Relative tolerance of the IEAD totals
+_RTOL = 1e-6
+
+
+def count_input_particles(input_filename):
+    """
+    Total number of simulation particles in a RustBCA input file, read from
+    particles.h5 for HDF5-input simulations.
+    """
+    with open(input_filename, 'r') as f:
+        rustbca_config = toml.load(f)
+    particle_parameters = rustbca_config['particle_parameters']
+    if particle_parameters.get('particle_input_filename'):
+        import h5py
+        particle_filename = os.path.join(os.path.dirname(input_filename), 'particles.h5')
+        with h5py.File(particle_filename, 'r') as f:
+            return f['particles'].shape[0]
+    return sum(particle_parameters['N'])
+
+
+def verify_manifest(manifest_filename):
+    """
+    :returns: (manifest_filename, list of problems). No problems means the
+        input checks out.
+    """
+    with open(manifest_filename, 'r') as f:
+        manifest = json.load(f)
+    dirname = os.path.dirname(manifest_filename)
+    input_filename = os.path.join(dirname, manifest['input_file'])
+    particle_filename = os.path.join(dirname, 'particles.h5')
+    problems = []
+
+    # Inputs holding several species (rustbca.combine_species) list the IEAD
+    # file of every species
+    IEAD_filenames = manifest.get('IEAD_file')
+    if isinstance(IEAD_filenames, str):
+        IEAD_filenames = [IEAD_filenames]
+    if IEAD_filenames:
+        missing = [f for f in IEAD_filenames if not os.path.exists(f)]
+        for IEAD_filename in missing:
+            problems.append(f'{IEAD_filename} is missing')
+        if not missing:
+            IEAD_total = sum(np.sum(np.loadtxt(f)) for f in IEAD_filenames)
+            if not np.isclose(IEAD_total, manifest['IEAD_total'], rtol = _RTOL):
+                problems.append(
+                    f'IEAD total is {IEAD_total}, manifest says {manifest["IEAD_total"]}'
+                )
+
+    if not os.path.exists(input_filename):
+        problems.append(f'{input_filename} is missing')
+        return manifest_filename, problems
+
+    particles_sha256 = (
+        builder.get_file_hash(particle_filename) if os.path.exists(particle_filename) else None
+    )
+    unchanged = (
+        builder.get_file_hash(input_filename) == manifest['input_sha256']
+        and particles_sha256 == manifest['particles_sha256']
+    )
+    if not unchanged:
+        N = count_input_particles(input_filename)
+        if N != manifest['N']:
+            problems.append(f'input has {N} particles, manifest says {manifest["N"]}')
+        else:
+            problems.append('input changed since it was built (its particle count still matches)')
+
+    return manifest_filename, problems
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+
+    manifests = sorted(glob.glob(
+        f'rustbca_simulations/**/{builder.MANIFEST_FILENAME}',
+        recursive = True,
+    ))
+    print(f'verifying {len(manifests)} RustBCA inputs...')
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers = processes) as pool:
+        for manifest_filename, problems in pool.map(verify_manifest, manifests, chunksize = 8):
+            for problem in problems:
+                print(f'{manifest_filename}: {problem}')
+            failed += bool(problems)
+
+    if failed:
+        print(f'{failed} of {len(manifests)} inputs failed verification')
+        sys.exit(1)
     print('all particle counts make sense ✔')
 
 
-def get_IEAD_counts():
-    counts = {}
-    # ping down species names in a config file so we're never wondering what
-    # ion "sp4" is.
-    config = util.load_yaml(common._CONFIG_FILENAME)
-    ion_names = common.invert_ion_map(config['ions'])
-
-    for SimID in glob.glob('hpic_results/*'):
-        if SimID == 'hpic_results/p2c.csv':
-            continue
-
-
-        for IEADfile in glob.glob(SimID + '/*_IEAD_*.dat'):
-            # Get this species name
-            iead_label = re.search('IEAD_sp[0-9]{1,2}', IEADfile).group()
-            species_label = iead_label.split('_')[1]
-            ion_name = ion_names[species_label]
-
-            IEAD = np.genfromtxt(IEADfile, delimiter = ' ')
-            RustBCA_Simdir = 'rustbca_simulations/' + SimID.replace('hpic_results/', '') + ion_name + '/'
-            counts[RustBCA_Simdir] = np.sum(IEAD)
-
-    return counts
-
-
 if __name__ == '__main__':
-    verify_particle_counts()
+    main()
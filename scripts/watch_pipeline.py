@@ -0,0 +1,300 @@
+import os
+import sys
+import glob
+import time
+import subprocess
+import yaml
+import util
+import common
+import profiling
+import run_job
+import find_p2c_values
+from requeue_failed import pick_machine
+
+
+"""
+Start RustBCA work as each hPIC simulation comes back, instead of once all
+of them have: hPIC and RustBCA then run at the same time.
+
+Every --interval seconds, hpic_results/ is scanned for simulations that are
+ready: simulation-complete is newer than simulation-start (the same check
+as run_job.py) and at least one IEAD is there. On the hosts,
+
+    WATCH_SECONDS=300 ./send_results_to_mikhail.sh
+
+sends each simulation back as soon as it completes, simulation-complete
+last. Each ready simulation then goes through three steps:
+
+    p2c     its p2c value is read from hpic.log into hpic_results/p2c.csv
+    build   its RustBCA inputs are built for every SBE given, as
+            build_rustbca_input_files.py would, each for the machine with
+            the most RustBCA throughput per input already queued
+    send    the inputs are copied to their machine's DEST directory, where
+
+                WATCH_SECONDS=60 ./launcher.sh
+
+            runs each as soon as it arrives
+
+Every step is recorded in WATCH_STATE_FILE as soon as it's done, and the
+rustbca_conversion_factors/ files are rewritten from it, so the watcher can
+be stopped and started again at any time without redoing or duplicating
+work. A send that fails (e.g. the host is down) is tried again on the next
+scan.
+
+Once every simulation in machine_assignments.yaml has been sent, the
+watcher writes queue-closed into every machine's DEST directory, so the
+launchers exit after their last input, and exits. Simulations that failed
+(see requeue_failed.py) are waited for until they come back.
+
+    --interval=SECONDS  time between scans (default 60)
+    --once              scan once and exit
+    --no-send           build the inputs, but leave sending them to
+                        send_scripts_to_all_hosts.sh
+    --dest=DIR          RustBCA run directory on the hosts (default
+                        my-rustbca-sims)
+
+usage: python scripts/watch_pipeline.py (low|high|<SBE_eV>)... [--interval=SECONDS]
+           [--once] [--no-send] [--dest=DIR]
+"""
+
+WATCH_STATE_FILE = 'watch_state.yaml'
+
+# Written into the hosts' RustBCA run directories once every input is there
+QUEUE_CLOSED_FILENAME = 'queue-closed'
+
+_DEFAULT_INTERVAL = 60.0
+_DEFAULT_DEST = 'my-rustbca-sims'
+
+
+def load_state(filename = WATCH_STATE_FILE):
+    """
+    :returns: dictionary of SimID -> {'p2c': ..., 'inputs': {SBE label ->
+        {RustBCA SimID -> {'machine', 'factors', 'sent'}}}}
+    """
+    if not os.path.exists(filename):
+        return {}
+    return util.load_yaml(filename) or {}
+
+
+def save_state(state, filename = WATCH_STATE_FILE):
+    """
+    Written to a temporary file first, so an interrupted watcher never leaves
+    half a state file behind
+    """
+    with open(filename + '.tmp', 'w') as f:
+        yaml.dump(state, f)
+    os.replace(filename + '.tmp', filename)
+
+
+def is_ready(simdir):
+    """
+    A simulation is ready once it's complete and its IEADs are back
+    """
+    return run_job.is_complete(simdir) and bool(glob.glob(os.path.join(simdir, '*_IEAD_*.dat')))
+
+
+def is_done(entry, SBE_labels, send):
+    if 'p2c' not in entry:
+        return False
+    inputs = entry.get('inputs', {})
+    if any(label not in inputs for label in SBE_labels):
+        return False
+    return not send or all(i['sent'] for label in SBE_labels for i in inputs[label].values())
+
+
+def get_loads(state):
+    """
+    :returns: dictionary of machine -> number of inputs queued on it
+    """
+    loads = {}
+    for entry in state.values():
+        for inputs in entry.get('inputs', {}).values():
+            for i in inputs.values():
+                loads[i['machine']] = loads.get(i['machine'], 0) + 1
+    return loads
+
+
+def iter_least_loaded_machines(capacities, loads):
+    """
+    The machine with the most capacity per queued input, again and again,
+    counting each one it yields (see requeue_failed.pick_machine)
+    """
+    while True:
+        machine = pick_machine(capacities, loads, ())
+        loads[machine] = loads.get(machine, 0) + 1
+        yield machine
+
+
+def record_p2c(SimID, simdir, entry):
+    p2c = find_p2c_values.find_p2c_value(os.path.join(simdir, 'hpic.log'))
+    p2c_values = find_p2c_values.read_p2c_file()
+    p2c_values[SimID] = p2c
+    find_p2c_values.write_p2c_file(p2c_values)
+    entry['p2c'] = p2c
+
+
+def build_inputs(SimID, simdir, settings, machines):
+    """
+    Build the RustBCA inputs of one simulation for one SBE, after removing
+    any an interrupted build left behind
+
+    :returns: dictionary of RustBCA SimID -> {'machine', 'factors', 'sent'}
+    """
+    import build_rustbca_input_files as builder
+
+    output_dir = settings['output_dir']
+    for stale in glob.glob(f'{output_dir}/{settings["SBE_label"]}/{SimID}*/*-input.toml'):
+        os.remove(stale)
+
+    inputs = {}
+    for ion_name, RustBCA_SimID, machine_name, factor in builder.build_hpic_simulation_inputs(
+            simdir, settings, machines):
+        i = inputs.setdefault(RustBCA_SimID, {'machine': machine_name, 'factors': {}, 'sent': False})
+        i['factors'][ion_name] = float(factor)
+    return inputs
+
+
+def send_input(output_dir, RustBCA_SimID, machine, dest):
+    """
+    Copy an input (and its particles.h5) to its machine. Files are copied
+    under a temporary name and renamed once they're all there, so launcher.sh
+    never picks up a partial input.
+
+    :returns: True if it was sent
+    """
+    simdir = os.path.join(output_dir, RustBCA_SimID).rstrip('/')
+    files = glob.glob(f'{simdir}/particles.h5') + glob.glob(f'{simdir}/{machine}-input.toml')
+    remote_dir = os.path.join(dest, RustBCA_SimID).rstrip('/')
+    commands = [['ssh', machine, f'mkdir -p {remote_dir}']]
+    commands += [['scp', '-q', f, f'{machine}:{remote_dir}/{os.path.basename(f)}.part'] for f in files]
+    commands.append([
+        'ssh', machine,
+        ' && '.join(f'mv {remote_dir}/{os.path.basename(f)}.part {remote_dir}/{os.path.basename(f)}' for f in files),
+    ])
+    for command in commands:
+        if subprocess.run(command).returncode != 0:
+            print(f'could not send {simdir} to {machine} ("{" ".join(command)}" failed), trying again later')
+            return False
+    return True
+
+
+def write_conversion_factors(state):
+    """
+    rustbca_conversion_factors/<ion_name>.csv, from every input built so far
+    """
+    rows = {}
+    for SimID in sorted(state):
+        for inputs in state[SimID].get('inputs', {}).values():
+            for RustBCA_SimID, i in inputs.items():
+                for ion_name, factor in i['factors'].items():
+                    rows.setdefault(ion_name, []).append(f'{RustBCA_SimID},{factor}\n')
+    util.mkdir('rustbca_conversion_factors')
+    for ion_name, lines in rows.items():
+        with open(f'rustbca_conversion_factors/{ion_name}.csv', 'w') as f:
+            f.writelines(lines)
+
+
+def close_queues(state, dest):
+    machines = sorted(set(get_loads(state)))
+    for machine in machines:
+        subprocess.run(['ssh', machine, f'mkdir -p {dest} && touch {dest}/{QUEUE_CLOSED_FILENAME}'])
+    print(f'every simulation is queued, closed the queues of {", ".join(machines)}')
+
+
+def scan(state, all_settings, send, dest):
+    """
+    Take every ready simulation as far as it goes
+    """
+    SBE_labels = [settings['SBE_label'] for settings in all_settings]
+    any_settings = all_settings[0]
+    machines = iter_least_loaded_machines(any_settings['capacities'], get_loads(state))
+    for simdir in sorted(glob.glob('hpic_results/*')):
+        SimID = simdir.replace('hpic_results/', '')
+        if not os.path.isdir(simdir) or not is_ready(simdir):
+            continue
+        entry = state.setdefault(SimID, {})
+        if is_done(entry, SBE_labels, send):
+            continue
+
+        if 'p2c' not in entry:
+            with profiling.span('p2c', 'parse'):
+                record_p2c(SimID, simdir, entry)
+            save_state(state)
+
+        inputs = entry.setdefault('inputs', {})
+        for settings in all_settings:
+            if settings['SBE_label'] not in inputs:
+                with profiling.span('inputs', 'write'):
+                    inputs[settings['SBE_label']] = build_inputs(SimID, simdir, settings, machines)
+                save_state(state)
+                write_conversion_factors(state)
+
+            if not send:
+                continue
+            for RustBCA_SimID, i in inputs[settings['SBE_label']].items():
+                if not i['sent']:
+                    with profiling.span('send', 'write'):
+                        i['sent'] = send_input(settings['output_dir'], RustBCA_SimID, i['machine'], dest)
+                    save_state(state)
+
+        if is_done(entry, SBE_labels, send):
+            print(f'{SimID}: queued')
+
+
+@profiling.profiled('watch_pipeline')
+def main():
+    import build_rustbca_input_files as builder
+
+    usage = (
+        'usage: python scripts/watch_pipeline.py (low|high|<SBE_eV>)... [--interval=SECONDS] '
+        + '[--once] [--no-send] [--dest=DIR]'
+    )
+    energies = []
+    interval = _DEFAULT_INTERVAL
+    once = False
+    send = True
+    dest = _DEFAULT_DEST
+    for arg in sys.argv[1:]:
+        option, _, value = arg.partition('=')
+        if option == '--interval' and value:
+            interval = float(value)
+        elif arg == '--once':
+            once = True
+        elif arg == '--no-send':
+            send = False
+        elif option == '--dest' and value:
+            dest = value
+        elif builder.parse_surface_binding_energy(arg) is not None:
+            energies.append(builder.parse_surface_binding_energy(arg))
+        else:
+            print(usage)
+            sys.exit(1)
+    if not energies:
+        print(usage)
+        sys.exit(1)
+
+    config = util.load_yaml(common._CONFIG_FILENAME)
+    all_settings = [builder.get_build_settings(config, energy) for energy in energies]
+    util.mkdir(all_settings[0]['output_dir'])
+    SBE_labels = [settings['SBE_label'] for settings in all_settings]
+    assigned = [
+        SimID for SimIDs in util.load_yaml(common._MACHINE_ASSIGNMENTS_FILE).values() for SimID in SimIDs
+    ]
+
+    state = load_state()
+    while True:
+        scan(state, all_settings, send, dest)
+        remaining = [SimID for SimID in assigned if not is_done(state.get(SimID, {}), SBE_labels, send)]
+        if not remaining:
+            if send:
+                close_queues(state, dest)
+            print(f'all {len(assigned)} simulations are queued')
+            return
+        if once:
+            print(f'{len(assigned) - len(remaining)} of {len(assigned)} simulations queued')
+            return
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    main()